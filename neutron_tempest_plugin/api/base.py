@@ -13,8 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+from concurrent import futures
 import functools
+import itertools
 import math
+import operator
 import time
 
 import netaddr
@@ -26,6 +30,8 @@ from tempest.lib import exceptions as lib_exc
 from tempest import test
 
 from neutron_tempest_plugin.api import clients
+from neutron_tempest_plugin.common import cidr_allocator
+from neutron_tempest_plugin.common import cleanup
 from neutron_tempest_plugin.common import constants
 from neutron_tempest_plugin.common import utils
 from neutron_tempest_plugin import config
@@ -63,8 +69,9 @@ class BaseNetworkTest(test.BaseTestCase):
     # Default to ipv4.
     _ip_version = const.IP_VERSION_4
 
-    # Derive from BaseAdminNetworkTest class to have this initialized
+    # Derive from BaseAdminNetworkTest class to have these initialized
     admin_client = None
+    admin_async_client = None
 
     external_network_id = CONF.network.public_network_id
 
@@ -105,6 +112,7 @@ class BaseNetworkTest(test.BaseTestCase):
     def setup_clients(cls):
         super(BaseNetworkTest, cls).setup_clients()
         cls.client = cls.os_primary.network_client
+        cls.async_client = cls.os_primary.async_network_client
 
     @classmethod
     def resource_setup(cls):
@@ -133,6 +141,7 @@ class BaseNetworkTest(test.BaseTestCase):
         cls.projects = []
         cls.log_objects = []
         cls.reserved_subnet_cidrs = set()
+        cls.allocated_subnet_cidrs = collections.defaultdict(list)
         cls.keypairs = []
         cls.trunks = []
         cls.network_segment_ranges = []
@@ -140,119 +149,115 @@ class BaseNetworkTest(test.BaseTestCase):
     @classmethod
     def resource_cleanup(cls):
         if CONF.service_available.neutron:
-            # Clean up trunks
-            for trunk in cls.trunks:
-                cls._try_delete_resource(cls.delete_trunk, trunk)
-
-            # Clean up floating IPs
-            for floating_ip in cls.floating_ips:
-                cls._try_delete_resource(cls.delete_floatingip, floating_ip)
-
-            # Clean up routers
-            for router in cls.routers:
-                cls._try_delete_resource(cls.delete_router,
-                                         router)
-            # Clean up metering label rules
-            for metering_label_rule in cls.metering_label_rules:
-                cls._try_delete_resource(
-                    cls.admin_client.delete_metering_label_rule,
-                    metering_label_rule['id'])
-            # Clean up metering labels
-            for metering_label in cls.metering_labels:
-                cls._try_delete_resource(
-                    cls.admin_client.delete_metering_label,
-                    metering_label['id'])
-            # Clean up flavors
-            for flavor in cls.flavors:
-                cls._try_delete_resource(
-                    cls.admin_client.delete_flavor,
-                    flavor['id'])
-            # Clean up service profiles
-            for service_profile in cls.service_profiles:
-                cls._try_delete_resource(
-                    cls.admin_client.delete_service_profile,
-                    service_profile['id'])
-            # Clean up ports
-            for port in cls.ports:
-                cls._try_delete_resource(cls.client.delete_port,
-                                         port['id'])
-            # Clean up subnets
-            for subnet in cls.subnets:
-                cls._try_delete_resource(cls.client.delete_subnet,
-                                         subnet['id'])
-            # Clean up admin subnets
-            for subnet in cls.admin_subnets:
-                cls._try_delete_resource(cls.admin_client.delete_subnet,
-                                         subnet['id'])
-            # Clean up networks
-            for network in cls.networks:
-                cls._try_delete_resource(cls.delete_network, network)
-
-            # Clean up admin networks
-            for network in cls.admin_networks:
-                cls._try_delete_resource(cls.admin_client.delete_network,
-                                         network['id'])
-
-            # Clean up security groups
-            for security_group in cls.security_groups:
-                cls._try_delete_resource(cls.delete_security_group,
-                                         security_group)
-
-            # Clean up admin security groups
-            for security_group in cls.admin_security_groups:
-                cls._try_delete_resource(cls.delete_security_group,
-                                         security_group,
-                                         client=cls.admin_client)
-
-            for subnetpool in cls.subnetpools:
-                cls._try_delete_resource(cls.client.delete_subnetpool,
-                                         subnetpool['id'])
-
-            for subnetpool in cls.admin_subnetpools:
-                cls._try_delete_resource(cls.admin_client.delete_subnetpool,
-                                         subnetpool['id'])
-
-            for address_scope in cls.address_scopes:
-                cls._try_delete_resource(cls.client.delete_address_scope,
-                                         address_scope['id'])
-
-            for address_scope in cls.admin_address_scopes:
-                cls._try_delete_resource(
-                    cls.admin_client.delete_address_scope,
-                    address_scope['id'])
-
-            for project in cls.projects:
-                cls._try_delete_resource(
-                    cls.identity_admin_client.delete_project,
-                    project['id'])
-
-            # Clean up QoS rules
-            for qos_rule in cls.qos_rules:
-                cls._try_delete_resource(cls.admin_client.delete_qos_rule,
-                                         qos_rule['id'])
-            # Clean up QoS policies
-            # as all networks and ports are already removed, QoS policies
-            # shouldn't be "in use"
-            for qos_policy in cls.qos_policies:
-                cls._try_delete_resource(cls.admin_client.delete_qos_policy,
-                                         qos_policy['id'])
-
-            # Clean up log_objects
-            for log_object in cls.log_objects:
-                cls._try_delete_resource(cls.admin_client.delete_log,
-                                         log_object['id'])
-
-            for keypair in cls.keypairs:
-                cls._try_delete_resource(cls.delete_keypair, keypair)
-
-            # Clean up network_segment_ranges
-            for network_segment_range in cls.network_segment_ranges:
-                cls._try_delete_resource(
-                    cls.admin_client.delete_network_segment_range,
-                    network_segment_range['id'])
+            try:
+                cls.get_resource_cleanup().run()
+            finally:
+                cls.release_subnet_cidrs()
 
         super(BaseNetworkTest, cls).resource_cleanup()
 
+    @classmethod
+    def get_resource_cleanup(cls):
+        """Describes how to delete resources created by the test class
+
+        Every resource list is registered together with the resource lists
+        that have to be deleted before it. Resource lists that don't depend on
+        each other are deleted concurrently.
+
+        :returns: cleanup.ResourceCleanup instance
+        """
+
+        def by_resource(get_delete_callable, **kwargs):
+            # delete_callable is resolved at deletion time because admin
+            # clients are not available to all test classes
+            def delete(resource):
+                cls._try_delete_resource(get_delete_callable(), resource,
+                                         **kwargs)
+            return delete
+
+        def by_id(get_delete_callable):
+            def delete(resource):
+                cls._try_delete_resource(get_delete_callable(),
+                                         resource['id'])
+            return delete
+
+        resource_cleanup = cleanup.ResourceCleanup(
+            max_workers=CONF.neutron_plugin_options.max_concurrent_requests)
+
+        def add(name, resources, delete, after=None, key='id'):
+            resource_cleanup.add(name, resources, delete, after=after,
+                                 key=operator.itemgetter(key))
+
+        add('trunks', cls.trunks, by_resource(lambda: cls.delete_trunk))
+        add('floating_ips', cls.floating_ips,
+            by_resource(lambda: cls.delete_floatingip))
+        add('routers', cls.routers, by_resource(lambda: cls.delete_router),
+            after=['floating_ips'])
+        add('metering_label_rules', cls.metering_label_rules,
+            by_id(lambda: cls.admin_client.delete_metering_label_rule))
+        add('metering_labels', cls.metering_labels,
+            by_id(lambda: cls.admin_client.delete_metering_label),
+            after=['metering_label_rules'])
+        add('flavors', cls.flavors,
+            by_id(lambda: cls.admin_client.delete_flavor),
+            after=['routers'])
+        add('service_profiles', cls.service_profiles,
+            by_id(lambda: cls.admin_client.delete_service_profile),
+            after=['flavors'])
+        add('ports', cls.ports, by_id(lambda: cls.client.delete_port),
+            after=['trunks', 'floating_ips', 'routers'])
+        add('subnets', cls.subnets, by_id(lambda: cls.client.delete_subnet),
+            after=['ports', 'routers'])
+        add('admin_subnets', cls.admin_subnets,
+            by_id(lambda: cls.admin_client.delete_subnet),
+            after=['ports', 'routers'])
+        add('networks', cls.networks,
+            by_resource(lambda: cls.delete_network),
+            after=['subnets', 'admin_subnets'])
+        add('admin_networks', cls.admin_networks,
+            by_id(lambda: cls.admin_client.delete_network),
+            after=['subnets', 'admin_subnets'])
+        add('security_groups', cls.security_groups,
+            by_resource(lambda: cls.delete_security_group),
+            after=['ports'])
+        add('admin_security_groups', cls.admin_security_groups,
+            by_resource(lambda: cls.delete_security_group,
+                        client=cls.admin_client),
+            after=['ports'])
+        add('subnetpools', cls.subnetpools,
+            by_id(lambda: cls.client.delete_subnetpool),
+            after=['subnets', 'admin_subnets'])
+        add('admin_subnetpools', cls.admin_subnetpools,
+            by_id(lambda: cls.admin_client.delete_subnetpool),
+            after=['subnets', 'admin_subnets'])
+        add('address_scopes', cls.address_scopes,
+            by_id(lambda: cls.client.delete_address_scope),
+            after=['subnetpools', 'admin_subnetpools'])
+        add('admin_address_scopes', cls.admin_address_scopes,
+            by_id(lambda: cls.admin_client.delete_address_scope),
+            after=['subnetpools', 'admin_subnetpools'])
+        add('projects', cls.projects,
+            by_id(lambda: cls.identity_admin_client.delete_project),
+            after=['security_groups', 'admin_security_groups', 'networks',
+                   'admin_networks', 'address_scopes',
+                   'admin_address_scopes'])
+        add('qos_rules', cls.qos_rules,
+            by_id(lambda: cls.admin_client.delete_qos_rule))
+        # as all networks and ports are already removed, QoS policies
+        # shouldn't be "in use"
+        add('qos_policies', cls.qos_policies,
+            by_id(lambda: cls.admin_client.delete_qos_policy),
+            after=['qos_rules', 'ports', 'networks', 'admin_networks'])
+        add('log_objects', cls.log_objects,
+            by_id(lambda: cls.admin_client.delete_log),
+            after=['security_groups', 'admin_security_groups'])
+        add('keypairs', cls.keypairs, by_resource(lambda: cls.delete_keypair),
+            key='name')
+        add('network_segment_ranges', cls.network_segment_ranges,
+            by_id(lambda: cls.admin_client.delete_network_segment_range),
+            after=['networks', 'admin_networks'])
+        return resource_cleanup
+
     @classmethod
     def _try_delete_resource(cls, delete_callable, *args, **kwargs):
         """Cleanup resources in case of test-failure
@@ -524,6 +529,7 @@ class BaseNetworkTest(test.BaseTestCase):
         [1] http://netaddr.readthedocs.io/en/latest/tutorial_01.html#supernets-and-subnets  # noqa
         """
 
+        allocator = None
         if cidr:
             # Generate subnet CIDRs starting from given CIDR
             # checking it is of requested IP version
@@ -532,19 +538,29 @@ class BaseNetworkTest(test.BaseTestCase):
             # Generate subnet CIDRs starting from configured values
             ip_version = ip_version or cls._ip_version
             if ip_version == const.IP_VERSION_4:
-                mask_bits = mask_bits or config.safe_get_config_value(
+                default_mask_bits = config.safe_get_config_value(
                     'network', 'project_network_mask_bits')
+                mask_bits = mask_bits or default_mask_bits
                 cidr = netaddr.IPNetwork(config.safe_get_config_value(
                     'network', 'project_network_cidr'))
             elif ip_version == const.IP_VERSION_6:
-                mask_bits = config.safe_get_config_value(
+                mask_bits = default_mask_bits = config.safe_get_config_value(
                     'network', 'project_network_v6_mask_bits')
                 cidr = netaddr.IPNetwork(config.safe_get_config_value(
                     'network', 'project_network_v6_cidr'))
             else:
                 raise ValueError('Invalid IP version: {!r}'.format(ip_version))
 
-        if mask_bits:
+            if (CONF.neutron_plugin_options.shared_subnet_cidr_allocator and
+                    mask_bits and mask_bits == default_mask_bits):
+                # Coordinate with other test workers to get CIDRs nobody
+                # else is using
+                allocator = cidr_allocator.get_subnet_cidr_allocator(
+                    cidr=cidr, mask_bits=mask_bits)
+
+        if allocator:
+            subnet_cidrs = cls._allocate_subnet_cidrs(allocator)
+        elif mask_bits:
             subnet_cidrs = cidr.subnet(mask_bits)
         else:
             subnet_cidrs = iter([cidr])
@@ -553,6 +569,28 @@ class BaseNetworkTest(test.BaseTestCase):
             if subnet_cidr not in cls.reserved_subnet_cidrs:
                 yield subnet_cidr
 
+    @classmethod
+    def _allocate_subnet_cidrs(cls, allocator):
+        while True:
+            subnet_cidr = allocator.allocate()
+            if subnet_cidr is None:
+                return
+            # CIDRs are kept allocated until the end of the test class, even
+            # when they are rejected by the server because they overlap with
+            # some other subnet, so that other workers won't try them.
+            cls.allocated_subnet_cidrs[allocator].append(subnet_cidr)
+            yield subnet_cidr
+
+    @classmethod
+    def release_subnet_cidrs(cls):
+        """Releases CIDRs allocated by get_subnet_cidrs to other workers"""
+        allocated_subnet_cidrs = getattr(cls, 'allocated_subnet_cidrs', {})
+        for allocator, subnet_cidrs in allocated_subnet_cidrs.items():
+            allocator.release(subnet_cidrs)
+            LOG.debug("Subnet CIDRs usage after releasing: %r",
+                      allocator.get_usage())
+        allocated_subnet_cidrs.clear()
+
     @classmethod
     def create_port(cls, network, **kwargs):
         """Wrapper utility that returns a test port."""
@@ -564,6 +602,33 @@ class BaseNetworkTest(test.BaseTestCase):
         cls.ports.append(port)
         return port
 
+    @classmethod
+    def create_ports(cls, network, count, **kwargs):
+        """Wrapper utility that creates many test ports concurrently
+
+        :param network: network where to create the ports
+        network['id'] must contain the ID of the network
+
+        :param count: number of ports to create
+
+        :param **kwargs: extra parameters to be forwarded to network service
+        for every port
+
+        :returns: list of created ports
+        """
+        if CONF.network.port_vnic_type and 'binding:vnic_type' not in kwargs:
+            kwargs['binding:vnic_type'] = CONF.network.port_vnic_type
+        requests = [cls.async_client.create_port(network_id=network['id'],
+                                                 **kwargs)
+                    for _ in range(count)]
+        futures.wait(requests)
+        # Schedule all created ports for cleanup even if some creation failed
+        cls.ports.extend(request.result()['port']
+                         for request in requests
+                         if request.exception() is None)
+        return [body['port']
+                for body in utils.gather(requests)]
+
     @classmethod
     def update_port(cls, port, **kwargs):
         """Wrapper utility that updates a test port."""
@@ -896,6 +961,7 @@ class BaseAdminNetworkTest(BaseNetworkTest):
     def setup_clients(cls):
         super(BaseAdminNetworkTest, cls).setup_clients()
         cls.admin_client = cls.os_admin.network_client
+        cls.admin_async_client = cls.os_admin.async_network_client
         cls.identity_admin_client = cls.os_admin.projects_client
 
     @classmethod
@@ -977,41 +1043,67 @@ class BaseAdminNetworkTest(BaseNetworkTest):
     @classmethod
     def get_unused_ip(cls, net_id, ip_version=None):
         """Get an unused ip address in a allocation pool of net"""
-        body = cls.admin_client.list_ports(network_id=net_id)
-        ports = body['ports']
-        used_ips = []
-        for port in ports:
-            used_ips.extend(
-                [fixed_ip['ip_address'] for fixed_ip in port['fixed_ips']])
-        body = cls.admin_client.list_subnets(network_id=net_id)
-        subnets = body['subnets']
+        return cls.get_unused_ips(net_id, count=1, ip_version=ip_version)[0]
+
+    @classmethod
+    def get_unused_ips(cls, net_id, count, ip_version=None):
+        """Get unused ip addresses in allocation pools of net
+
+        Free addresses are computed as the set of addresses of allocation
+        pools minus the set of addresses already assigned to network ports.
+        Only required fields of ports and subnets are fetched from the
+        server.
+
+        :param net_id: ID of the network where to look for addresses
+
+        :param count: number of addresses to be returned
 
+        :param ip_version: when given only addresses of this IP version are
+        returned
+
+        :returns: list of count ip address strings
+        """
+        body = cls.admin_client.list_ports(network_id=net_id,
+                                           fields=['fixed_ips'])
+        used_ips = netaddr.IPSet(fixed_ip['ip_address']
+                                 for port in body['ports']
+                                 for fixed_ip in port['fixed_ips'])
+
+        subnet_filters = {'network_id': net_id,
+                          'fields': ['ip_version', 'cidr',
+                                     'allocation_pools']}
+        if ip_version:
+            subnet_filters['ip_version'] = ip_version
+        subnets = cls.admin_client.list_subnets(**subnet_filters)['subnets']
+
+        unused_ips = []
         for subnet in subnets:
             if ip_version and subnet['ip_version'] != ip_version:
                 continue
-            cidr = subnet['cidr']
             allocation_pools = subnet['allocation_pools']
-            iterators = []
             if allocation_pools:
+                available_ips = netaddr.IPSet()
                 for allocation_pool in allocation_pools:
-                    iterators.append(netaddr.iter_iprange(
+                    available_ips.add(netaddr.IPRange(
                         allocation_pool['start'], allocation_pool['end']))
             else:
-                net = netaddr.IPNetwork(cidr)
-
-                def _iterip():
-                    for ip in net:
-                        if ip not in (net.network, net.broadcast):
-                            yield ip
-                iterators.append(iter(_iterip()))
-
-            for iterator in iterators:
-                for ip in iterator:
-                    if str(ip) not in used_ips:
-                        return str(ip)
+                net = netaddr.IPNetwork(subnet['cidr'])
+                available_ips = netaddr.IPSet(net)
+                for ip in (net.network, net.broadcast):
+                    if ip is not None:
+                        available_ips.remove(ip)
+
+            available_ips -= used_ips
+            unused_ips.extend(
+                str(ip)
+                for ip in itertools.islice(available_ips,
+                                           count - len(unused_ips)))
+            if len(unused_ips) >= count:
+                return unused_ips
 
         message = (
-            "net(%s) has no usable IP address in allocation pools" % net_id)
+            "net(%s) has no %d usable IP addresses in allocation pools" % (
+                net_id, count))
         raise exceptions.InvalidConfiguration(message)
 
     @classmethod
@@ -1110,9 +1202,8 @@ class BaseSearchCriteriaTest(BaseNetworkTest):
         return method(*args, **kwargs)
 
     def get_bare_url(self, url):
-        base_url = self.client.base_url
-        self.assertTrue(url.startswith(base_url))
-        return url[len(base_url):]
+        self.assertTrue(url.startswith(self.client.base_url))
+        return self.client.get_bare_uri(url)
 
     @classmethod
     def _extract_resources(cls, body):
@@ -1244,6 +1335,20 @@ class BaseSearchCriteriaTest(BaseNetworkTest):
     def _test_list_pagination_with_href_links(self):
         self._test_list_pagination_iteratively(self._list_all_with_hrefs)
 
+    def _list_all_with_iterator(self, niterations, sort_args):
+        # walk all resources one page at a time following next href links,
+        # fetching next page in background
+        list_args = dict(sort_args, **self.list_kwargs)
+        iter_method = getattr(self.list_client, 'iter_%s' % self.plural_name)
+        resources = list(iter_method(page_size=1, prefetch=True, **list_args))
+        self.assertEqual(niterations, len(resources))
+        return resources
+
+    @_require_pagination
+    @_require_sorting
+    def _test_list_pagination_with_iterator(self):
+        self._test_list_pagination_iteratively(self._list_all_with_iterator)
+
     @_require_pagination
     @_require_sorting
     def _test_list_pagination_page_reverse_with_href_links(
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from tempest.lib.common import rest_client
 from tempest.lib.services.compute import availability_zone_client
 from tempest.lib.services.compute import hypervisor_client
 from tempest.lib.services.compute import interfaces_client
@@ -22,6 +23,7 @@ from tempest.lib.services.identity.v2 import tenants_client
 from tempest.lib.services.identity.v3 import projects_client
 from tempest import manager
 
+from neutron_tempest_plugin.common import http_pool
 from neutron_tempest_plugin import config
 from neutron_tempest_plugin.services.network.json import network_client
 
@@ -59,6 +61,9 @@ class Manager(manager.Manager):
             build_interval=CONF.network.build_interval,
             build_timeout=CONF.network.build_timeout,
             **self.default_params)
+        self.async_network_client = network_client.AsyncNetworkClient(
+            self.network_client,
+            max_workers=CONF.neutron_plugin_options.max_concurrent_requests)
 
         params = {
             'service': CONF.compute.catalog_type,
@@ -83,6 +88,9 @@ class Manager(manager.Manager):
         self.az_client = availability_zone_client.AvailabilityZoneClient(
             self.auth_provider, **params)
 
+        if CONF.neutron_plugin_options.http_keep_alive:
+            self._set_http_pool()
+
     def _set_identity_clients(self):
         params = {
             'service': CONF.identity.catalog_type,
@@ -97,3 +105,16 @@ class Manager(manager.Manager):
         # Client uses admin endpoint type of Keystone API v3
         self.projects_client = projects_client.ProjectsClient(
             self.auth_provider, **params_v2_admin)
+
+    def _set_http_pool(self):
+        """Makes all REST clients share the same keep-alive connections"""
+        self.http_pool = http_pool.create_http_pool(
+            proxy_url=self.default_params['proxy_url'],
+            disable_ssl_certificate_validation=self.default_params[
+                'disable_ssl_certificate_validation'],
+            ca_certs=self.default_params['ca_certs'],
+            maxsize=CONF.neutron_plugin_options.http_pool_maxsize,
+            idle_timeout=CONF.neutron_plugin_options.http_pool_idle_timeout)
+        for client in vars(self).values():
+            if isinstance(client, rest_client.RestClient):
+                client.http_obj = self.http_pool
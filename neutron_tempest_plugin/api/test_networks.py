@@ -193,6 +193,10 @@ class NetworksSearchCriteriaTest(base.BaseSearchCriteriaTest):
     def test_list_pagination_with_href_links(self):
         self._test_list_pagination_with_href_links()
 
+    @decorators.idempotent_id('d7602288-728c-4cc4-bf92-bd14b2bdba4e')
+    def test_list_pagination_with_iterator(self):
+        self._test_list_pagination_with_iterator()
+
     @decorators.idempotent_id('79a52810-2156-4ab6-b577-9e46e58d4b58')
     def test_list_pagination_page_reverse_asc(self):
         self._test_list_pagination_page_reverse_asc()
@@ -188,6 +188,10 @@ class PortsSearchCriteriaTest(base.BaseSearchCriteriaTest):
     def test_list_pagination_with_href_links(self):
         self._test_list_pagination_with_href_links()
 
+    @decorators.idempotent_id('24eb3b18-6454-4fd3-8156-ef8081b205eb')
+    def test_list_pagination_with_iterator(self):
+        self._test_list_pagination_with_iterator()
+
     @decorators.idempotent_id('3afe7024-77ab-4cfe-824b-0b2bf4217727')
     def test_list_no_pagination_limit_0(self):
         self._test_list_no_pagination_limit_0()
@@ -0,0 +1,253 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import math
+import socket
+import time
+
+from oslo_log import log
+
+
+LOG = log.getLogger(__name__)
+
+# Size of the buffer data is received into
+BUFFER_SIZE = 1024 * 1024
+
+# Seconds covered by every throughput sample
+SAMPLE_INTERVAL = .5
+
+# Seconds of transfer discarded at the beginning of a measurement (ie. TCP
+# slow start and QoS burst)
+WARMUP_TIME = 1.
+
+# Quantile of the standard normal distribution used for 95% confidence
+# intervals
+_Z_95 = 1.96
+
+
+class BandwidthSample(collections.namedtuple(
+        'BandwidthSample', ['start', 'duration', 'size'])):
+    """Bytes received during a time window
+
+    :param start: seconds elapsed from the beginning of the measurement to
+    the beginning of the window
+
+    :param duration: window duration in seconds
+
+    :param size: number of bytes received during the window
+    """
+
+    @property
+    def rate(self):
+        """Bytes per second received during the window"""
+        if self.duration <= 0.:
+            return 0.
+        return self.size / self.duration
+
+
+class BandwidthMeasurement(object):
+    """Throughput of a data transfer sampled over time windows
+
+    Steady-state figures are computed from samples beginning after warmup
+    seconds, or from all samples when the transfer was shorter than that.
+
+    :param samples: sequence of BandwidthSample
+
+    :param warmup: seconds of transfer excluded from steady-state figures
+
+    :param start_time: time (as returned by time.time on the receiving host)
+    sample start times are relative to
+    """
+
+    def __init__(self, samples, warmup=WARMUP_TIME, start_time=None):
+        self.samples = list(samples)
+        self.warmup = warmup
+        self.start_time = start_time
+
+    @property
+    def size(self):
+        """Total number of bytes received"""
+        return sum(sample.size for sample in self.samples)
+
+    @property
+    def duration(self):
+        """Total transfer time in seconds"""
+        return sum(sample.duration for sample in self.samples)
+
+    @property
+    def average_rate(self):
+        """Bytes per second received over the whole transfer"""
+        duration = self.duration
+        return self.size / duration if duration > 0. else 0.
+
+    @property
+    def steady_samples(self):
+        samples = [sample for sample in self.samples
+                   if sample.start >= self.warmup]
+        return samples or self.samples
+
+    @property
+    def rate(self):
+        """Bytes per second received after warmup"""
+        samples = self.steady_samples
+        duration = sum(sample.duration for sample in samples)
+        if duration <= 0.:
+            return 0.
+        return sum(sample.size for sample in samples) / duration
+
+    def percentile(self, percent):
+        """Steady-state sample rate below which percent of samples fall"""
+        rates = sorted(sample.rate for sample in self.steady_samples)
+        if not rates:
+            return 0.
+        position = (len(rates) - 1) * percent / 100.
+        lower = int(math.floor(position))
+        upper = min(lower + 1, len(rates) - 1)
+        return rates[lower] + (rates[upper] - rates[lower]) * (
+            position - lower)
+
+    @property
+    def median(self):
+        return self.percentile(50)
+
+    def find_rate_change(self, since, min_rate, max_rate, settle_samples=2):
+        """Finds when the rate entered a band after given time
+
+        The rate is considered in the band from the beginning of the first
+        of settle_samples consecutive samples whose rate is between min_rate
+        and max_rate, so that a single noisy sample is not taken for it.
+
+        :param since: seconds from the beginning of the measurement (ie. the
+        time a QoS policy was changed)
+
+        :returns: seconds elapsed from since to the rate entering the band,
+        or None when it never did
+        """
+        samples = [sample for sample in self.samples
+                   if sample.start + sample.duration > since]
+        in_band = 0
+        for index, sample in enumerate(samples):
+            if min_rate <= sample.rate <= max_rate:
+                in_band += 1
+                if in_band >= settle_samples:
+                    first = samples[index - in_band + 1]
+                    return max(0., first.start - since)
+            else:
+                in_band = 0
+        return None
+
+    @property
+    def confidence(self):
+        """Relative half width of the 95% confidence interval of rate
+
+        For example 0.1 means the steady-state rate is known within +/-10%.
+        It is None when there are not enough samples to estimate it.
+        """
+        rates = [sample.rate for sample in self.steady_samples]
+        if len(rates) < 2:
+            return None
+        mean = sum(rates) / len(rates)
+        if mean <= 0.:
+            return None
+        variance = sum((rate - mean) ** 2 for rate in rates) / (
+            len(rates) - 1)
+        return _Z_95 * math.sqrt(variance / len(rates)) / mean
+
+    def __str__(self):
+        confidence = self.confidence
+        return ('{:d} bytes in {:.3f} s: rate={:.0f} B/s (+/-{!s}), '
+                'average={:.0f} B/s, p10={:.0f} B/s, p50={:.0f} B/s, '
+                'p90={:.0f} B/s, samples={:d}').format(
+                    self.size, self.duration, self.rate,
+                    'n/a' if confidence is None else '{:.1%}'.format(
+                        confidence),
+                    self.average_rate, self.percentile(10), self.median,
+                    self.percentile(90), len(self.samples))
+
+
+def receive(sock, max_size=None, timeout=None, buffer_size=BUFFER_SIZE,
+            sample_interval=SAMPLE_INTERVAL, warmup=WARMUP_TIME,
+            started=None):
+    """Receives data from a connected socket measuring throughput
+
+    Data is received into a single preallocated buffer and then discarded.
+
+    :param sock: connected stream socket
+
+    :param max_size: stop after receiving this number of bytes. By default
+    it receives until the connection is closed by peer.
+
+    :param timeout: max number of seconds to receive data for
+
+    :param buffer_size: max number of bytes received with a single call
+
+    :param sample_interval: duration in seconds of throughput samples
+
+    :param warmup: seconds of transfer excluded from steady-state figures
+
+    :param started: threading.Event set when the first data are received
+
+    :returns: BandwidthMeasurement instance
+    """
+    view = memoryview(bytearray(buffer_size))
+    samples = []
+    start = time.time()
+    end_of_time = timeout and start + timeout
+    window_start = start
+    window_size = total_size = 0
+    while True:
+        if end_of_time:
+            remaining = end_of_time - time.time()
+            if remaining <= 0.:
+                LOG.debug("Timeout receiving data (timeout=%s)", timeout)
+                break
+            sock.settimeout(remaining)
+        if max_size:
+            size = min(buffer_size, max_size - total_size)
+        else:
+            size = buffer_size
+        try:
+            received = sock.recv_into(view, size)
+        except socket.timeout:
+            LOG.debug("Timeout receiving data (timeout=%s)", timeout)
+            break
+        now = time.time()
+        if started is not None and received:
+            started.set()
+        if now - window_start >= sample_interval:
+            samples.append(BandwidthSample(start=window_start - start,
+                                           duration=now - window_start,
+                                           size=window_size + received))
+            window_start = now
+            window_size = 0
+        else:
+            window_size += received
+        total_size += received
+        if not received or (max_size and total_size >= max_size):
+            break
+
+    duration = time.time() - window_start
+    if samples and duration < sample_interval / 2.:
+        # Merge last short window into previous sample to avoid a noisy one
+        last = samples.pop()
+        samples.append(last._replace(duration=last.duration + duration,
+                                     size=last.size + window_size))
+    elif window_size or not samples:
+        samples.append(BandwidthSample(start=window_start - start,
+                                       duration=duration, size=window_size))
+    measurement = BandwidthMeasurement(samples, warmup=warmup,
+                                       start_time=start)
+    LOG.debug("Bandwidth measured: %s", measurement)
+    return measurement
@@ -0,0 +1,142 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import tempfile
+
+from neutron_tempest_plugin import config
+
+
+CONF = config.CONF
+
+
+class OutputBuffer(object):
+    """Collects the output stream of a command
+
+    Data is appended to an in-memory buffer until it reaches max_memory_size
+    bytes: after that all data is moved to an anonymous temporary file so
+    that very big outputs don't fill up test runner memory. Collected data is
+    decoded to text only when it is asked for. The temporary file is deleted
+    as soon as the buffer is garbage collected.
+
+    :param max_memory_size: max number of bytes to keep in memory. By
+    default it uses command_output_max_memory_size option.
+
+    :param line_callback: callable receiving every line of text (without line
+    terminator) as soon as it has been received
+
+    :param encoding: encoding used to decode output to text
+    """
+
+    def __init__(self, max_memory_size=None, line_callback=None,
+                 encoding='utf-8'):
+        if max_memory_size is None:
+            max_memory_size = (
+                CONF.neutron_plugin_options.command_output_max_memory_size)
+        self.max_memory_size = max_memory_size
+        self.line_callback = line_callback
+        self.encoding = encoding
+        self._buffer = bytearray()
+        self._file = None
+        self._size = 0
+        self._line = bytearray()
+        self._text = None
+
+    def __len__(self):
+        return self._size
+
+    def __str__(self):
+        return self.decode()
+
+    @property
+    def spilled(self):
+        """True when output has been moved to a temporary file"""
+        return self._file is not None
+
+    def write(self, data):
+        if not data:
+            return
+
+        self._text = None
+        self._size += len(data)
+        if self._file is None:
+            if len(self._buffer) + len(data) <= self.max_memory_size:
+                self._buffer += data
+            else:
+                self._file = tempfile.TemporaryFile()
+                self._file.write(self._buffer)
+                self._file.write(data)
+                self._buffer = bytearray()
+        else:
+            self._file.write(data)
+
+        if self.line_callback:
+            self._line += data
+            if b'\n' in data:
+                lines = self._line.split(b'\n')
+                self._line = lines.pop()
+                for line in lines:
+                    self._call_line_callback(line)
+            if len(self._line) > self.max_memory_size:
+                # Don't keep huge lines in memory
+                self._call_line_callback(self._line)
+                self._line = bytearray()
+
+    def flush(self):
+        """Passes last line to line_callback even if it is not terminated"""
+        if self._line:
+            self._call_line_callback(self._line)
+            self._line = bytearray()
+
+    def getvalue(self):
+        """Returns all collected data as bytes"""
+        if self._file is None:
+            return bytes(self._buffer)
+        self._file.seek(0)
+        try:
+            return self._file.read()
+        finally:
+            self._file.seek(0, 2)
+
+    def decode(self):
+        """Returns all collected data as text with normalized line ends"""
+        if self._text is None:
+            self._text = decode_output(self.getvalue(), self.encoding)
+        return self._text
+
+    def head(self, size):
+        """Returns at most first size bytes of collected data as text
+
+        It is intended for logging big outputs without reading all of them.
+        """
+        if self._file is None:
+            data = bytes(self._buffer[:size])
+        else:
+            self._file.seek(0)
+            try:
+                data = self._file.read(size)
+            finally:
+                self._file.seek(0, 2)
+        text = decode_output(data, self.encoding, errors='replace')
+        if self._size > size:
+            text += '\n... ({:d} more bytes)'.format(self._size - size)
+        return text
+
+    def _call_line_callback(self, line):
+        self.line_callback(decode_output(bytes(line).rstrip(b'\r'),
+                                         self.encoding))
+
+
+def decode_output(data, encoding='utf-8', errors='strict'):
+    return data.decode(encoding, errors).replace("\r\n", "\n").replace(
+        "\r", "\n")
@@ -0,0 +1,208 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import errno
+import os
+import threading
+
+import netaddr
+from oslo_concurrency import lockutils
+from oslo_log import log
+from oslo_serialization import jsonutils
+
+from neutron_tempest_plugin import config
+
+
+CONF = config.CONF
+LOG = log.getLogger(__name__)
+
+LOCK_FILE_PREFIX = 'tempest-'
+
+# Bigger pools are truncated to keep allocation state small
+MAX_SUBNETS = 2 ** 16
+
+
+class SubnetCidrAllocatorUsage(collections.namedtuple(
+        'SubnetCidrAllocatorUsage', ['cidr', 'mask_bits', 'allocated',
+                                     'size'])):
+
+    @property
+    def ratio(self):
+        return float(self.allocated) / self.size
+
+
+class SubnetCidrAllocator(object):
+    """Allocates subnet CIDRs from a pool shared between worker processes
+
+    Subnet CIDRs of given prefix length are obtained splitting the pool CIDR.
+    Allocated subnet CIDRs are recorded in a state file together with the PID
+    of the owner process. The state file is accessed holding an inter-process
+    lock so that the same CIDR is never handed out twice to test workers
+    running at the same time. CIDRs owned by terminated processes are
+    considered free again.
+
+    :param cidr: the CIDR of the pool to allocate subnet CIDRs from
+
+    :param mask_bits: prefix length of allocated subnet CIDRs
+
+    :param lock_path: directory where to store lock and state files. By
+    default it uses oslo_concurrency lock_path option.
+    """
+
+    def __init__(self, cidr, mask_bits, lock_path=None):
+        self.cidr = netaddr.IPNetwork(cidr).cidr
+        self.mask_bits = int(mask_bits)
+        if self.mask_bits < self.cidr.prefixlen:
+            message = ("Subnet prefix length {!r} is shorter than pool "
+                       "prefix length of {!s}").format(self.mask_bits,
+                                                       self.cidr)
+            raise ValueError(message)
+        self.size = min(2 ** (self.mask_bits - self.cidr.prefixlen),
+                        MAX_SUBNETS)
+        self._step = self.cidr.size >> (self.mask_bits - self.cidr.prefixlen)
+        self.lock_path = lock_path or CONF.oslo_concurrency.lock_path
+        self.name = 'subnet-cidrs-{!s}-{!s}-{:d}'.format(
+            self.cidr.ip, self.cidr.prefixlen, self.mask_bits).replace(
+                ':', '_')
+        self.state_file = os.path.join(self.lock_path,
+                                       LOCK_FILE_PREFIX + self.name + '.json')
+
+    def get_subnet_cidr(self, index):
+        address = netaddr.IPAddress(self.cidr.first + index * self._step,
+                                    version=self.cidr.version)
+        return netaddr.IPNetwork('{!s}/{:d}'.format(address, self.mask_bits))
+
+    def get_index(self, subnet_cidr):
+        subnet_cidr = netaddr.IPNetwork(subnet_cidr)
+        if (subnet_cidr.prefixlen != self.mask_bits or
+                subnet_cidr not in self.cidr):
+            message = "{!s} is not a subnet CIDR of {!s}/{:d}".format(
+                subnet_cidr, self.cidr, self.mask_bits)
+            raise ValueError(message)
+        return (subnet_cidr.first - self.cidr.first) // self._step
+
+    def allocate(self):
+        """Allocates a subnet CIDR nobody else is using
+
+        :returns: netaddr.IPNetwork instance or None when all subnet CIDRs
+        are allocated.
+        """
+        pid = os.getpid()
+        with self._lock():
+            state = self._read_state()
+            owners = state['owners']
+            start = state['next']
+            for offset in range(self.size):
+                index = (start + offset) % self.size
+                owner = owners.get(index)
+                if owner is None or not _is_process_alive(owner):
+                    owners[index] = pid
+                    state['next'] = (index + 1) % self.size
+                    self._write_state(state)
+                    break
+            else:
+                LOG.warning("All %d subnet CIDRs of %s/%d are allocated",
+                            self.size, self.cidr, self.mask_bits)
+                return None
+
+        subnet_cidr = self.get_subnet_cidr(index)
+        LOG.debug("Subnet CIDR %s allocated (%d/%d subnet CIDRs in use)",
+                  subnet_cidr, len(owners), self.size)
+        return subnet_cidr
+
+    def release(self, subnet_cidrs):
+        """Makes given subnet CIDRs available again
+
+        :param subnet_cidrs: sequence of subnet CIDRs previously returned by
+        allocate method.
+        """
+        indexes = [self.get_index(subnet_cidr)
+                   for subnet_cidr in subnet_cidrs]
+        if not indexes:
+            return
+
+        pid = os.getpid()
+        with self._lock():
+            state = self._read_state()
+            owners = state['owners']
+            for index in indexes:
+                if owners.get(index) == pid:
+                    del owners[index]
+            self._write_state(state)
+        LOG.debug("%d subnet CIDRs of %s/%d released", len(indexes),
+                  self.cidr, self.mask_bits)
+
+    def get_usage(self):
+        """Reports how many subnet CIDRs are currently allocated
+
+        :returns: SubnetCidrAllocatorUsage instance
+        """
+        with self._lock():
+            owners = self._read_state()['owners']
+        allocated = sum(1 for owner in owners.values()
+                        if _is_process_alive(owner))
+        return SubnetCidrAllocatorUsage(cidr=self.cidr,
+                                        mask_bits=self.mask_bits,
+                                        allocated=allocated, size=self.size)
+
+    def _lock(self):
+        return lockutils.lock(self.name, lock_file_prefix=LOCK_FILE_PREFIX,
+                              external=True, lock_path=self.lock_path)
+
+    def _read_state(self):
+        try:
+            with open(self.state_file) as fd:
+                state = jsonutils.loads(fd.read())
+            return {'next': int(state['next']),
+                    'owners': {int(index): int(pid)
+                               for index, pid in state['owners'].items()}}
+        except (IOError, OSError) as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+        except (ValueError, KeyError, TypeError, AttributeError):
+            LOG.warning("Invalid subnet CIDRs allocation state file %r: "
+                        "resetting it", self.state_file)
+        return {'next': 0, 'owners': {}}
+
+    def _write_state(self, state):
+        # Write to a temporary file first so that a failure can't leave a
+        # truncated state file behind
+        temp_file = '{!s}.{:d}'.format(self.state_file, os.getpid())
+        with open(temp_file, 'w') as fd:
+            fd.write(jsonutils.dumps(state))
+        os.rename(temp_file, self.state_file)
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        return ex.errno == errno.EPERM
+    return True
+
+
+_ALLOCATORS = {}
+_ALLOCATORS_LOCK = threading.Lock()
+
+
+def get_subnet_cidr_allocator(cidr, mask_bits):
+    """Gets the allocator for given pool CIDR and subnet prefix length"""
+    key = (str(netaddr.IPNetwork(cidr).cidr), int(mask_bits))
+    with _ALLOCATORS_LOCK:
+        allocator = _ALLOCATORS.get(key)
+        if allocator is None:
+            _ALLOCATORS[key] = allocator = SubnetCidrAllocator(
+                cidr=cidr, mask_bits=mask_bits)
+    return allocator
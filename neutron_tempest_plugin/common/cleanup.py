@@ -0,0 +1,140 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+from concurrent import futures
+
+from oslo_log import log
+
+
+LOG = log.getLogger(__name__)
+
+
+class CleanupStep(collections.namedtuple('CleanupStep',
+                                         ['name', 'resources', 'delete',
+                                          'after', 'key'])):
+
+    def iter_resources(self):
+        if self.key is None:
+            for resource in self.resources:
+                yield resource
+        else:
+            # Skip resources recorded more than once
+            keys = set()
+            for resource in self.resources:
+                key = self.key(resource)
+                if key not in keys:
+                    keys.add(key)
+                    yield resource
+
+
+class ResourceCleanup(object):
+    """Deletes resources in dependency order
+
+    Resource lists are registered together with the names of other resource
+    lists that have to be deleted before them. These dependencies are used to
+    split resource lists in layers: all resources of the same layer don't
+    depend on each other and they are deleted concurrently by a pool of
+    worker threads before proceeding with the next layer.
+
+    :param max_workers: max number of resources being deleted concurrently
+    """
+
+    max_workers = 10
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or self.max_workers
+        self._steps = collections.OrderedDict()
+
+    def add(self, name, resources, delete, after=None, key=None):
+        """Registers a list of resources to be deleted
+
+        :param name: unique name of the resource list
+
+        :param resources: sequence of resources to be deleted
+
+        :param delete: callable accepting a resource as its only argument
+        that deletes it
+
+        :param after: names of resource lists that have to be deleted
+        before this one
+
+        :param key: callable returning a unique key for every resource. If
+        given it is used to delete a resource recorded more times only once.
+        """
+        if name in self._steps:
+            message = "Resource list {!r} already added".format(name)
+            raise ValueError(message)
+        self._steps[name] = CleanupStep(
+            name=name, resources=resources, delete=delete,
+            after=tuple(after or ()), key=key)
+
+    def get_layers(self):
+        """Sorts resource lists in layers of independent resource lists
+
+        :returns: list of layers, where every layer is a list of CleanupStep
+        whose dependencies are all in previous layers
+
+        :raises ValueError: if a dependency is unknown or dependencies are
+        circular
+        """
+        pending = collections.OrderedDict()
+        for name, step in self._steps.items():
+            for dependency in step.after:
+                if dependency not in self._steps:
+                    message = ("Resource list {!r} depends on unknown "
+                               "resource list {!r}").format(name, dependency)
+                    raise ValueError(message)
+            pending[name] = set(step.after)
+
+        layers = []
+        while pending:
+            layer = [self._steps[name]
+                     for name, dependencies in pending.items()
+                     if not dependencies]
+            if not layer:
+                message = ("Circular dependencies between resource lists: "
+                           "{!s}").format(', '.join(pending))
+                raise ValueError(message)
+            for step in layer:
+                del pending[step.name]
+            for dependencies in pending.values():
+                dependencies.difference_update(step.name for step in layer)
+            layers.append(layer)
+        return layers
+
+    def run(self):
+        """Deletes all registered resources layer by layer
+
+        Deletion stops after the first layer where any resource failed to be
+        deleted, as deleting next layers would fail because of it.
+
+        :raises: the first exception raised while deleting a resource
+        """
+        layers = self.get_layers()
+        with futures.ThreadPoolExecutor(
+                max_workers=self.max_workers) as executor:
+            for layer in layers:
+                jobs = [executor.submit(step.delete, resource)
+                        for step in layer
+                        for resource in step.iter_resources()]
+                if not jobs:
+                    continue
+
+                LOG.debug("Deleting %d resources from resource lists: %s",
+                          len(jobs), ', '.join(step.name for step in layer))
+                futures.wait(jobs)
+                for job in jobs:
+                    # This raises the exception of first failed deletion
+                    job.result()
@@ -0,0 +1,285 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+from concurrent import futures
+import re
+
+import netaddr
+from oslo_log import log
+
+
+LOG = log.getLogger(__name__)
+
+RESULT_MARKER = '### PING-RESULT'
+
+# Pings all destinations with a single command for every address family:
+# fping when it is available (fping6 or 'fping -6' for IPv6, as older
+# versions only ping IPv4 addresses), otherwise one ping process for every
+# destination running in background. It always succeeds as failures are
+# reported by the output of every ping.
+PING_SCRIPT = """
+dests4='{destinations4}'
+dests6='{destinations6}'
+dests="$dests4 $dests6"
+if command -v fping > /dev/null 2>&1; then
+    echo '{marker} fping'
+    if [ -n "$dests4" ]; then
+        fping -C {count} -q -b {size} -t {timeout_ms} $dests4 2>&1
+    fi
+    if [ -n "$dests6" ]; then
+        if command -v fping6 > /dev/null 2>&1; then
+            fping6=fping6
+        else
+            fping6='fping -6'
+        fi
+        $fping6 -C {count} -q -b {size} -t {timeout_ms} $dests6 2>&1
+    fi
+else
+    dir=$(mktemp -d)
+    for dest in $dests; do
+        case $dest in
+            *:*) cmd=ping6 ;;
+            *) cmd=ping ;;
+        esac
+        $cmd -c {count} -w {timeout} -s {size} $dest > "$dir/$dest" 2>&1 &
+    done
+    wait
+    for dest in $dests; do
+        echo "{marker} $dest"
+        cat "$dir/$dest"
+    done
+    rm -fr "$dir"
+fi
+true
+"""
+
+_FPING_LINE_RE = re.compile(r'^(?P<destination>\S+)\s+:\s+(?P<times>.*)$')
+
+_PING_PACKETS_RE = re.compile(
+    r'(?P<transmitted>\d+) packets transmitted, '
+    r'(?P<received>\d+) (?:packets )?received')
+
+_PING_RTT_RE = re.compile(
+    r'(?:rtt|round-trip) min/avg/max\S* = '
+    r'(?P<min>[\d.]+)/(?P<avg>[\d.]+)/(?P<max>[\d.]+)')
+
+
+class PingResult(collections.namedtuple(
+        'PingResult', ['source', 'destination', 'transmitted', 'received',
+                       'latency'])):
+    """Result of pinging a destination from a source
+
+    :param source: host of the SSH client the destination was pinged from
+
+    :param destination: pinged IP address
+
+    :param transmitted: number of ICMP echo requests sent
+
+    :param received: number of ICMP echo replies received
+
+    :param latency: average round trip time in milliseconds or None when no
+    reply has been received
+    """
+
+    @property
+    def reachable(self):
+        return self.received > 0
+
+    @property
+    def loss(self):
+        if not self.transmitted:
+            return 1.
+        return 1. - float(self.received) / self.transmitted
+
+    def __str__(self):
+        if self.reachable:
+            status = 'reachable ({:.3f} ms, {:.0%} loss)'.format(
+                self.latency, self.loss)
+        else:
+            status = 'unreachable'
+        return '{!s} -> {!s}: {!s}'.format(self.source, self.destination,
+                                           status)
+
+
+class ConnectivityMatrix(object):
+    """Reachability and latency between every source and destination pair"""
+
+    def __init__(self, results=None):
+        self._results = collections.OrderedDict()
+        if results:
+            self.update(results)
+
+    def update(self, results):
+        for result in results:
+            self._results[result.source, result.destination] = result
+
+    def __getitem__(self, pair):
+        return self._results[pair]
+
+    def __iter__(self):
+        return iter(self._results.values())
+
+    def __len__(self):
+        return len(self._results)
+
+    def __str__(self):
+        return '\n'.join(str(result) for result in self)
+
+    @property
+    def sources(self):
+        return list(collections.OrderedDict.fromkeys(
+            source for source, _ in self._results))
+
+    @property
+    def destinations(self):
+        return list(collections.OrderedDict.fromkeys(
+            destination for _, destination in self._results))
+
+    def is_reachable(self, source, destination):
+        return self[source, destination].reachable
+
+    def get_latency(self, source, destination):
+        return self[source, destination].latency
+
+    def get_unexpected(self, should_succeed=True):
+        """Lists results not matching expected reachability
+
+        :param should_succeed: True if all destinations are expected to be
+        reachable, False otherwise
+        """
+        return [result for result in self
+                if result.reachable != should_succeed]
+
+
+def ping_destinations(source, destinations, count=1, size=56, timeout=None):
+    """Pings many destinations at once from a single SSH client
+
+    All destinations are pinged concurrently by a single remote command.
+
+    :param source: SSH client to ping from
+
+    :param destinations: IP addresses to ping
+
+    :param count: number of ICMP echo requests sent to every destination
+
+    :param size: ICMP payload size
+
+    :param timeout: max time in seconds to wait for every destination to
+    reply. By default it is equal to count.
+
+    :returns: list of PingResult, one for every destination
+    """
+    addresses = [netaddr.IPAddress(destination)
+                 for destination in destinations]
+    if not addresses:
+        return []
+
+    destinations = [str(address) for address in addresses]
+    timeout = timeout or count
+    output = source.exec_command(PING_SCRIPT.format(
+        destinations4=' '.join(str(address) for address in addresses
+                               if address.version == 4),
+        destinations6=' '.join(str(address) for address in addresses
+                               if address.version == 6),
+        count=count, size=size, timeout=timeout,
+        timeout_ms=int(timeout * 1000), marker=RESULT_MARKER))
+    results = parse_ping_output(output, source=source.host, count=count)
+    missing = PingResult(source=source.host, destination=None,
+                         transmitted=count, received=0, latency=None)
+    return [results.get(destination,
+                        missing._replace(destination=destination))
+            for destination in destinations]
+
+
+def ping_matrix(probes, count=1, size=56, timeout=None, max_workers=None):
+    """Pings destinations from many SSH clients concurrently
+
+    :param probes: sequence of (source, destinations) pairs where source is
+    an SSH client and destinations the IP addresses to ping from it
+
+    :param max_workers: max number of sources pinging at the same time. By
+    default all of them run concurrently.
+
+    See ping_destinations for other parameters.
+
+    :returns: ConnectivityMatrix instance
+    """
+    probes = [(source, destinations) for source, destinations in probes
+              if destinations]
+    matrix = ConnectivityMatrix()
+    if not probes:
+        return matrix
+
+    with futures.ThreadPoolExecutor(
+            max_workers=max_workers or len(probes)) as executor:
+        jobs = [executor.submit(ping_destinations, source, destinations,
+                                count=count, size=size, timeout=timeout)
+                for source, destinations in probes]
+    for job in jobs:
+        matrix.update(job.result())
+    LOG.debug("Connectivity matrix:\n%s", matrix)
+    return matrix
+
+
+def parse_ping_output(output, source, count):
+    """Parses the output of PING_SCRIPT
+
+    :returns: dictionary mapping every pinged destination to its PingResult
+    """
+    results = {}
+    destination = None
+    lines = []
+    for line in output.splitlines() + [RESULT_MARKER + ' end']:
+        if line.startswith(RESULT_MARKER):
+            if destination == 'fping':
+                results.update(_parse_fping_lines(lines, source, count))
+            elif destination:
+                results[destination] = _parse_ping_lines(
+                    lines, source, destination, count)
+            destination = line[len(RESULT_MARKER):].strip()
+            lines = []
+        else:
+            lines.append(line)
+    return results
+
+
+def _parse_fping_lines(lines, source, count):
+    # Every line looks like '<destination> : <rtt1> <rtt2> - <rtt4> ...'
+    # where '-' is a lost reply
+    for line in lines:
+        match = _FPING_LINE_RE.match(line.strip())
+        if not match:
+            continue
+        times = [float(value) for value in match.group('times').split()
+                 if value != '-']
+        latency = sum(times) / len(times) if times else None
+        yield match.group('destination'), PingResult(
+            source=source, destination=match.group('destination'),
+            transmitted=count, received=len(times), latency=latency)
+
+
+def _parse_ping_lines(lines, source, destination, count):
+    output = '\n'.join(lines)
+    transmitted, received, latency = count, 0, None
+    match = _PING_PACKETS_RE.search(output)
+    if match:
+        transmitted = int(match.group('transmitted'))
+        received = int(match.group('received'))
+    match = _PING_RTT_RE.search(output)
+    if match and received:
+        latency = float(match.group('avg'))
+    return PingResult(source=source, destination=destination,
+                      transmitted=transmitted, received=received,
+                      latency=latency)
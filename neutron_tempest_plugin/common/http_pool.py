@@ -0,0 +1,166 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+from oslo_log import log
+import urllib3
+
+
+LOG = log.getLogger(__name__)
+
+
+class Response(dict):
+    """HTTP response headers as returned by tempest HTTP classes"""
+
+    def __init__(self, url, info):
+        super(Response, self).__init__()
+        for key, value in info.getheaders().items():
+            self[str(key).lower()] = value
+        self.status = info.status
+        self['status'] = str(self.status)
+        self.reason = info.reason
+        self.version = info.version
+        self['content-location'] = url
+
+
+class KeepAliveMixin(object):
+    """Reuse HTTP connections instead of closing them after every response
+
+    It implements the same request method interface as
+    tempest.lib.common.http.ClosingHttp class so that instances can be
+    assigned to RestClient.http_obj attribute. Connections are kept in a pool
+    for every endpoint (scheme, host, port) and pools that have not been used
+    for more than idle_timeout seconds are closed before next request.
+    """
+
+    follow_redirects = True
+    idle_timeout = None
+
+    def _init_keep_alive(self, follow_redirects, idle_timeout):
+        self.follow_redirects = follow_redirects
+        self.idle_timeout = idle_timeout
+        self._last_used = {}
+        self._last_used_lock = threading.Lock()
+
+    def connection_from_pool_key(self, pool_key, *args, **kwargs):
+        pool = super(KeepAliveMixin, self).connection_from_pool_key(
+            pool_key, *args, **kwargs)
+        with self._last_used_lock:
+            self._last_used[pool_key] = time.time()
+        return pool
+
+    def evict_idle_pools(self):
+        """Close connection pools that have not been used for a while"""
+        if not self.idle_timeout:
+            return
+
+        deadline = time.time() - self.idle_timeout
+        with self._last_used_lock:
+            idle_keys = [key for key, last_used in self._last_used.items()
+                         if last_used < deadline]
+            for key in idle_keys:
+                del self._last_used[key]
+
+        for key in idle_keys:
+            LOG.debug("Closing idle HTTP connection pool for %s://%s:%s",
+                      key.key_scheme, key.key_host, key.key_port)
+            try:
+                # Removed pools are closed by the container dispose function
+                del self.pools[key]
+            except KeyError:
+                pass
+
+    def request(self, url, method, *args, **kwargs):
+        self.evict_idle_pools()
+
+        headers = dict(kwargs.pop('headers', None) or {},
+                       connection='keep-alive')
+        if self.follow_redirects:
+            # Follow up to 5 redirections. Don't raise an exception if
+            # it's exceeded but return the HTTP 3XX response instead.
+            retry = urllib3.util.Retry(raise_on_redirect=False, redirect=5)
+        else:
+            # Do not follow redirections. Don't raise an exception if
+            # a redirect is found, but return the HTTP 3XX response instead.
+            retry = urllib3.util.Retry(redirect=False)
+        r = super(KeepAliveMixin, self).request(
+            method, url, retries=retry, headers=headers, *args, **kwargs)
+
+        if not kwargs.get('preload_content', True):
+            # This means we asked urllib3 for streaming content, so we
+            # need to return the raw response and not read any data yet
+            return r, b''
+        else:
+            return Response(url, r), r.data
+
+
+class KeepAliveHttp(KeepAliveMixin, urllib3.PoolManager):
+
+    def __init__(self, disable_ssl_certificate_validation=False,
+                 ca_certs=None, timeout=None, follow_redirects=True,
+                 maxsize=10, idle_timeout=30.):
+        self._init_keep_alive(follow_redirects=follow_redirects,
+                              idle_timeout=idle_timeout)
+        super(KeepAliveHttp, self).__init__(
+            maxsize=maxsize, **_get_pool_kwargs(
+                disable_ssl_certificate_validation=(
+                    disable_ssl_certificate_validation),
+                ca_certs=ca_certs, timeout=timeout))
+
+
+class KeepAliveProxyHttp(KeepAliveMixin, urllib3.ProxyManager):
+
+    def __init__(self, proxy_url, disable_ssl_certificate_validation=False,
+                 ca_certs=None, timeout=None, follow_redirects=True,
+                 maxsize=10, idle_timeout=30.):
+        self._init_keep_alive(follow_redirects=follow_redirects,
+                              idle_timeout=idle_timeout)
+        super(KeepAliveProxyHttp, self).__init__(
+            proxy_url, maxsize=maxsize, **_get_pool_kwargs(
+                disable_ssl_certificate_validation=(
+                    disable_ssl_certificate_validation),
+                ca_certs=ca_certs, timeout=timeout))
+
+
+def _get_pool_kwargs(disable_ssl_certificate_validation=False, ca_certs=None,
+                     timeout=None):
+    kwargs = {}
+    if disable_ssl_certificate_validation:
+        urllib3.disable_warnings()
+        kwargs['cert_reqs'] = 'CERT_NONE'
+    elif ca_certs:
+        kwargs['cert_reqs'] = 'CERT_REQUIRED'
+        kwargs['ca_certs'] = ca_certs
+    if timeout:
+        kwargs['timeout'] = timeout
+    return kwargs
+
+
+def create_http_pool(proxy_url=None, **kwargs):
+    """Creates a keep-alive HTTP connection pool
+
+    :param proxy_url: URL of the HTTP proxy to pass through (if any)
+
+    :param **kwargs: keyword parameters forwarded to KeepAliveHttp or
+    KeepAliveProxyHttp class constructor (disable_ssl_certificate_validation,
+    ca_certs, timeout, follow_redirects, maxsize and idle_timeout)
+
+    :returns: an object that can be used as RestClient.http_obj
+    """
+    if proxy_url:
+        return KeepAliveProxyHttp(proxy_url, **kwargs)
+    else:
+        return KeepAliveHttp(**kwargs)
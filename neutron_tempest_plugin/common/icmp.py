@@ -0,0 +1,341 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import itertools
+import os
+import select
+import socket
+import struct
+import time
+
+import netaddr
+from oslo_log import log
+
+from neutron_tempest_plugin import exceptions
+
+
+LOG = log.getLogger(__name__)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+_ICMP_HEADER = struct.Struct('!BBHHH')
+_TIMESTAMP = struct.Struct('!d')
+
+# Errors raised when current process is not allowed to open ICMP sockets
+_NOT_AVAILABLE_ERRNOS = (errno.EPERM, errno.EACCES, errno.EPROTONOSUPPORT,
+                         errno.EAFNOSUPPORT, errno.ESOCKTNOSUPPORT)
+
+
+class ProbeResult(object):
+    """Statistics of ICMP echo requests sent to an IP address
+
+    :param address: probed IP address
+
+    :param sent: number of echo requests sent
+
+    :param received: number of echo replies received
+
+    :param lost: number of echo requests whose reply didn't arrive in time
+
+    :param first_reply: seconds elapsed from the beginning of probing until
+    the first reply was received (None when no reply has been received)
+
+    :param rtts: round trip times of received replies in seconds
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.first_reply = None
+        self.rtts = []
+
+    @property
+    def reachable(self):
+        return self.received > 0
+
+    @property
+    def loss(self):
+        completed = self.received + self.lost
+        if not completed:
+            return None
+        return float(self.lost) / completed
+
+    @property
+    def latency(self):
+        if not self.rtts:
+            return None
+        return sum(self.rtts) / len(self.rtts)
+
+    def __repr__(self):
+        return ('ProbeResult(address={!r}, sent={!r}, received={!r}, '
+                'lost={!r}, first_reply={!r}, latency={!r})').format(
+                    self.address, self.sent, self.received, self.lost,
+                    self.first_reply, self.latency)
+
+
+class IcmpSocket(object):
+    """ICMP or ICMPv6 socket sending echo requests and receiving replies
+
+    It uses an unprivileged datagram ICMP socket when the kernel allows it
+    (see net.ipv4.ping_group_range sysctl option), otherwise a raw socket.
+
+    :raises exceptions.IcmpSocketNotAvailable: when current process is not
+    allowed to open any of them
+    """
+
+    def __init__(self, ip_version):
+        if ip_version == 6:
+            self.family = socket.AF_INET6
+            self.proto = socket.IPPROTO_ICMPV6
+            self.request_type = ICMPV6_ECHO_REQUEST
+            self.reply_type = ICMPV6_ECHO_REPLY
+        else:
+            self.family = socket.AF_INET
+            self.proto = socket.IPPROTO_ICMP
+            self.request_type = ICMP_ECHO_REQUEST
+            self.reply_type = ICMP_ECHO_REPLY
+        self.ident = os.getpid() & 0xffff
+        self.sock = self._open_socket()
+        self.sock.setblocking(False)
+        self._sequence = itertools.count()
+
+    def _open_socket(self):
+        errors = []
+        for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+            try:
+                sock = socket.socket(self.family, sock_type, self.proto)
+            except socket.error as ex:
+                if ex.errno not in _NOT_AVAILABLE_ERRNOS:
+                    raise
+                errors.append(ex)
+            else:
+                self.sock_type = sock_type
+                return sock
+        raise exceptions.IcmpSocketNotAvailable(
+            family=self.family, reason='; '.join(str(ex) for ex in errors))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def send_request(self, address, payload_size=56):
+        """Sends an echo request to given address
+
+        :returns: the sequence number of sent request
+        """
+        sequence = next(self._sequence) & 0xffff
+        payload = _TIMESTAMP.pack(time.time()).ljust(payload_size, b'Q')
+        header = _ICMP_HEADER.pack(self.request_type, 0, 0, self.ident,
+                                   sequence)
+        if self.family == socket.AF_INET:
+            # Kernel computes the checksum only for ICMPv6 packets
+            header = _ICMP_HEADER.pack(
+                self.request_type, 0, _checksum(header + payload),
+                self.ident, sequence)
+        self.sock.sendto(header + payload, (address, 0))
+        return sequence
+
+    def receive_replies(self):
+        """Receives all echo replies waiting in socket buffer
+
+        :returns: list of (address, sequence) pairs
+        """
+        replies = []
+        while True:
+            try:
+                data, sender = self.sock.recvfrom(65535)
+            except socket.error as ex:
+                if ex.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return replies
+                raise
+
+            if self.family == socket.AF_INET and self.sock_type == (
+                    socket.SOCK_RAW):
+                # IPv4 raw sockets receive IP header too
+                data = data[(ord(data[0:1]) & 0x0f) * 4:]
+            if len(data) < _ICMP_HEADER.size:
+                continue
+
+            icmp_type, _, _, ident, sequence = _ICMP_HEADER.unpack_from(data)
+            if icmp_type != self.reply_type:
+                continue
+            if self.sock_type == socket.SOCK_RAW and ident != self.ident:
+                # Datagram sockets only receive replies to their own
+                # requests, but raw sockets receive all of them
+                continue
+            address = str(netaddr.IPAddress(sender[0].split('%', 1)[0]))
+            replies.append((address, sequence))
+
+
+class IcmpProber(object):
+    """Sends echo requests to many IP addresses at once
+
+    Echo requests are sent to all addresses every interval seconds from a
+    single thread, while replies are received as soon as they arrive.
+
+    :param addresses: IP addresses to probe
+
+    :param interval: seconds between echo requests sent to the same address
+
+    :param reply_timeout: seconds to wait for a reply before considering
+    an echo request lost
+
+    :param payload_size: size of echo requests payload
+    """
+
+    def __init__(self, addresses, interval=.2, reply_timeout=1.,
+                 payload_size=56):
+        self.addresses = [str(netaddr.IPAddress(address))
+                          for address in addresses]
+        self.interval = interval
+        self.reply_timeout = reply_timeout
+        self.payload_size = max(payload_size, _TIMESTAMP.size)
+        self._sockets = {}
+
+    def open(self):
+        for address in self.addresses:
+            version = netaddr.IPAddress(address).version
+            if version not in self._sockets:
+                self._sockets[version] = IcmpSocket(version)
+        return self
+
+    def close(self):
+        while self._sockets:
+            self._sockets.popitem()[1].close()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, _exception_type, _exception_value, _traceback):
+        self.close()
+
+    def run(self, duration, until=None):
+        """Probes all addresses for duration seconds
+
+        :param duration: max time in seconds to probe addresses
+
+        :param until: callable receiving the results dictionary after every
+        sent request or received reply. Probing stops as soon as it returns
+        True.
+
+        :returns: dictionary mapping every address to its ProbeResult
+        """
+        if not self._sockets:
+            with self:
+                return self.run(duration=duration, until=until)
+
+        results = dict((address, ProbeResult(address))
+                       for address in self.addresses)
+        pending = {}
+        sockets = list(self._sockets.values())
+        start = time.time()
+        end_of_time = start + duration
+        next_send = start
+        while True:
+            now = time.time()
+            if now >= next_send:
+                self._send_requests(results, pending, now)
+                next_send += self.interval
+
+            # Requests not replied in time are considered lost
+            for key, (address, sent_time) in list(pending.items()):
+                if now - sent_time >= self.reply_timeout:
+                    del pending[key]
+                    results[address].lost += 1
+
+            if (until and until(results)) or now >= end_of_time:
+                return results
+
+            timeout = max(0., min(next_send, end_of_time) - now)
+            readable, _, _ = select.select(sockets, [], [], timeout)
+            for sock in readable:
+                for address, sequence in sock.receive_replies():
+                    request = pending.get((sock.family, sequence))
+                    if request is None or request[0] != address:
+                        # Unknown or already expired request
+                        continue
+                    del pending[sock.family, sequence]
+                    sent_time = request[1]
+                    received_time = time.time()
+                    result = results[address]
+                    result.received += 1
+                    result.rtts.append(received_time - sent_time)
+                    if result.first_reply is None:
+                        result.first_reply = received_time - start
+
+    def _send_requests(self, results, pending, now):
+        for address in self.addresses:
+            sock = self._sockets[netaddr.IPAddress(address).version]
+            result = results[address]
+            result.sent += 1
+            try:
+                sequence = sock.send_request(
+                    address, payload_size=self.payload_size)
+            except socket.error as ex:
+                # ie. no route to host
+                LOG.debug("Unable to send echo request to %s: %s", address,
+                          ex)
+                result.lost += 1
+            else:
+                pending[sock.family, sequence] = address, now
+
+
+def probe(addresses, timeout, should_succeed=True, **kwargs):
+    """Probes addresses until all of them have the expected reachability
+
+    An address is considered reachable as soon as it replies to an echo
+    request and unreachable as soon as an echo request is lost.
+
+    :param addresses: IP addresses to probe
+
+    :param timeout: max time in seconds to wait for expected reachability
+
+    :param should_succeed: True if addresses are expected to be reachable,
+    False otherwise
+
+    :param **kwargs: other IcmpProber parameters
+
+    :returns: dictionary mapping every address to its ProbeResult
+
+    :raises exceptions.IcmpSocketNotAvailable: when ICMP sockets can't be
+    opened by current process
+    """
+    if should_succeed:
+        def until(results):
+            return all(result.received for result in results.values())
+    else:
+        def until(results):
+            return all(result.lost for result in results.values())
+
+    with IcmpProber(addresses, **kwargs) as prober:
+        results = prober.run(duration=timeout, until=until)
+    LOG.debug("ICMP probe results: %r", list(results.values()))
+    return results
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!{:d}H'.format(len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
@@ -15,41 +15,195 @@
 #    under the License.
 
 import collections
-import subprocess
+import json
+import re
 
 import netaddr
 from neutron_lib import constants
 from oslo_log import log
 from oslo_utils import excutils
+from six.moves import shlex_quote
 
 from neutron_tempest_plugin.common import shell
+from neutron_tempest_plugin import exceptions
 
 
 LOG = log.getLogger(__name__)
 
+# Error line written to STDERR by 'ip -batch' for every failed operation
+_BATCH_ERROR_RE = re.compile(r'^Command failed (?P<file>\S+):(?P<line>\d+)',
+                             re.MULTILINE)
+
+# Error written to STDERR by ip commands not supporting '-batch' or
+# '-force' options: iproute2 rejects them as unknown, while busybox prints
+# its usage
+_BATCH_UNSUPPORTED_RE = re.compile(
+    r'option .*-(batch|force)\b|^Usage: ip ', re.IGNORECASE | re.MULTILINE)
+
+BATCH_HEREDOC_MARKER = 'IP_BATCH_EOF'
+
 
 class IPCommand(object):
 
     sudo = 'sudo'
     ip_path = '/sbin/ip'
 
+    # Parse JSON output of ip command ('-json' option) when it is supported
+    use_json = True
+
     def __init__(self, ssh_client=None, timeout=None):
         self.ssh_client = ssh_client
         self.timeout = timeout
+        # objects whose JSON output is not supported by ip command
+        self._json_unsupported = set()
+        # whether ip command doesn't support '-batch' option
+        self._batch_unsupported = False
+        self._address_table = None
 
     def get_command(self, obj, *command):
         command_line = '{sudo!s} {ip_path!r} {object!s} {command!s}'.format(
             sudo=self.sudo, ip_path=self.ip_path, object=obj,
-            command=subprocess.list2cmdline([str(c) for c in command]))
+            command=_join_args(command))
         return command_line
 
     def execute(self, obj, *command):
+        # Executed command could change addresses configuration
+        self.invalidate_address_table()
         command_line = self.get_command(obj, *command)
         return shell.execute(command_line, ssh_client=self.ssh_client,
                              timeout=self.timeout).stdout
 
+    def get_address_table(self, refresh=False):
+        """Gets the table of all addresses configured on the host
+
+        The table is listed once and then cached until addresses
+        configuration is changed through this object (or any batch created
+        by it) or invalidate_address_table method is called.
+
+        :param refresh: when True it lists addresses again anyway
+
+        :returns: AddressTable instance
+        """
+        table = self._address_table
+        if table is None or refresh:
+            table = AddressTable(self.list_addresses())
+            self._address_table = table
+        return table
+
+    def invalidate_address_table(self):
+        """Makes get_address_table list addresses again on next call"""
+        self._address_table = None
+
+    def batch(self, force=False):
+        """Creates a batch of operations to be applied all at once
+
+        Example of use:
+
+            with ip_command.batch() as batch:
+                batch.add_link(link='eth0', name='eth0.10', link_type='vlan',
+                               segmentation_id=10)
+                batch.set_link(device='eth0.10', state='up')
+
+        :param force: when True failed operations don't prevent following
+        ones from being applied
+
+        :returns: IPBatch instance
+        """
+        return IPBatch(self, force=force)
+
+    def execute_batch(self, operations, force=False):
+        """Executes many ip command operations with a single shell command
+
+        Operations are passed to 'ip -batch' command, or when it isn't
+        supported (ie. busybox ip command) to a shell script executing them
+        one after the other.
+
+        :param operations: sequence of (obj, command) pairs, where command is
+        the sequence of ip command arguments following obj
+
+        :param force: when True it doesn't stop at first failed operation
+
+        :raises exceptions.IPBatchCommandFailed: when an operation fails
+        """
+        operations = list(operations)
+        if not operations:
+            return
+
+        self.invalidate_address_table()
+
+        if not self._batch_unsupported:
+            lines = [' '.join([obj, _join_args(command)])
+                     for obj, command in operations]
+            options = '-force -batch -' if force else '-batch -'
+            command_line = '{!s} <<\'{!s}\'\n{!s}\n{!s}\n'.format(
+                self.get_command(options), BATCH_HEREDOC_MARKER,
+                '\n'.join(lines), BATCH_HEREDOC_MARKER)
+            result = shell.execute(command_line, ssh_client=self.ssh_client,
+                                   timeout=self.timeout, check=False)
+            stderr = result.stderr or ''
+            if result.exit_status and not _BATCH_ERROR_RE.search(stderr):
+                if not _BATCH_UNSUPPORTED_RE.search(stderr):
+                    # Command failed before executing operations (ie. sudo
+                    # or shell error)
+                    result.check()
+                # '-batch' option is not supported
+                LOG.debug("'ip -batch' command not supported: executing "
+                          "operations with a shell script")
+                self._batch_unsupported = True
+
+        if self._batch_unsupported:
+            # Failed operations are reported the same way as 'ip -batch'
+            lines = ['{!s} || {{ echo "Command failed -:{:d}" >&2; '
+                     '{!s}; }}'.format(self.get_command(obj, *command), i + 1,
+                                       'status=1' if force else 'exit 1')
+                     for i, (obj, command) in enumerate(operations)]
+            lines.insert(0, 'status=0')
+            lines.append('exit $status')
+            command_line = '\n'.join(lines)
+            result = shell.execute(command_line, ssh_client=self.ssh_client,
+                                   timeout=self.timeout, check=False)
+
+        if result.exit_status is None:
+            result.check()
+
+        failed = [operations[int(match.group('line')) - 1]
+                  for match in _BATCH_ERROR_RE.finditer(result.stderr or '')
+                  if 0 < int(match.group('line')) <= len(operations)]
+        if failed:
+            raise exceptions.IPBatchCommandFailed(
+                command=result.command, exit_status=result.exit_status or 1,
+                operations=', '.join(
+                    repr(' '.join([obj] + [str(c) for c in command]))
+                    for obj, command in failed),
+                stderr=result.stderr, stdout=result.stdout)
+        result.check()
+
+    def list_objects(self, obj, command, parse_json, parse_text):
+        """Executes ip command and parses its output
+
+        It uses JSON output when ip command supports it for given object,
+        otherwise (ie. busybox ip command) it falls back to text output.
+        """
+        if self.use_json and obj not in self._json_unsupported:
+            command_line = self.get_command('-json ' + obj, *command)
+            result = shell.execute(command_line, ssh_client=self.ssh_client,
+                                   timeout=self.timeout, check=False)
+            output = result.stdout
+            if result.exit_status == 0 and output.lstrip().startswith('['):
+                return parse_json(output)
+
+            # Command failed or ignored '-json' option: if text output
+            # works then JSON one is not supported
+            output = self.execute(obj, *command)
+            LOG.debug("JSON output of 'ip %s' command not supported: "
+                      "parsing text output", obj)
+            self._json_unsupported.add(obj)
+        else:
+            output = self.execute(obj, *command)
+        return parse_text(output)
+
     def configure_vlan_subport(self, port, subport, vlan_tag, subnets):
-        addresses = self.list_addresses()
+        addresses = self.get_address_table()
         try:
             subport_device = get_port_device_name(addresses=addresses,
                                                   port=subport)
@@ -74,11 +228,12 @@ class IPCommand(object):
                   '%r with IPs: %s', subport_device, port_device,
                   ', '.join(subport_ips))
 
-        self.add_link(link=port_device, name=subport_device, link_type='vlan',
-                      segmentation_id=vlan_tag)
-        self.set_link(device=subport_device, state='up')
-        for subport_ip in subport_ips:
-            self.add_address(address=subport_ip, device=subport_device)
+        with self.batch() as batch:
+            batch.add_link(link=port_device, name=subport_device,
+                           link_type='vlan', segmentation_id=vlan_tag)
+            batch.set_link(device=subport_device, state='up')
+            for subport_ip in subport_ips:
+                batch.add_address(address=subport_ip, device=subport_device)
         return subport_device
 
     def list_addresses(self, device=None, ip_addresses=None, port=None,
@@ -86,8 +241,9 @@ class IPCommand(object):
         command = ['list']
         if device:
             command += ['dev', device]
-        output = self.execute('address', *command)
-        addresses = list(parse_addresses(output))
+        addresses = self.list_objects('address', command,
+                                      parse_json=parse_addresses_json,
+                                      parse_text=parse_addresses)
 
         return list_ip_addresses(addresses=addresses,
                                  ip_addresses=ip_addresses, port=port,
@@ -98,7 +254,7 @@ class IPCommand(object):
         if link:
             command += ['link', link]
         command += ['name', name, 'type', link_type]
-        if id:
+        if segmentation_id is not None:
             command += ['id', segmentation_id]
         return self.execute('link', *command)
 
@@ -112,9 +268,74 @@ class IPCommand(object):
         # ip addr add 192.168.1.1/24 dev em1
         return self.execute('address', 'add', address, 'dev', device)
 
+    def add_route(self, dest, via=None, device=None):
+        command = ['add', dest]
+        if via:
+            command += ['via', via]
+        if device:
+            command += ['dev', device]
+        return self.execute('route', *command)
+
     def list_routes(self, *args):
-        output = self.execute('route', 'show', *args)
-        return list(parse_routes(output))
+        return list(self.list_objects('route', ('show',) + args,
+                                      parse_json=parse_routes_json,
+                                      parse_text=parse_routes))
+
+
+class IPBatch(IPCommand):
+    """Collects ip command operations to apply them all at once
+
+    Operations (ie. add_link, set_link, add_address, add_route) are recorded
+    instead of being executed, then they are executed by apply method (or
+    when leaving the with block) with a single shell command. Operations
+    listing objects are executed immediately. Nested with blocks of the same
+    batch are applied when leaving the outer one.
+
+    :param ip_command: IPCommand instance used to execute operations
+    """
+
+    def __init__(self, ip_command, force=False):
+        super(IPBatch, self).__init__(ssh_client=ip_command.ssh_client,
+                                      timeout=ip_command.timeout)
+        self.ip_command = ip_command
+        self.sudo = ip_command.sudo
+        self.ip_path = ip_command.ip_path
+        self.use_json = ip_command.use_json
+        self.force = force
+        self.operations = []
+        self._depth = 0
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, exception_type, _exception_value, _traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            if exception_type is None:
+                self.apply()
+            else:
+                del self.operations[:]
+
+    def batch(self, force=False):
+        return self
+
+    def execute(self, obj, *command):
+        self.operations.append((obj, command))
+
+    def list_objects(self, obj, command, parse_json, parse_text):
+        return self.ip_command.list_objects(obj, command,
+                                            parse_json=parse_json,
+                                            parse_text=parse_text)
+
+    def get_address_table(self, refresh=False):
+        return self.ip_command.get_address_table(refresh=refresh)
+
+    def apply(self):
+        """Executes all recorded operations"""
+        operations = self.operations
+        self.operations = []
+        self.ip_command.execute_batch(operations, force=self.force)
 
 
 def parse_addresses(command_output):
@@ -144,24 +365,21 @@ def parse_addresses(command_output):
                     flags = fields[2]
                     if flags.startswith('<'):
                         flags = flags[1:]
-                    if flags.startswith('>'):
+                    if flags.endswith('>'):
                         flags = flags[:-1]
                     flags = flags.split(',')
 
                 device = Device(name=name, parent=parent, flags=flags,
                                 properties=dict(parse_properties(fields[3:])))
-                LOG.debug("Device parsed: %r", device)
 
             elif indent == 4:
                 address = Address.create(
                     family=fields[0], address=fields[1], device=device,
-                    properties=dict(parse_properties(fields[2:])))
+                    properties=dict(_parse_address_properties(fields[2:])))
                 addresses.append(address)
-                LOG.debug("Address parsed: %r", address)
 
             elif indent == 7:
                 address.properties.update(parse_properties(fields))
-                LOG.debug("Address properties parsed: %r", address.properties)
 
             else:
                 assert False, "Invalid line indentation: {!r}".format(indent)
@@ -176,6 +394,124 @@ def parse_addresses(command_output):
     return addresses
 
 
+# Address flags printed as single words by ip command (ie. 'dynamic'), that
+# are true values in its JSON output
+_ADDRESS_FLAGS = frozenset([
+    'secondary', 'temporary', 'nodad', 'optimistic', 'dadfailed', 'home',
+    'deprecated', 'tentative', 'permanent', 'dynamic', 'noprefixroute',
+    'autojoin', 'mngtmpaddr', 'stable-privacy'])
+
+
+def _parse_address_properties(fields):
+    # Flags have no value, while the label of IPv4 addresses is the last
+    # field after them
+    values = []
+    for field in fields:
+        if field in _ADDRESS_FLAGS:
+            yield field, field
+        else:
+            values.append(field)
+    if len(values) % 2:
+        yield 'label', values.pop()
+    for key, value in parse_properties(values):
+        yield key, value
+
+
+# Keys of 'ip -json' objects renamed to the properties names of text output
+_JSON_PROPERTY_NAMES = {
+    'operstate': 'state',
+    'txqlen': 'qlen',
+    'broadcast': 'brd',
+    'valid_life_time': 'valid_lft',
+    'preferred_life_time': 'preferred_lft',
+    'gateway': 'via',
+    'protocol': 'proto',
+    'prefsrc': 'src',
+}
+
+# Lifetime reported for addresses that never expire
+_INFINITE_LIFETIME = 0xffffffff
+
+_LIFETIME_JSON_KEYS = frozenset(['valid_life_time', 'preferred_life_time'])
+
+_DEVICE_JSON_KEYS = frozenset(['ifindex', 'ifname', 'flags', 'link',
+                               'link_type', 'address', 'broadcast',
+                               'addr_info'])
+
+_ADDRESS_JSON_KEYS = frozenset(['family', 'local', 'prefixlen'])
+
+_ROUTE_JSON_KEYS = frozenset(['dst', 'flags'])
+
+
+def parse_addresses_json(command_output):
+    """Parses the output of 'ip -json address list' command
+
+    It returns the same objects as parse_addresses
+    """
+    addresses = []
+    for link in json.loads(command_output):
+        device = Device(name=link['ifname'], parent=link.get('link'),
+                        flags=link.get('flags', []),
+                        properties=_json_properties(link, _DEVICE_JSON_KEYS))
+        if 'address' in link:
+            properties = {}
+            if 'broadcast' in link:
+                properties['brd'] = link['broadcast']
+            addresses.append(Address.create(
+                family='link/' + link.get('link_type', 'none'),
+                address=link['address'], device=device,
+                properties=properties))
+        for info in link.get('addr_info', []):
+            addresses.append(Address.create(
+                family=info['family'],
+                address='{!s}/{!s}'.format(info['local'], info['prefixlen']),
+                device=device,
+                properties=_json_properties(info, _ADDRESS_JSON_KEYS)))
+    return addresses
+
+
+def parse_routes_json(command_output):
+    """Parses the output of 'ip -json route show' command
+
+    It returns the same objects as parse_routes
+    """
+    for route in json.loads(command_output):
+        dest = route['dst']
+        properties = _json_properties(route, _ROUTE_JSON_KEYS)
+        if dest == 'default':
+            dest = constants.IPv4_ANY
+            via = properties.get('via')
+            if via:
+                dest = constants.IP_ANY[netaddr.IPAddress(via).version]
+        yield Route(dest=dest, properties=properties)
+
+
+def _json_properties(obj, skip_keys):
+    # Properties values are strings like the ones parsed from text output
+    properties = {}
+    for key, value in obj.items():
+        if key in skip_keys:
+            continue
+        if key in _LIFETIME_JSON_KEYS:
+            if value == _INFINITE_LIFETIME:
+                value = 'forever'
+            else:
+                value = '{!s}sec'.format(value)
+        elif isinstance(value, bool):
+            # Flags are printed as single words only when they are set,
+            # and parsed with their name as value
+            if not value:
+                continue
+            value = key
+        elif isinstance(value, list):
+            # Lists are printed comma separated (ie. '<UP,LOWER_UP>')
+            value = ','.join(str(item) for item in value)
+        elif type(value) is not str:
+            value = str(value)
+        properties[_JSON_PROPERTY_NAMES.get(key, key)] = value
+    return properties
+
+
 def parse_properties(fields):
     for i, field in enumerate(fields):
         if i % 2 == 0:
@@ -242,7 +578,62 @@ class InetAddress(Address):
 
     @property
     def network(self):
-        return netaddr.IPNetwork(self.address)
+        # Parse address only once
+        network = self.__dict__.get('_network')
+        if network is None:
+            network = self.__dict__['_network'] = netaddr.IPNetwork(
+                self.address)
+        return network
+
+
+class AddressTable(object):
+    """Addresses of a host indexed by IP address, device and subnet
+
+    :param addresses: Address instances (ie. parsed by parse_addresses)
+    """
+
+    def __init__(self, addresses):
+        self.addresses = list(addresses)
+        self._by_ip = collections.OrderedDict()
+        self._by_device = collections.OrderedDict()
+        self._by_subnet = collections.OrderedDict()
+        for address in self.addresses:
+            self._by_device.setdefault(address.device.name, []).append(
+                address)
+            if isinstance(address, InetAddress):
+                network = address.network
+                self._by_ip.setdefault(str(network.ip), []).append(address)
+                self._by_subnet.setdefault(str(network.cidr), []).append(
+                    address)
+
+    def __iter__(self):
+        return iter(self.addresses)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    @property
+    def devices(self):
+        return list(self._by_device)
+
+    def list_by_ip(self, ip_addresses):
+        ip_addresses = collections.OrderedDict.fromkeys(
+            str(netaddr.IPAddress(ip_address)) for ip_address in ip_addresses)
+        addresses = []
+        for ip_address in ip_addresses:
+            addresses += self._by_ip.get(ip_address, [])
+        return addresses
+
+    def list_by_device(self, device):
+        return list(self._by_device.get(device, []))
+
+    def list_by_subnet(self, cidr):
+        return list(self._by_subnet.get(
+            str(netaddr.IPNetwork(cidr).cidr), []))
+
+    def list_by_port(self, port, subnets=None):
+        return self.list_by_ip(list_port_ip_addresses(port=port,
+                                                      subnets=subnets))
 
 
 def parse_routes(command_output):
@@ -261,6 +652,15 @@ def parse_routes(command_output):
 
 def list_ip_addresses(addresses, ip_addresses=None, port=None,
                       subnets=None):
+    if isinstance(addresses, AddressTable):
+        if not (ip_addresses or port):
+            return list(addresses)
+        ip_addresses = list(ip_addresses or [])
+        if port:
+            ip_addresses += list_port_ip_addresses(port=port,
+                                                   subnets=subnets)
+        return addresses.list_by_ip(ip_addresses)
+
     if port:
         # filter addresses by port IP addresses
         ip_addresses = set(ip_addresses) if ip_addresses else set()
@@ -279,14 +679,14 @@ def list_port_ip_addresses(port, subnets=None):
         fixed_ips = [fixed_ip
                      for fixed_ip in fixed_ips
                      if fixed_ip['subnet_id'] in subnets]
-    return [ip['ip_address'] for ip in port['fixed_ips']]
+    return [ip['ip_address'] for ip in fixed_ips]
 
 
 def get_port_device_name(addresses, port):
     for address in list_ip_addresses(addresses=addresses, port=port):
         return address.device.name
 
-    msg = "Port %r fixed IPs not found on server.".format(port['id'])
+    msg = "Port {!r} fixed IPs not found on server.".format(port['id'])
     raise ValueError(msg)
 
 
@@ -314,3 +714,11 @@ class Route(HasProperties,
     @property
     def src_ip(self):
         return netaddr.IPAddress(self.src)
+
+
+def _join_args(args):
+    """Joins command arguments quoting them for a POSIX shell
+
+    The same quoting is understood by 'ip -batch' command.
+    """
+    return ' '.join(shlex_quote(str(arg)) for arg in args)
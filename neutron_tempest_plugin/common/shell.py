@@ -15,12 +15,18 @@
 #    under the License.
 
 import collections
+from concurrent import futures
+import os
+import select
+import signal
 import subprocess
-import sys
+import threading
+import time
 
 from oslo_log import log
 from tempest.lib import exceptions as lib_exc
 
+from neutron_tempest_plugin.common import capture
 from neutron_tempest_plugin.common import ssh
 from neutron_tempest_plugin import config
 from neutron_tempest_plugin import exceptions
@@ -30,25 +36,69 @@ LOG = log.getLogger(__name__)
 
 CONF = config.CONF
 
-if ssh.Client.proxy_jump_host:
-    # Perform all SSH connections passing through configured SSH server
-    SSH_PROXY_CLIENT = ssh.Client.create_proxy_client()
-else:
-    SSH_PROXY_CLIENT = None
+# Max number of bytes read from a local command stream at once
+READ_CHUNK_SIZE = 32768
 
+# Time in seconds to wait for a killed local command to close its streams
+LOCAL_KILL_TIMEOUT = 5.
 
-def execute(command, ssh_client=None, timeout=None, check=True):
+# Max number of bytes of command output written to the log
+MAX_LOG_OUTPUT_SIZE = 65536
+
+# SSH client connected to proxy jump host, created on first use
+_SSH_PROXY_CLIENT = None
+_SSH_PROXY_CLIENT_LOCK = threading.Lock()
+
+
+def get_ssh_proxy_client():
+    """Gets the SSH client used to execute commands on proxy jump host
+
+    The client is created the first time this function is called, so that
+    processes not executing any command don't have to care about it. When
+    its connection to proxy jump host is found broken, the client is closed
+    so that it connects again as soon as it is used.
+
+    :returns: ssh.Client instance or None when no proxy jump host is
+    configured
+    """
+    global _SSH_PROXY_CLIENT
+    if not ssh.Client.proxy_jump_host:
+        return None
+
+    with _SSH_PROXY_CLIENT_LOCK:
+        client = _SSH_PROXY_CLIENT
+        if client is None:
+            # Perform all SSH connections passing through configured SSH
+            # server
+            client = _SSH_PROXY_CLIENT = ssh.Client.create_proxy_client()
+        elif client.connected and not client.is_active():
+            LOG.debug("Connection to proxy jump host %r is broken: "
+                      "reconnecting", client.host)
+            client.close()
+        return client
+
+
+def execute(command, ssh_client=None, timeout=None, check=True,
+            stdout_callback=None, stderr_callback=None):
     """Execute command inside a remote or local shell
 
     :param command: command string to be executed
 
-    :param ssh_client: SSH client instance used for remote shell execution
+    :param ssh_client: SSH client instance used for remote shell execution.
+    It can also be a ssh.ShellSession instance to execute the command in an
+    already running remote shell.
 
     :param timeout: command execution timeout in seconds
 
     :param check: when False it doesn't raises ShellCommandError when
     exit status is not zero. True by default
 
+    :param stdout_callback: callable receiving every line written by command
+    to STDOUT as soon as it is received
+
+    :param stderr_callback: callable receiving every line written by command
+    to STDERR as soon as it is received
+
     :returns: STDOUT text when command execution terminates with zero exit
     status.
 
@@ -60,46 +110,117 @@ def execute(command, ssh_client=None, timeout=None, check=True):
     :raises ShellCommandError: when command execution terminates with non-zero
     exit status.
     """
-    ssh_client = ssh_client or SSH_PROXY_CLIENT
+    ssh_client = ssh_client or get_ssh_proxy_client()
     if timeout:
         timeout = float(timeout)
 
+    stdout = capture.OutputBuffer(line_callback=stdout_callback)
+    stderr = capture.OutputBuffer(line_callback=stderr_callback)
     if ssh_client:
         result = execute_remote_command(command=command, timeout=timeout,
-                                        ssh_client=ssh_client)
+                                        ssh_client=ssh_client,
+                                        stdout=stdout, stderr=stderr)
     else:
-        result = execute_local_command(command=command, timeout=timeout)
+        result = execute_local_command(command=command, timeout=timeout,
+                                       stdout=stdout, stderr=stderr)
 
     if result.exit_status == 0:
         LOG.debug("Command %r succeeded:\n"
                   "stderr:\n%s\n"
                   "stdout:\n%s\n",
-                  command, result.stderr, result.stdout)
+                  command, _get_log_text(result.stderr_data),
+                  _get_log_text(result.stdout_data))
     elif result.exit_status is None:
         LOG.debug("Command %r timeout expired (timeout=%s):\n"
                   "stderr:\n%s\n"
                   "stdout:\n%s\n",
-                  command, timeout, result.stderr, result.stdout)
+                  command, timeout, _get_log_text(result.stderr_data),
+                  _get_log_text(result.stdout_data))
     else:
         LOG.debug("Command %r failed (exit_status=%s):\n"
                   "stderr:\n%s\n"
                   "stdout:\n%s\n",
-                  command, result.exit_status, result.stderr, result.stdout)
+                  command, result.exit_status,
+                  _get_log_text(result.stderr_data),
+                  _get_log_text(result.stdout_data))
     if check:
         result.check()
 
     return result
 
 
-def execute_remote_command(command, ssh_client, timeout=None):
+def execute_many(command, ssh_clients, timeout=None, check=True,
+                 max_workers=None):
+    """Execute the same command on many remote hosts concurrently
+
+    :param command: command string (or shell script) to be executed
+
+    :param ssh_clients: SSH clients (or ssh.ShellSession instances) of remote
+    hosts where to execute the command
+
+    :param timeout: global timeout in seconds: every command execution is
+    interrupted when it expires, commands not started yet are not executed
+    at all and are reported as expired
+
+    :param check: when True it raises the error of the first host (in
+    ssh_clients order) whose command failed or expired. True by default
+
+    :param max_workers: max number of hosts executing the command at the
+    same time. By default all of them run concurrently.
+
+    :returns: list of ShellExecuteResult, one for every SSH client in the
+    same order
+    """
+    ssh_clients = list(ssh_clients)
+    if not ssh_clients:
+        return []
+
+    end_of_time = timeout and time.time() + float(timeout)
+
+    def execute_on(ssh_client):
+        remaining = end_of_time and end_of_time - time.time()
+        if end_of_time and remaining <= 0.:
+            LOG.debug("Command %r not executed on remote host %r: timeout "
+                      "expired (timeout=%s)", command, ssh_client.host,
+                      timeout)
+            return ShellExecuteResult(command=command, timeout=timeout,
+                                      exit_status=None, stdout='',
+                                      stderr='')
+        return execute(command, ssh_client=ssh_client, timeout=remaining,
+                       check=False)
+
+    with futures.ThreadPoolExecutor(
+            max_workers=max_workers or len(ssh_clients)) as executor:
+        jobs = [executor.submit(execute_on, ssh_client)
+                for ssh_client in ssh_clients]
+    results = [job.result() for job in jobs]
+    if check:
+        for result in results:
+            result.check()
+    return results
+
+
+def execute_remote_command(command, ssh_client, timeout=None, stdout=None,
+                           stderr=None):
     """Execute command on a remote host using SSH client"""
     LOG.debug("Executing command %r on remote host %r (timeout=%r)...",
               command, ssh_client.host, timeout)
 
+    if isinstance(ssh_client, (ssh.Client, ssh.ShellSession)):
+        if stdout is None:
+            stdout = capture.OutputBuffer()
+        if stderr is None:
+            stderr = capture.OutputBuffer()
+        exit_status = ssh_client.execute_command(
+            command, stdout=stdout, stderr=stderr, timeout=timeout)
+        return ShellExecuteResult(command=command, timeout=timeout,
+                                  exit_status=exit_status,
+                                  stdout=stdout, stderr=stderr)
+
     stdout = stderr = exit_status = None
 
     try:
-        # TODO(fressi): re-implement to capture stderr
+        # Only plugin SSH client is able to capture stderr
         stdout = ssh_client.exec_command(command, timeout=timeout)
         exit_status = 0
 
@@ -120,51 +241,113 @@ def execute_remote_command(command, ssh_client, timeout=None):
                               stdout=stdout, stderr=stderr)
 
 
-def execute_local_command(command, timeout=None):
+def execute_local_command(command, timeout=None, stdout=None, stderr=None):
     """Execute command on local host using local shell"""
 
     LOG.debug("Executing command %r on local host (timeout=%r)...",
               command, timeout)
 
+    if stdout is None:
+        stdout = capture.OutputBuffer()
+    if stderr is None:
+        stderr = capture.OutputBuffer()
+    # Run the shell in a new process group so that on timeout it can be
+    # killed together with all its child processes
     process = subprocess.Popen(command, shell=True,
-                               universal_newlines=True,
                                stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-
-    if timeout and sys.version_info < (3, 3):
-        # TODO(fressi): re-implement to timeout support on older Pythons
-        LOG.warning("Popen.communicate method doens't support for timeout "
-                    "on Python %r", sys.version)
-        timeout = None
+                               stderr=subprocess.PIPE,
+                               preexec_fn=os.setsid)
 
-    # Wait for process execution while reading STDERR and STDOUT streams
-    if timeout:
-        try:
-            stdout, stderr = process.communicate(timeout=timeout)
-        except subprocess.TimeoutExpired:
-            # At this state I expect the process to be still running
-            # therefore it has to be kill later after calling poll()
-            LOG.exception("Command %r timeout expired.", command)
-            stdout = stderr = None
-    else:
-        stdout, stderr = process.communicate()
-
-    # Check process termination status
-    exit_status = process.poll()
-    if exit_status is None:
-        # The process is still running after calling communicate():
-        # let kill it and then read buffers again
-        process.kill()
-        stdout, stderr = process.communicate()
+    end_of_time = timeout and (time.time() + timeout)
+    streams = {process.stdout.fileno(): stdout,
+               process.stderr.fileno(): stderr}
+    exit_status = None
+    try:
+        # Wait for process execution while reading STDERR and STDOUT streams
+        _read_streams(streams, end_of_time)
+        exit_status = _wait_process(process, end_of_time)
+    finally:
+        if exit_status is None:
+            # The process is still running: let kill it and then read
+            # buffers again
+            LOG.debug("Command %r timeout expired: killing it.", command)
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                # Process group has already gone
+                pass
+            _read_streams(streams, time.time() + LOCAL_KILL_TIMEOUT)
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        stdout.flush()
+        stderr.flush()
 
     return ShellExecuteResult(command=command, timeout=timeout,
                               stdout=stdout, stderr=stderr,
                               exit_status=exit_status)
 
 
+def _read_streams(streams, end_of_time=None):
+    streams = dict(streams)
+    while streams:
+        timeout = None
+        if end_of_time:
+            timeout = end_of_time - time.time()
+            if timeout <= 0.:
+                return
+        readable, _, _ = select.select(list(streams), [], [], timeout)
+        for fd in readable:
+            data = os.read(fd, READ_CHUNK_SIZE)
+            if data:
+                streams[fd].write(data)
+            else:
+                # End of stream
+                del streams[fd]
+
+
+def _wait_process(process, end_of_time=None):
+    # STDOUT and STDERR has been closed: process is very likely exiting
+    exit_status = process.poll()
+    while exit_status is None:
+        if end_of_time and time.time() >= end_of_time:
+            break
+        time.sleep(.01)
+        exit_status = process.poll()
+    return exit_status
+
+
+def _get_log_text(output):
+    if not isinstance(output, capture.OutputBuffer):
+        return output
+    return output.head(MAX_LOG_OUTPUT_SIZE)
+
+
 class ShellExecuteResult(collections.namedtuple(
         'ShellExecuteResult', ['command', 'timeout', 'exit_status', 'stdout',
                                'stderr'])):
+    """Result of a command execution
+
+    STDOUT and STDERR can be given as text or as capture.OutputBuffer
+    instances: in such case they are decoded only when stdout and stderr
+    attributes are accessed.
+    """
+
+    @property
+    def stdout_data(self):
+        return self[3]
+
+    @property
+    def stderr_data(self):
+        return self[4]
+
+    @property
+    def stdout(self):
+        return _get_text(self.stdout_data)
+
+    @property
+    def stderr(self):
+        return _get_text(self.stderr_data)
 
     def check(self):
         if self.exit_status is None:
@@ -174,7 +357,13 @@ class ShellExecuteResult(collections.namedtuple(
                                                  stdout=self.stdout)
 
         elif self.exit_status != 0:
-            raise exceptions.ShellCommandError(command=self.command,
-                                               exit_status=self.exit_status,
-                                               stderr=self.stderr,
-                                               stdout=self.stdout)
+            raise exceptions.ShellCommandFailed(command=self.command,
+                                                exit_status=self.exit_status,
+                                                stderr=self.stderr,
+                                                stdout=self.stdout)
+
+
+def _get_text(output):
+    if not isinstance(output, capture.OutputBuffer):
+        return output
+    return output.decode()
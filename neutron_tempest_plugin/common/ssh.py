@@ -12,15 +12,20 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import atexit
 import locale
 import os
+import select
+import threading
 import time
+import uuid
 
 from oslo_log import log
 import paramiko
 from tempest.lib.common import ssh
 from tempest.lib import exceptions
 
+from neutron_tempest_plugin.common import capture
 from neutron_tempest_plugin import config
 from neutron_tempest_plugin import exceptions as exc
 
@@ -35,6 +40,18 @@ class Client(ssh.Client):
 
     timeout = CONF.validation.ssh_timeout
 
+    # Max number of script bytes sent with a single channel write
+    write_chunk_size = 32768
+
+    # Max number of output bytes received with a single channel read
+    read_chunk_size = 32768
+
+    # Seconds to wait before trying again to send script bytes when remote
+    # window is full
+    send_poll_interval = .05
+
+    use_connection_pool = CONF.neutron_plugin_options.ssh_connection_pool
+
     proxy_jump_host = CONF.neutron_plugin_options.ssh_proxy_jump_host
     proxy_jump_username = CONF.neutron_plugin_options.ssh_proxy_jump_username
     proxy_jump_password = CONF.neutron_plugin_options.ssh_proxy_jump_password
@@ -123,17 +140,34 @@ class Client(ssh.Client):
     # attribute used to keep reference to opened client connection
     _client = None
 
+    @property
+    def connection_key(self):
+        """Identifies connections that can be shared between clients"""
+        pkey = self.pkey and self.pkey.get_fingerprint()
+        proxy_key = None
+        if self.proxy_client is not None:
+            proxy_key = getattr(self.proxy_client, 'connection_key',
+                                id(self.proxy_client))
+        return (self.host, self.port, self.username, self.password, pkey,
+                self.key_filename, self.look_for_keys, proxy_key)
+
     def connect(self, *args, **kwargs):
         """Creates paramiko.SSHClient and connect it to remote SSH server
 
         In case this method is called more times it returns the same client
         and no new SSH connection is created until close method is called.
+        When use_connection_pool is True connections are taken from
+        CONNECTION_POOL, so that all clients with the same connection_key
+        share the same connection.
 
         :returns: paramiko.Client connected to remote server.
 
         :raises tempest.lib.exceptions.SSHTimeout: in case it fails to connect
         to remote server.
         """
+        if self.use_connection_pool:
+            return self._get_pooled_connection(*args, **kwargs)
+
         client = self._client
         if client is None:
             client = super(Client, self)._get_ssh_connection(
@@ -142,21 +176,70 @@ class Client(ssh.Client):
 
         return client
 
+    @property
+    def connected(self):
+        """True when connect method has been called but not close one"""
+        return self._client is not None
+
+    def is_active(self):
+        """Checks if client connection to SSH server is still working"""
+        client = self._client
+        return client is not None and _is_active(client)
+
+    def _get_pooled_connection(self, *args, **kwargs):
+        exclude = kwargs.pop('exclude', None)
+        self._client = client = CONNECTION_POOL.get(
+            self.connection_key,
+            lambda: super(Client, self)._get_ssh_connection(*args, **kwargs),
+            exclude=exclude)
+        return client
+
     # This overrides superclass protected method to make sure exec_command
     # method is going to reuse the same SSH client and connection if called
     # more times
     _get_ssh_connection = connect
 
-    # This overrides superclass test_connection_auth method forbidding it to
-    # close connection
-    test_connection_auth = connect
+    def test_connection_auth(self):
+        """Checks the server accepts a new connection with client credentials
+
+        It always opens and then closes a new connection, ignoring the
+        connection of this client and the shared ones, so that it verifies
+        the server is reachable when it is called.
+        """
+        connection = super(Client, self)._get_ssh_connection()
+        connection.close()
+
+    # attribute used to keep reference to opened shell session
+    _shell_session = None
+
+    def get_shell_session(self):
+        """Gets a persistent shell session running on remote server
+
+        In case this method is called more times it returns the same session
+        until it is closed.
+
+        :returns: ShellSession instance
+        """
+        session = self._shell_session
+        if session is None or session.closed:
+            self._shell_session = session = ShellSession(self)
+        return session
 
     def close(self):
-        """Closes connection to SSH server and cleanup resources."""
+        """Closes connection to SSH server and cleanup resources.
+
+        Pooled connections are not closed as other clients could be using
+        them: they are closed by the pool after they stay unused for a while.
+        """
+        session = self._shell_session
+        if session is not None:
+            session.close()
+            self._shell_session = None
         client = self._client
         if client is not None:
-            client.close()
             self._client = None
+            if not self.use_connection_pool:
+                client.close()
 
     def __exit__(self, _exception_type, _exception_value, _traceback):
         self.close()
@@ -170,7 +253,18 @@ class Client(ssh.Client):
         client = self.connect()
 
         try:
-            return client.get_transport().open_session()
+            try:
+                return client.get_transport().open_session()
+            except (EOFError, paramiko.SSHException):
+                if not self.use_connection_pool:
+                    raise
+                # Pooled connection could have been broken while it was
+                # unused or the server could refuse to open more channels
+                # on it: try once again with another one
+                LOG.debug("Unable to open SSH session on pooled connection "
+                          "to %r: trying with another one", self.host)
+                client = self._get_pooled_connection(exclude=client)
+                return client.get_transport().open_session()
         except paramiko.SSHException:
             # the request is rejected, the session ends prematurely or
             # there is a timeout opening a channel
@@ -179,6 +273,19 @@ class Client(ssh.Client):
                                         user=self.username,
                                         password=self.password)
 
+    def _get_proxy_channel(self):
+        if not isinstance(self.proxy_client, Client):
+            return super(Client, self)._get_proxy_channel()
+
+        # Open the channel the same way as any other session so that it
+        # gets a pooled proxy connection accepting new channels
+        chan = self.proxy_client.open_session()
+        # Keep a reference to avoid g/c
+        # https://github.com/paramiko/paramiko/issues/440
+        self._proxy_conn = self.proxy_client._client
+        chan.exec_command('nc %s %s' % (self.host, self.port))
+        return chan
+
     def exec_command(self, cmd, encoding="utf-8", timeout=None):
         if timeout:
             original_timeout = self.timeout
@@ -233,9 +340,6 @@ class Client(ssh.Client):
 
         timeout = timeout or self.timeout
         end_of_time = time.time() + timeout
-        output_data = b''
-        error_data = b''
-        exit_status = None
 
         channel = self.open_session()
         with channel:
@@ -256,43 +360,19 @@ class Client(ssh.Client):
             # Spawn a Bash
             channel.exec_command(shell)
 
-            end_of_script = False
-            lines_iterator = iter(script.splitlines())
-            while (not channel.exit_status_ready() and
-                   time.time() < end_of_time):
-                # Drain incoming data buffers
-                while channel.recv_ready():
-                    output_data += channel.recv(self.buf_size)
-                while channel.recv_stderr_ready():
-                    error_data += channel.recv_stderr(self.buf_size)
-
-                if not end_of_script and channel.send_ready():
-                    try:
-                        line = next(lines_iterator)
-                    except StopIteration:
-                        # Finalize Bash script execution
-                        channel.shutdown_write()
-                        end_of_script = True
-                    else:
-                        # Send script to Bash STDIN line by line
-                        channel.send((line + '\n').encode(encoding))
-                        continue
-
-                time.sleep(.1)
+            stdout_buffer = capture.OutputBuffer(encoding=encoding)
+            stderr_buffer = capture.OutputBuffer(encoding=encoding)
+            script_data = ''.join(
+                line + '\n' for line in script.splitlines()).encode(encoding)
+            exit_status = self._communicate(
+                channel, input_data=script_data, stdout=stdout_buffer,
+                stderr=stderr_buffer, end_of_time=end_of_time)
 
-            # Get exit status and drain incoming data buffers
-            if channel.exit_status_ready():
-                exit_status = channel.recv_exit_status()
-            while channel.recv_ready():
-                output_data += channel.recv(self.buf_size)
-            while channel.recv_stderr_ready():
-                error_data += channel.recv_stderr(self.buf_size)
-
-        stdout = _buffer_to_string(output_data, encoding)
+        stdout = stdout_buffer.decode()
         if exit_status == 0:
             return stdout
 
-        stderr = _buffer_to_string(error_data, encoding)
+        stderr = stderr_buffer.decode()
         if exit_status is None:
             raise exc.SSHScriptTimeoutExpired(
                 command=shell, host=self.host, script=script, stderr=stderr,
@@ -302,7 +382,443 @@ class Client(ssh.Client):
                 command=shell, host=self.host, script=script, stderr=stderr,
                 stdout=stdout, exit_status=exit_status)
 
+    def execute_command(self, command, stdout, stderr, timeout=None):
+        """Executes a command on remote machine streaming its output
+
+        :param command: command line to be executed
+
+        :param stdout: object whose write method receives data written by
+        command to STDOUT (like capture.OutputBuffer)
+
+        :param stderr: object whose write method receives data written by
+        command to STDERR
+
+        :param timeout: time in seconds to wait before brutally aborting
+        command execution.
+
+        :returns: command exit status or None if timeout expired before
+        command termination
+
+        :raises tempest.lib.exceptions.SSHTimeout: in case it fails to connect
+        to remote server or it fails to open a channel.
+        """
+        end_of_time = time.time() + (timeout or self.timeout)
+        channel = self.open_session()
+        with channel:
+            channel.exec_command(command)
+            return self._communicate(channel, input_data=None,
+                                     stdout=stdout, stderr=stderr,
+                                     end_of_time=end_of_time)
+
+    def _communicate(self, channel, input_data, stdout, stderr, end_of_time):
+        # Never block on channel operations: waiting for incoming data is up
+        # to select
+        channel.settimeout(0.)
+        input_sent = 0
+        end_of_input = False
+        exit_status = None
+        while time.time() < end_of_time:
+            if not end_of_input:
+                # Send input data to STDIN as fast as the channel window
+                # allows
+                if input_data and channel.send_ready():
+                    input_sent += channel.send(
+                        input_data[input_sent:
+                                   input_sent + self.write_chunk_size])
+                if input_sent >= len(input_data or b''):
+                    # Close remote STDIN
+                    channel.shutdown_write()
+                    end_of_input = True
+
+            # Drain incoming data buffers
+            self._drain_channel(channel, stdout, stderr)
+
+            if channel.exit_status_ready():
+                break
+
+            timeout = max(0., end_of_time - time.time())
+            if not end_of_input:
+                # There is no event telling when remote window gets room
+                # for more data
+                if channel.send_ready():
+                    timeout = 0.
+                else:
+                    timeout = min(timeout, self.send_poll_interval)
+            if channel.eof_received:
+                # Channel is always readable after EOF: just wait for the
+                # exit status
+                channel.status_event.wait(timeout)
+            else:
+                select.select([channel], [], [], timeout)
+
+        # Get exit status and drain incoming data buffers
+        if channel.exit_status_ready():
+            exit_status = channel.recv_exit_status()
+        self._drain_channel(channel, stdout, stderr)
+        stdout.flush()
+        stderr.flush()
+        return exit_status
+
+    def _drain_channel(self, channel, stdout, stderr):
+        while channel.recv_ready():
+            stdout.write(channel.recv(self.read_chunk_size))
+        while channel.recv_stderr_ready():
+            stderr.write(channel.recv_stderr(self.read_chunk_size))
+
+
+class ConnectionPool(object):
+    """Shares SSH connections between clients of this process
+
+    Connections are identified by a key (see Client.connection_key). As
+    paramiko multiplexes channels over a connection, a few connections are
+    enough for all clients connecting to the same server with the same
+    credentials: a new one is opened only when all of them already have
+    max_sessions open channels (see MaxSessions option of OpenSSH server).
+    Connections send keepalive messages and they are closed after staying
+    unused for idle_timeout seconds.
+
+    :param idle_timeout: seconds after which an unused connection is closed
 
-def _buffer_to_string(data_buffer, encoding):
-    return data_buffer.decode(encoding).replace("\r\n", "\n").replace(
-        "\r", "\n")
+    :param keepalive_interval: seconds between keepalive messages
+
+    :param max_sessions: max number of channels opened on the same
+    connection
+    """
+
+    def __init__(self, idle_timeout=None, keepalive_interval=None,
+                 max_sessions=10):
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.max_sessions = max_sessions
+        # key -> list of [client, last_used] entries
+        self._connections = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, connect, exclude=None):
+        """Gets an active connection for given key
+
+        :param key: hashable object identifying the connection
+
+        :param connect: callable used to create a new paramiko.SSHClient
+        when there is no active connection for given key accepting new
+        channels
+
+        :param exclude: connection not to be returned (ie. because it
+        failed opening a new channel)
+
+        :returns: paramiko.SSHClient instance
+        """
+        self.close_idle()
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Only one client at a time can connect for the same key, while
+        # other clients wait to reuse its connection
+        with key_lock:
+            with self._lock:
+                entries = self._connections.setdefault(key, [])
+                inactive = [entry for entry in entries
+                            if entry[0] is exclude or not _is_active(entry[0])]
+                for entry in inactive:
+                    entries.remove(entry)
+                available = [entry for entry in entries
+                             if self._accepts_channels(entry[0])]
+                entry = available[0] if available else None
+            for client, _ in inactive:
+                if not _count_open_channels(client):
+                    LOG.debug("Closing SSH connection %r", key[:3])
+                    client.close()
+
+            if entry is None:
+                client = connect()
+                if self.keepalive_interval:
+                    client.get_transport().set_keepalive(
+                        self.keepalive_interval)
+                entry = [client, time.time()]
+                with self._lock:
+                    entries.append(entry)
+            entry[1] = time.time()
+        return entry[0]
+
+    def _accepts_channels(self, client):
+        return _count_open_channels(client) < self.max_sessions
+
+    def close_idle(self):
+        """Closes connections not used for more than idle_timeout seconds"""
+        if not self.idle_timeout:
+            return
+
+        deadline = time.time() - self.idle_timeout
+        idle = []
+        with self._lock:
+            for key, entries in self._connections.items():
+                for entry in list(entries):
+                    # Connections with open channels are still being used
+                    if entry[1] >= deadline or _count_open_channels(
+                            entry[0]):
+                        continue
+                    entries.remove(entry)
+                    idle.append((key, entry[0]))
+        for key, client in idle:
+            LOG.debug("Closing idle SSH connection %r", key[:3])
+            client.close()
+
+    def evict(self, host):
+        """Stops sharing connections to given host
+
+        Connections without open channels are closed, while the others are
+        left to the clients using them. Next clients connecting to the host
+        open new connections (ie. after a floating IP address is associated
+        to another server).
+        """
+        evicted = []
+        with self._lock:
+            for key, entries in self._connections.items():
+                if key[0] == host:
+                    evicted.extend(entry[0] for entry in entries)
+                    del entries[:]
+        for client in evicted:
+            if not _count_open_channels(client):
+                LOG.debug("Closing SSH connection to evicted host %r", host)
+                client.close()
+
+    def close_all(self):
+        with self._lock:
+            connections = [entry[0] for entries in self._connections.values()
+                           for entry in entries]
+            self._connections.clear()
+        for client in connections:
+            client.close()
+
+
+def _is_active(client):
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+def _count_open_channels(client):
+    transport = client.get_transport()
+    # Transport doesn't expose open channels but through this attribute
+    channels = getattr(transport, '_channels', None)
+    return 0 if channels is None else len(channels)
+
+
+CONNECTION_POOL = ConnectionPool(
+    idle_timeout=CONF.neutron_plugin_options.ssh_pool_idle_timeout,
+    keepalive_interval=CONF.neutron_plugin_options.ssh_keepalive_interval,
+    max_sessions=CONF.neutron_plugin_options.ssh_pool_max_sessions)
+atexit.register(CONNECTION_POOL.close_all)
+
+
+class ShellSession(object):
+    """Long-lived remote shell executing commands one after the other
+
+    Commands are sent to the STDIN of a single remote shell instead of
+    opening a new SSH channel for every command. The end of every command
+    output is marked on both STDOUT and STDERR by a line made of a unique
+    sentinel string followed by command exit status.
+
+    Every command is executed in a sub-shell with STDIN redirected from
+    /dev/null, so it can't change the state of the session shell or consume
+    next commands. Output written by background processes after their
+    command has terminated is received as output of next commands.
+
+    It implements execute_command and exec_command methods as Client class,
+    so it can be used as ssh_client parameter of shell.execute function.
+
+    :param client: Client instance used to open the session
+    :param shell: command line used to launch the remote shell
+    """
+
+    def __init__(self, client, shell='sh'):
+        self.client = client
+        self.shell = shell
+        self.closed = False
+        self._channel = None
+        self._lock = threading.Lock()
+        # Output received after the end of the last command
+        self._stdout_pending = b''
+        self._stderr_pending = b''
+
+    @property
+    def host(self):
+        return self.client.host
+
+    @property
+    def timeout(self):
+        return self.client.timeout
+
+    def _get_channel(self):
+        if self.closed:
+            raise exc.ShellSessionClosed(host=self.host)
+        channel = self._channel
+        if channel is None:
+            self._channel = channel = self.client.open_session()
+            channel.exec_command(self.shell)
+            # Never block on channel operations
+            channel.settimeout(0.)
+        return channel
+
+    def close(self):
+        self.closed = True
+        self._stdout_pending = self._stderr_pending = b''
+        channel = self._channel
+        if channel is not None:
+            self._channel = None
+            channel.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _traceback):
+        self.close()
+
+    def execute_command(self, command, stdout, stderr, timeout=None):
+        """Executes a command in the remote shell streaming its output
+
+        See Client.execute_command for parameters. In case timeout expires
+        the session is closed, as there is no way to stop the command alone.
+
+        :returns: command exit status or None if timeout expired before
+        command termination
+
+        :raises neutron_tempest_plugin.exceptions.ShellSessionTerminated: if
+        the remote shell terminated before the end of the command
+        """
+        end_of_time = time.time() + (timeout or self.timeout)
+        sentinel = 'END-OF-COMMAND-{!s}'.format(uuid.uuid4().hex)
+        script = ("( {command}\n) < /dev/null\n"
+                  "__exit_status=$?\n"
+                  "printf '\\n{sentinel} %d\\n' $__exit_status\n"
+                  "printf '\\n{sentinel} %d\\n' $__exit_status >&2\n"
+                  ).format(command=command, sentinel=sentinel)
+        marker = ('\n' + sentinel + ' ').encode('ascii')
+        stdout_reader = _SentinelReader(stdout, marker)
+        stderr_reader = _SentinelReader(stderr, marker)
+
+        with self._lock:
+            channel = self._get_channel()
+            try:
+                self._send(channel, script.encode('utf-8'), end_of_time)
+                stdout_reader.feed(self._stdout_pending)
+                stderr_reader.feed(self._stderr_pending)
+                self._stdout_pending = self._stderr_pending = b''
+                while not (stdout_reader.done and stderr_reader.done):
+                    # Both streams are drained, as the channel is selected
+                    # as readable until there is data in any of them. Output
+                    # following the sentinel is kept by readers for next
+                    # command.
+                    while channel.recv_ready():
+                        stdout_reader.feed(channel.recv(
+                            self.client.read_chunk_size))
+                    while channel.recv_stderr_ready():
+                        stderr_reader.feed(channel.recv_stderr(
+                            self.client.read_chunk_size))
+                    if stdout_reader.done and stderr_reader.done:
+                        break
+                    if channel.eof_received:
+                        # Remote shell has terminated (ie. the command
+                        # called exit or had a syntax error)
+                        self.close()
+                        raise exc.ShellSessionTerminated(host=self.host,
+                                                         command=command)
+                    timeout = end_of_time - time.time()
+                    if timeout <= 0.:
+                        LOG.debug("Command %r timed out on host %r: closing "
+                                  "shell session", command, self.host)
+                        self.close()
+                        return None
+                    select.select([channel], [], [], timeout)
+            except Exception:
+                # Session state is unknown
+                self.close()
+                raise
+            finally:
+                stdout_reader.flush()
+                stderr_reader.flush()
+            if not self.closed:
+                self._stdout_pending = stdout_reader.remaining
+                self._stderr_pending = stderr_reader.remaining
+        return stdout_reader.exit_status
+
+    def exec_command(self, cmd, encoding="utf-8", timeout=None):
+        """Executes a command in the remote shell
+
+        :returns: STDOUT text
+
+        :raises tempest.lib.exceptions.TimeoutException: if timeout expires
+        before command termination
+
+        :raises tempest.lib.exceptions.SSHExecCommandFailed: if command exit
+        status is not zero
+        """
+        stdout = capture.OutputBuffer(encoding=encoding)
+        stderr = capture.OutputBuffer(encoding=encoding)
+        exit_status = self.execute_command(cmd, stdout=stdout, stderr=stderr,
+                                           timeout=timeout)
+        if exit_status is None:
+            raise exceptions.TimeoutException(
+                "Command {!r} timed out on host {!r}".format(cmd, self.host))
+        if exit_status != 0:
+            raise exceptions.SSHExecCommandFailed(
+                command=cmd, exit_status=exit_status,
+                stderr=stderr.decode(), stdout=stdout.decode())
+        return stdout.decode()
+
+    def _send(self, channel, data, end_of_time):
+        sent = 0
+        while sent < len(data):
+            if channel.send_ready():
+                sent += channel.send(
+                    data[sent:sent + self.client.write_chunk_size])
+            elif time.time() < end_of_time:
+                # There is no event telling when remote window gets room for
+                # more data
+                time.sleep(self.client.send_poll_interval)
+            else:
+                raise exceptions.TimeoutException(
+                    "Unable to send command to host {!r}".format(self.host))
+
+
+class _SentinelReader(object):
+    """Forwards data to output until sentinel line is received
+
+    Data received after the sentinel line is kept in remaining attribute.
+    """
+
+    def __init__(self, output, marker):
+        self.output = output
+        self.marker = marker
+        self.exit_status = None
+        self.done = False
+        self.remaining = b''
+        self._pending = bytearray()
+
+    def feed(self, data):
+        if self.done:
+            self.remaining += bytes(data)
+            return
+
+        pending = self._pending
+        pending += data
+        index = pending.find(self.marker)
+        if index < 0:
+            # Keep the bytes that could be the beginning of the marker
+            keep = len(self.marker) - 1
+            if len(pending) > keep:
+                self.output.write(bytes(pending[:-keep]))
+                del pending[:-keep]
+            return
+
+        if index:
+            self.output.write(bytes(pending[:index]))
+            del pending[:index]
+        end_of_line = pending.find(b'\n', len(self.marker))
+        if end_of_line >= 0:
+            self.exit_status = int(pending[len(self.marker):end_of_line])
+            self.done = True
+            self.remaining = bytes(pending[end_of_line + 1:])
+            del pending[:]
+
+    def flush(self):
+        self.output.flush()
@@ -0,0 +1,223 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from concurrent import futures
+import json
+import os
+import threading
+import weakref
+
+from oslo_log import log
+from six.moves import shlex_quote
+
+from neutron_tempest_plugin.common import bandwidth
+from neutron_tempest_plugin.common import shell
+from neutron_tempest_plugin.common import traffic_agent
+from neutron_tempest_plugin import exceptions
+
+
+LOG = log.getLogger(__name__)
+
+AGENT_SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'traffic_agent.py')
+
+REMOTE_AGENT_PATH = '/tmp/traffic_agent.py'
+
+DEFAULT_PORT = 5001
+
+# Python interpreters looked for on guests, in order of preference
+PYTHON_COMMANDS = ('python3', 'python', 'python2')
+
+# Extra seconds given to remote agent to exit after transfer timeout
+_REMOTE_EXIT_TIMEOUT = 10.
+
+# SSH client -> (python, remote_path) pair, or None when there is no Python
+# interpreter on remote host
+_AGENTS = weakref.WeakKeyDictionary()
+_AGENTS_LOCK = threading.Lock()
+
+
+class TrafficResult(object):
+    """Results of a transfer between test runner and a guest
+
+    :param sender: results reported by the sending side
+
+    :param receiver: results reported by the receiving side
+    """
+
+    def __init__(self, sender, receiver):
+        self.sender = sender
+        self.receiver = receiver
+        self.protocol = receiver['protocol']
+        self.measurements = [
+            bandwidth.BandwidthMeasurement(
+                [bandwidth.BandwidthSample(*sample)
+                 for sample in stream.get('samples', [])],
+                start_time=stream.get('start_time'))
+            for stream in receiver['streams']]
+
+    @property
+    def bytes_sent(self):
+        return self.sender['bytes']
+
+    @property
+    def bytes_received(self):
+        return self.receiver['bytes']
+
+    @property
+    def rate(self):
+        """Steady-state bytes per second received by all streams"""
+        return sum(measurement.rate for measurement in self.measurements)
+
+    @property
+    def average_rate(self):
+        """Bytes per second received over the whole transfer"""
+        return self.receiver['rate']
+
+    @property
+    def loss(self):
+        """Fraction of sent bytes not received (relevant for UDP)"""
+        if not self.bytes_sent:
+            return 0.
+        return max(0., 1. - float(self.bytes_received) / self.bytes_sent)
+
+    def __str__(self):
+        return ('{!s}: {:d} bytes sent, {:d} bytes received in {:.3f} s, '
+                'rate={:.0f} B/s, average={:.0f} B/s, loss={:.1%}').format(
+                    self.protocol, self.bytes_sent, self.bytes_received,
+                    self.receiver['duration'], self.rate, self.average_rate,
+                    self.loss)
+
+
+def find_python(ssh_client):
+    """Looks for a Python interpreter on remote host
+
+    :returns: interpreter command or None when there is no one (ie. CirrOS)
+    """
+    command = ' || '.join('command -v {!s}'.format(python)
+                          for python in PYTHON_COMMANDS)
+    output = shell.execute(command, ssh_client=ssh_client, check=False).stdout
+    for line in (output or '').splitlines():
+        if line.strip():
+            return line.strip()
+    return None
+
+
+def deploy_agent(ssh_client, remote_path=REMOTE_AGENT_PATH):
+    """Copies traffic agent script to remote host using SFTP"""
+    sftp = ssh_client.connect().open_sftp()
+    try:
+        sftp.put(AGENT_SOURCE_PATH, remote_path)
+    finally:
+        sftp.close()
+    return remote_path
+
+
+def get_agent(ssh_client):
+    """Gets the command running traffic agent on remote host
+
+    The first time it is called for an SSH client it looks for a Python
+    interpreter and deploys the agent. Results are then reused for later
+    calls with the same client.
+
+    :returns: (python, remote_path) pair or None when the remote host has no
+    Python interpreter
+    """
+    with _AGENTS_LOCK:
+        if ssh_client in _AGENTS:
+            return _AGENTS[ssh_client]
+    python = find_python(ssh_client)
+    agent = python and (python, deploy_agent(ssh_client))
+    with _AGENTS_LOCK:
+        _AGENTS[ssh_client] = agent
+    return agent
+
+
+def measure(ssh_client, host, direction='egress', protocol='tcp',
+            port=DEFAULT_PORT, streams=1, duration=None, size=None, rate=None,
+            sample_interval=None, timeout=60., started=None):
+    """Measures traffic between a guest and the test runner
+
+    The traffic agent listens on the guest while the test runner connects to
+    it (ie. through a floating IP), then the transfer happens in given
+    direction.
+
+    :param ssh_client: SSH client of the guest
+
+    :param host: IP address of the guest reachable from test runner
+
+    :param direction: 'egress' when the guest sends data, 'ingress' when it
+    receives them
+
+    :param protocol: 'tcp' or 'udp'
+
+    :param port: listening port. UDP streams use consecutive ports starting
+    from this one.
+
+    :param streams: number of parallel streams
+
+    :param duration: seconds to send data for
+
+    :param size: bytes to send with every stream
+
+    :param rate: max bytes per second sent by every stream
+
+    :param sample_interval: seconds covered by every throughput sample taken
+    by the receiving side
+
+    :param timeout: max seconds to wait for the transfer to end
+
+    :param started: threading.Event set when the test runner receives the
+    first data of an egress transfer
+
+    :returns: TrafficResult instance
+
+    :raises exceptions.TrafficAgentNotAvailable: when the guest has no
+    Python interpreter
+    """
+    agent = get_agent(ssh_client)
+    if not agent:
+        raise exceptions.TrafficAgentNotAvailable(host=ssh_client.host)
+
+    python, remote_path = agent
+    if direction == 'egress':
+        remote_direction, local_direction = 'send', 'receive'
+    else:
+        remote_direction, local_direction = 'receive', 'send'
+    options = {'protocol': protocol, 'port': port, 'streams': streams,
+               'duration': duration, 'size': size, 'rate': rate,
+               'timeout': timeout}
+    if sample_interval:
+        options['sample_interval'] = sample_interval
+    command = [python, remote_path, 'listen', '--direction', remote_direction]
+    command += ['--{!s}={!s}'.format(name.replace('_', '-'), value)
+                for name, value in sorted(options.items())
+                if value is not None]
+    command = ' '.join(shlex_quote(arg) for arg in command)
+
+    with futures.ThreadPoolExecutor(max_workers=1) as executor:
+        remote_job = executor.submit(
+            shell.execute, command, ssh_client=ssh_client,
+            timeout=timeout + _REMOTE_EXIT_TIMEOUT)
+        local_result = traffic_agent.run(
+            role='connect', host=host, direction=local_direction,
+            started=started, **options)
+    remote_result = json.loads(remote_job.result().stdout)
+
+    if direction == 'egress':
+        result = TrafficResult(sender=remote_result, receiver=local_result)
+    else:
+        result = TrafficResult(sender=local_result, receiver=remote_result)
+    LOG.debug("Traffic measured (direction=%s): %s", direction, result)
+    return result
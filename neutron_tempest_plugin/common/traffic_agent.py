@@ -0,0 +1,368 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Network traffic generator and sink
+
+This module is a self-contained script: it only depends on Python (2.7 or
+3.x) standard library, so that it can be copied to guest VMs and executed
+there (see common/traffic.py). The same functions are used in process by
+the test runner for the other side of the transfer.
+
+One side listens for connections and the other one connects to it, while
+either of them can be the sender. Every stream is a TCP connection to the
+same port or, for UDP, a pair of sockets using its own port (port + stream
+index). When the transfer ends the script prints a JSON document with the
+number of bytes sent or received by every stream and, for receivers,
+throughput samples taken every sample_interval seconds.
+
+Usage examples:
+
+    python traffic_agent.py listen --port 5001 --direction send --size 1000000
+    python traffic_agent.py connect --host 10.0.0.5 --port 5001 \\
+        --direction receive --protocol tcp --streams 2
+"""
+
+from __future__ import print_function
+
+import argparse
+import errno
+import json
+import random
+import socket
+import sys
+import threading
+import time
+
+
+# Datagram sent by UDP connecting side until the listening side answers
+HELLO = b'\0TRAFFIC-HELLO\0'
+
+# Datagram sent by UDP senders to tell receivers the transfer is over
+END = b'\0TRAFFIC-END\0'
+
+_CONTROL_SIZES = frozenset([len(HELLO), len(END)])
+
+# Seconds between retries while connecting
+RETRY_INTERVAL = .2
+
+# Seconds to wait before the second TCP connection attempt: it doubles after
+# every failed attempt up to MAX_BACKOFF seconds
+INITIAL_BACKOFF = .1
+MAX_BACKOFF = 5.
+
+# Errors meaning the listening side is not reachable yet (ie. agent not
+# listening yet or floating IP not configured yet)
+_CONNECT_RETRY_ERRNOS = frozenset([errno.ECONNREFUSED, errno.ECONNRESET,
+                                   errno.ECONNABORTED, errno.ETIMEDOUT,
+                                   errno.EHOSTUNREACH, errno.ENETUNREACH])
+
+# Seconds a UDP sender waits when kernel buffers are full
+SEND_RETRY_INTERVAL = .005
+
+# Seconds a UDP receiver waits for more data after last datagram
+UDP_IDLE_TIMEOUT = 2.
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('role', choices=['listen', 'connect'])
+    parser.add_argument('--host', default='',
+                        help='address to connect to or to listen on')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--protocol', choices=['tcp', 'udp'], default='tcp')
+    parser.add_argument('--direction', choices=['send', 'receive'],
+                        default='send')
+    parser.add_argument('--streams', type=int, default=1,
+                        help='number of parallel streams')
+    parser.add_argument('--duration', type=float,
+                        help='seconds to send data for')
+    parser.add_argument('--size', type=int,
+                        help='bytes to send with every stream')
+    parser.add_argument('--rate', type=float,
+                        help='max bytes per second sent by every stream')
+    parser.add_argument('--packet-size', type=int, default=1400,
+                        help='size of UDP datagrams')
+    parser.add_argument('--buffer-size', type=int, default=65536,
+                        help='max bytes sent or received with a single call')
+    parser.add_argument('--sample-interval', type=float, default=.5)
+    parser.add_argument('--timeout', type=float, default=60.,
+                        help='max seconds to wait for the transfer to end')
+    args = parser.parse_args(argv)
+    result = run(**vars(args))
+    print(json.dumps(result))
+
+
+def run(role, protocol='tcp', direction='send', host='', port=5001,
+        streams=1, duration=None, size=None, rate=None, packet_size=1400,
+        buffer_size=65536, sample_interval=.5, timeout=60., started=None):
+    """Executes a transfer and returns its results as a dictionary
+
+    When receiving, started (a threading.Event) is set as soon as the first
+    data are received by any stream.
+    """
+    if direction == 'send' and not (duration or size):
+        message = 'Either duration or size is required for sending'
+        raise ValueError(message)
+
+    end_of_time = time.time() + timeout
+    if protocol == 'tcp':
+        if role == 'listen':
+            sockets = _tcp_accept(host, port, streams, end_of_time)
+        else:
+            sockets = _tcp_connect(host, port, streams, end_of_time)
+    elif role == 'listen':
+        sockets = _udp_bind(host, port, streams, end_of_time)
+    else:
+        sockets = _udp_connect(host, port, streams, end_of_time)
+
+    if direction == 'send':
+        target = _send
+        kwargs = dict(duration=duration, size=size, rate=rate,
+                      chunk_size=(buffer_size if protocol == 'tcp'
+                                  else packet_size))
+    else:
+        target = _receive
+        kwargs = dict(size=size, buffer_size=buffer_size,
+                      sample_interval=sample_interval, started=started)
+
+    results = [None] * len(sockets)
+
+    def run_stream(index, sock):
+        try:
+            results[index] = target(
+                sock, protocol=protocol, end_of_time=end_of_time, **kwargs)
+        except Exception as ex:
+            results[index] = {'error': str(ex), 'bytes': 0, 'duration': 0.}
+        finally:
+            sock.close()
+
+    threads = [threading.Thread(target=run_stream, args=(index, sock))
+               for index, sock in enumerate(sockets)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total_bytes = sum(result['bytes'] for result in results)
+    total_duration = max(result['duration'] for result in results)
+    return {'role': role, 'protocol': protocol, 'direction': direction,
+            'bytes': total_bytes, 'duration': total_duration,
+            'rate': total_bytes / total_duration if total_duration else 0.,
+            'streams': results}
+
+
+def _tcp_accept(host, port, streams, end_of_time):
+    server = socket.socket(_get_family(host), socket.SOCK_STREAM)
+    try:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(streams)
+        sockets = []
+        while len(sockets) < streams:
+            server.settimeout(_get_remaining(end_of_time))
+            sock, _ = server.accept()
+            sockets.append(sock)
+        return sockets
+    finally:
+        server.close()
+
+
+def _tcp_connect(host, port, streams, end_of_time):
+    sockets = []
+    backoff = INITIAL_BACKOFF
+    while len(sockets) < streams:
+        sock = socket.socket(_get_family(host), socket.SOCK_STREAM)
+        sock.settimeout(_get_remaining(end_of_time))
+        try:
+            sock.connect((host, port))
+        except socket.timeout:
+            sock.close()
+            raise
+        except socket.error as ex:
+            sock.close()
+            if ex.errno not in _CONNECT_RETRY_ERRNOS:
+                raise
+            # Listening side isn't reachable yet: wait for a random time up
+            # to a backoff doubling after every failure
+            remaining = _get_remaining(end_of_time)
+            time.sleep(min(remaining, random.uniform(0., backoff)))
+            backoff = min(backoff * 2., MAX_BACKOFF)
+        else:
+            sockets.append(sock)
+            backoff = INITIAL_BACKOFF
+    return sockets
+
+
+def _udp_bind(host, port, streams, end_of_time):
+    sockets = []
+    for index in range(streams):
+        sock = socket.socket(_get_family(host), socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port + index))
+        sockets.append(sock)
+    for sock in sockets:
+        # Wait for the connecting side to tell its address
+        while True:
+            sock.settimeout(_get_remaining(end_of_time))
+            data, peer = sock.recvfrom(len(HELLO))
+            if data == HELLO:
+                sock.connect(peer)
+                sock.send(HELLO)
+                break
+    return sockets
+
+
+def _udp_connect(host, port, streams, end_of_time):
+    sockets = []
+    for index in range(streams):
+        sock = socket.socket(_get_family(host), socket.SOCK_DGRAM)
+        sock.connect((host, port + index))
+        # Tell listening side our address until it replies
+        while True:
+            try:
+                sock.send(HELLO)
+            except socket.error as ex:
+                # ICMP port unreachable received for previous datagram
+                if ex.errno != errno.ECONNREFUSED:
+                    raise
+            sock.settimeout(min(RETRY_INTERVAL,
+                                _get_remaining(end_of_time)))
+            try:
+                sock.recv(len(HELLO))
+            except socket.timeout:
+                _get_remaining(end_of_time)
+            except socket.error as ex:
+                if ex.errno != errno.ECONNREFUSED:
+                    raise
+                time.sleep(RETRY_INTERVAL)
+            else:
+                break
+        sockets.append(sock)
+    return sockets
+
+
+def _send(sock, protocol, end_of_time, duration=None, size=None, rate=None,
+          chunk_size=65536):
+    view = memoryview(b'x' * chunk_size)
+    sent = datagrams = 0
+    start = time.time()
+    stop_time = min(end_of_time, start + duration) if duration else end_of_time
+    while not size or sent < size:
+        now = time.time()
+        if now >= stop_time:
+            break
+        if rate and sent > rate * (now - start):
+            # Sending faster than requested: wait a bit
+            time.sleep(min(sent / rate - (now - start), stop_time - now))
+            continue
+        length = min(chunk_size, size - sent) if size else chunk_size
+        if protocol == 'tcp':
+            sock.settimeout(stop_time - now)
+            try:
+                sent += sock.send(view[:length])
+            except socket.timeout:
+                break
+        else:
+            try:
+                sent += sock.send(view[:length])
+                datagrams += 1
+            except socket.error as ex:
+                # Kernel buffers are full: try again after they are drained
+                if ex.errno not in (errno.ENOBUFS, errno.EAGAIN):
+                    raise
+                time.sleep(min(SEND_RETRY_INTERVAL,
+                               max(stop_time - time.time(), 0.)))
+    elapsed = time.time() - start
+
+    if protocol == 'tcp':
+        sock.shutdown(socket.SHUT_WR)
+        # Wait for receiver to close the connection
+        sock.settimeout(_get_remaining(end_of_time, raise_timeout=False))
+        try:
+            while sock.recv(1024):
+                pass
+        except socket.error:
+            pass
+    else:
+        # Datagrams could be lost: send it more times
+        for _ in range(3):
+            try:
+                sock.send(END)
+            except socket.error:
+                # Receiver already closed its socket after the first one
+                break
+    return {'bytes': sent, 'datagrams': datagrams, 'duration': elapsed}
+
+
+def _receive(sock, protocol, end_of_time, size=None, buffer_size=65536,
+             sample_interval=.5, started=None):
+    view = memoryview(bytearray(buffer_size))
+    received = datagrams = window_size = 0
+    samples = []
+    start = window_start = last_time = time.time()
+    while not size or received < size:
+        timeout = _get_remaining(end_of_time, raise_timeout=False)
+        if protocol == 'udp' and datagrams:
+            timeout = min(timeout, UDP_IDLE_TIMEOUT)
+        if timeout <= 0.:
+            break
+        sock.settimeout(timeout)
+        try:
+            length = sock.recv_into(view)
+        except socket.timeout:
+            break
+        now = time.time()
+        if protocol == 'udp':
+            if length in _CONTROL_SIZES:
+                data = view[:length].tobytes()
+                if data == END:
+                    break
+                if data == HELLO:
+                    continue
+            datagrams += 1
+        elif not length:
+            break
+        if not received:
+            # Measure from the first received byte
+            start = window_start = now
+            if started is not None:
+                started.set()
+        received += length
+        window_size += length
+        last_time = now
+        if now - window_start >= sample_interval:
+            samples.append([window_start - start, now - window_start,
+                            window_size])
+            window_start = now
+            window_size = 0
+    if window_size:
+        samples.append([window_start - start, last_time - window_start,
+                        window_size])
+    return {'bytes': received, 'datagrams': datagrams, 'start_time': start,
+            'duration': last_time - start, 'samples': samples}
+
+
+def _get_family(host):
+    return socket.AF_INET6 if ':' in host else socket.AF_INET
+
+
+def _get_remaining(end_of_time, raise_timeout=True):
+    remaining = end_of_time - time.time()
+    if remaining <= 0. and raise_timeout:
+        raise socket.timeout('Transfer timeout expired')
+    return max(remaining, 0.)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,6 +18,7 @@
 
 """Utilities and helper functions."""
 
+from concurrent import futures
 import functools
 import threading
 import time
@@ -102,3 +103,29 @@ def override_class(overriden_class, overrider_class):
         bases = (overrider_class, overriden_class)
         overriden_class = type(name, bases, {})
     return overriden_class
+
+
+def gather(futures_list, timeout=None):
+    """Waits for all given futures to complete and returns their results
+
+    :param futures_list: sequence of concurrent.futures.Future objects (ie.
+    as returned by AsyncNetworkClient methods)
+
+    :param timeout: max time in seconds to wait for all futures to complete
+
+    :returns: list of results in the same order as given futures
+
+    :raises: the exception raised by the first failed future. It is raised
+    only after all other futures have completed, so that created resources
+    can always be tracked for later cleanup.
+
+    :raises concurrent.futures.TimeoutError: when timeout expires before all
+    futures complete
+    """
+    futures_list = list(futures_list)
+    _, not_done = futures.wait(futures_list, timeout=timeout)
+    if not_done:
+        raise futures.TimeoutError(
+            "{:d} futures not completed after {!s} seconds".format(
+                len(not_done), timeout))
+    return [future.result() for future in futures_list]
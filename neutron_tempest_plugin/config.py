@@ -65,6 +65,37 @@ NeutronPluginOptions = [
                choices=['None', 'linuxbridge', 'ovs', 'sriov'],
                help='Agent used for devstack@q-agt.service'),
 
+    # Options for reusing HTTP connections between API requests
+    cfg.BoolOpt('http_keep_alive',
+                default=False,
+                help='Reuse HTTP connections between API requests made by '
+                     'REST clients of the same clients manager instead of '
+                     'closing them after every response.'),
+    cfg.IntOpt('http_pool_maxsize',
+               default=10,
+               min=1,
+               help='Max number of HTTP connections kept open for every API '
+                    'endpoint when "http_keep_alive" is enabled.'),
+    cfg.IntOpt('http_pool_idle_timeout',
+               default=30,
+               min=0,
+               help='Time in seconds after which HTTP connections to an '
+                    'unused API endpoint are closed when "http_keep_alive" '
+                    'is enabled. Zero means they are never closed.'),
+    cfg.IntOpt('max_concurrent_requests',
+               default=10,
+               min=1,
+               help='Max number of API requests executed at the same time '
+                    'by every asynchronous network client.'),
+    cfg.BoolOpt('shared_subnet_cidr_allocator',
+                default=False,
+                help='Coordinate test worker processes running on the same '
+                     'host when allocating subnet CIDRs from '
+                     'project_network_cidr and project_network_v6_cidr, so '
+                     'that they never try to create overlapping subnets. '
+                     'Allocations are recorded in oslo_concurrency '
+                     'lock_path directory.'),
+
     # Option for feature to connect via SSH to VMs using an intermediate SSH
     # server
     cfg.StrOpt('ssh_proxy_jump_host',
@@ -82,6 +113,51 @@ NeutronPluginOptions = [
     cfg.IntOpt('ssh_proxy_jump_port',
                default=22,
                help='Port used to connect to "ssh_proxy_jump_host".'),
+    cfg.BoolOpt('ssh_connection_pool',
+                default=False,
+                help='Share SSH connections between all SSH clients of the '
+                     'same test worker process connecting to the same '
+                     'server with the same credentials (including the '
+                     'connection to "ssh_proxy_jump_host").'),
+    cfg.IntOpt('ssh_pool_idle_timeout',
+               default=60,
+               min=0,
+               help='Time in seconds after which a shared SSH connection '
+                    'without open channels is closed. Zero means they are '
+                    'never closed.'),
+    cfg.IntOpt('ssh_keepalive_interval',
+               default=15,
+               min=0,
+               help='Time in seconds between keepalive messages sent over '
+                    'shared SSH connections. Zero disables them.'),
+    cfg.IntOpt('ssh_pool_max_sessions',
+               default=10,
+               min=1,
+               help='Max number of channels opened on the same shared SSH '
+                    'connection before opening a new connection. It should '
+                    'not exceed MaxSessions option of SSH servers.'),
+
+    # Option for capturing output of commands executed by tests
+    cfg.IntOpt('command_output_max_memory_size',
+               default=1048576,
+               min=0,
+               help='Max number of bytes of a command output stream kept in '
+                    'memory: bigger outputs are moved to a temporary file.'),
+
+    # Options for QoS scenario tests
+    cfg.IntOpt('qos_bandwidth_ports',
+               default=3,
+               min=1,
+               help='Number of ports whose bandwidth limits are verified '
+                    'concurrently by QoS scenario tests. Every port belongs '
+                    'to its own server.'),
+    cfg.FloatOpt('qos_max_enforcement_latency',
+                 default=None,
+                 min=0,
+                 help='Max seconds a change of a QoS bandwidth limit may '
+                      'take to be enforced on the traffic of a port. When it '
+                      'is not set the enforcement latency is only reported '
+                      'by QoS scenario tests.'),
 
     # Options for special, "advanced" image like e.g. Ubuntu. Such image can be
     # used in tests which require some more advanced tool than available in
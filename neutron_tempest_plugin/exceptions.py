@@ -47,6 +47,14 @@ class InvalidServiceTag(NeutronTempestPluginException):
     message = "Invalid service tag"
 
 
+class IcmpSocketNotAvailable(NeutronTempestPluginException):
+    message = "Unable to open ICMP socket (family %(family)s): %(reason)s"
+
+
+class TrafficAgentNotAvailable(NeutronTempestPluginException):
+    message = "Unable to run traffic agent on host %(host)r: Python not found"
+
+
 class SSHScriptException(exceptions.TempestException):
     """Base class for SSH client execute_script() exceptions"""
 
@@ -55,6 +63,15 @@ class ShellError(NeutronTempestPluginException):
     pass
 
 
+class ShellSessionClosed(ShellError):
+    message = "Shell session to host %(host)r is closed"
+
+
+class ShellSessionTerminated(ShellSessionClosed):
+    message = ("Shell session to host %(host)r terminated while executing "
+               "command %(command)r")
+
+
 class ShellCommandFailed(ShellError):
     """Raised when shell command exited with non-zero status
 
@@ -64,6 +81,13 @@ class ShellCommandFailed(ShellError):
                "stdout:\n%(stdout)s")
 
 
+class IPBatchCommandFailed(ShellCommandFailed):
+    message = ("Command %(command)r failed, exit status: %(exit_status)d, "
+               "failed operations: %(operations)s\n"
+               "stderr:\n%(stderr)s\n"
+               "stdout:\n%(stdout)s")
+
+
 class SSHScriptFailed(ShellCommandFailed):
     message = ("Command %(command)r failed, exit status: %(exit_status)d, "
                "host: %(host)r\n"
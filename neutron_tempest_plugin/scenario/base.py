@@ -12,7 +12,10 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import collections
+from concurrent import futures
 import subprocess
+import time
 
 from debtcollector import removals
 import netaddr
@@ -21,13 +24,18 @@ from neutron_lib import constants as neutron_lib_constants
 from oslo_log import log
 from tempest.common.utils import net_utils
 from tempest.common import waiters
+from tempest import exceptions as tempest_exc
 from tempest.lib.common.utils import data_utils
 from tempest.lib.common.utils import test_utils
 from tempest.lib import exceptions as lib_exc
 
 from neutron_tempest_plugin.api import base as base_api
+from neutron_tempest_plugin.common import connectivity
+from neutron_tempest_plugin.common import icmp
 from neutron_tempest_plugin.common import ssh
+from neutron_tempest_plugin.common import utils
 from neutron_tempest_plugin import config
+from neutron_tempest_plugin import exceptions
 from neutron_tempest_plugin.scenario import constants
 
 CONF = config.CONF
@@ -94,6 +102,45 @@ class BaseTempestTestCase(base_api.BaseNetworkTest):
                         server['server']['id'])
         return server
 
+    def create_servers(self, servers_kwargs, max_workers=None):
+        """Create many servers concurrently
+
+        Servers boot requests are submitted in parallel by a pool of worker
+        threads. Servers are not waited for to become active: use
+        wait_for_servers_active method for it.
+
+        :param servers_kwargs: sequence of dictionaries, each one with the
+        parameters of create_server method for a server to be created
+        :param max_workers: max number of concurrent boot requests. By default
+        it uses max_concurrent_requests option.
+        :returns: list of created servers in the same order of servers_kwargs
+        """
+        if not max_workers:
+            max_workers = CONF.neutron_plugin_options.max_concurrent_requests
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            jobs = [executor.submit(self.create_server, **kwargs)
+                    for kwargs in servers_kwargs]
+        return utils.gather(jobs)
+
+    def list_servers_ports(self, servers, client=None, **filters):
+        """List ports of many servers with a single request
+
+        :param servers: sequence of mappings having schema
+        {'id': <server_id>}
+        :param client: network client (self.client as default value)
+        :param filters: additional port filters (es: network_id)
+        :returns: dictionary mapping every server ID to the list of its ports
+        """
+        client = client or self.client
+        server_ids = [server['id'] for server in servers]
+        ports = collections.OrderedDict(
+            (server_id, []) for server_id in server_ids)
+        if server_ids:
+            for port in client.list_ports(device_id=server_ids,
+                                          **filters)['ports']:
+                ports[port['device_id']].append(port)
+        return ports
+
     @classmethod
     def create_secgroup_rules(cls, rule_list, secgroup_id=None,
                               client=None):
@@ -154,6 +201,23 @@ class BaseTempestTestCase(base_api.BaseNetworkTest):
         cls.routers.append(router)
         return router
 
+    @classmethod
+    def create_floatingip(cls, *args, **kwargs):
+        fip = super(BaseTempestTestCase, cls).create_floatingip(
+            *args, **kwargs)
+        # Shared SSH connections to a recycled floating IP address could
+        # reach another server
+        if ssh.Client.use_connection_pool:
+            ssh.CONNECTION_POOL.evict(fip['floating_ip_address'])
+        return fip
+
+    @classmethod
+    def delete_floatingip(cls, floating_ip, client=None):
+        super(BaseTempestTestCase, cls).delete_floatingip(
+            floating_ip, client=client)
+        if ssh.Client.use_connection_pool:
+            ssh.CONNECTION_POOL.evict(floating_ip['floating_ip_address'])
+
     @removals.remove(version='Stein',
                      message="Please use create_floatingip method instead of "
                              "create_and_associate_floatingip.")
@@ -309,6 +373,56 @@ class BaseTempestTestCase(base_api.BaseNetworkTest):
             self._log_console_output(servers)
             raise
 
+    def check_connectivity_matrix(self, sources, destinations,
+                                  should_succeed=True, servers=None,
+                                  timeout=None):
+        """Check ping from every source to every destination
+
+        Every source pings all destinations with a single command and all
+        sources run concurrently. Pairs not matching the expected result are
+        checked again every second until timeout expires.
+
+        :param sources: RemoteClient instances to ping from
+        :param destinations: IP addresses to ping from every source
+        :param should_succeed: boolean should ping succeed or not
+        :param servers: servers whose console output is logged on failure
+        :param timeout: time in seconds to wait for all pairs to get the
+                        expected result
+        :returns: connectivity.ConnectivityMatrix with the last result for
+                  every source and destination pair
+        """
+        sources = {source.host: source for source in sources}
+        matrix = connectivity.ConnectivityMatrix()
+        probes = [(source, list(destinations)) for source in sources.values()]
+
+        def ping_matrix():
+            matrix.update(connectivity.ping_matrix(
+                probes, count=CONF.validation.ping_count,
+                size=CONF.validation.ping_size))
+            unexpected = collections.OrderedDict()
+            for result in matrix.get_unexpected(should_succeed):
+                unexpected.setdefault(result.source, []).append(
+                    result.destination)
+            # Only pairs with unexpected results are checked again
+            probes[:] = [(sources[source], pending)
+                         for source, pending in unexpected.items()]
+            return not probes
+
+        try:
+            self.assertTrue(
+                test_utils.call_until_true(
+                    ping_matrix, timeout or CONF.validation.ping_timeout, 1),
+                "Unexpected connectivity (should_succeed={!r}):\n"
+                "{!s}".format(should_succeed, matrix))
+        except lib_exc.SSHTimeout as ssh_e:
+            LOG.debug(ssh_e)
+            self._log_console_output(servers)
+            raise
+        except AssertionError:
+            self._log_console_output(servers)
+            raise
+        return matrix
+
     def ping_ip_address(self, ip_address, should_succeed=True,
                         ping_timeout=None, mtu=None):
         # the code is taken from tempest/scenario/manager.py in tempest git
@@ -339,7 +453,24 @@ class BaseTempestTestCase(base_api.BaseNetworkTest):
                       'should_succeed':
                       'reachable' if should_succeed else 'unreachable'
                   })
-        result = test_utils.call_until_true(ping, timeout, 1)
+        result = None
+        if not mtu and any(is_valid(ip_address) for is_valid in
+                           (netaddr.valid_ipv4, netaddr.valid_ipv6)):
+            # Probe from this process without spawning a ping command
+            # every second when ICMP sockets can be opened
+            try:
+                probe_result = icmp.probe(
+                    [ip_address], timeout=timeout,
+                    should_succeed=should_succeed)[ip_address]
+            except exceptions.IcmpSocketNotAvailable as ex:
+                LOG.debug("Falling back to ping command: %s", ex)
+            else:
+                if should_succeed:
+                    result = probe_result.reachable
+                else:
+                    result = bool(probe_result.lost)
+        if result is None:
+            result = test_utils.call_until_true(ping, timeout, 1)
 
         # To make sure ping_ip_address called by test works
         # as expected.
@@ -352,6 +483,46 @@ class BaseTempestTestCase(base_api.BaseNetworkTest):
                   })
         return result
 
+    def ping_ip_addresses(self, ip_addresses, should_succeed=True,
+                          ping_timeout=None):
+        """Ping many IP addresses at once from this process
+
+        All addresses are probed concurrently with ICMP echo requests sent
+        several times per second until every address gets the expected
+        result. When ICMP sockets can't be opened by this process it falls
+        back to ping_ip_address method for every address.
+
+        :param ip_addresses: IP addresses to ping
+        :param should_succeed: boolean should ping succeed or not
+        :param ping_timeout: time in seconds to wait for expected result
+        :returns: dictionary mapping every IP address to its
+                  icmp.ProbeResult (or None when ICMP sockets are not
+                  available)
+        """
+        timeout = ping_timeout or CONF.validation.ping_timeout
+        try:
+            results = icmp.probe(ip_addresses, timeout=timeout,
+                                 should_succeed=should_succeed)
+        except exceptions.IcmpSocketNotAvailable as ex:
+            LOG.debug("Falling back to ping command: %s", ex)
+            for ip_address in ip_addresses:
+                self.ping_ip_address(ip_address,
+                                     should_succeed=should_succeed,
+                                     ping_timeout=ping_timeout)
+            return {ip_address: None for ip_address in ip_addresses}
+
+        if should_succeed:
+            unexpected = [result for result in results.values()
+                          if not result.received]
+        else:
+            unexpected = [result for result in results.values()
+                          if not result.lost]
+        self.assertFalse(
+            unexpected, "IP addresses not {!s} within {!s} seconds: "
+            "{!r}".format('reachable' if should_succeed else 'unreachable',
+                          timeout, unexpected))
+        return results
+
     def wait_for_server_status(self, server, status, client=None, **kwargs):
         """Waits for a server to reach a given status.
 
@@ -373,3 +544,81 @@ class BaseTempestTestCase(base_api.BaseNetworkTest):
         """
         self.wait_for_server_status(
             server, constants.SERVER_STATUS_ACTIVE, client)
+
+    def wait_for_servers_status(self, servers, status, client=None,
+                                ready_wait=True, raise_on_error=True):
+        """Waits for many servers to reach a given status.
+
+        Instead of polling every server it lists all servers once for every
+        build interval until all of them have reached given status.
+
+        :param servers: sequence of mappings having schema
+        {'id': <server_id>}
+        :param status: string status to wait for (es: 'ACTIVE')
+        :param client: servers client (self.os_primary.servers_client as
+                       default value)
+        :param ready_wait: wait also for servers to have no task in progress
+        :param raise_on_error: raise BuildErrorException as soon as any
+                               server goes to ERROR status
+        :raises tempest.lib.exceptions.NotFound: as soon as any server is no
+                                                 longer listed, unless status
+                                                 is 'DELETED'
+        """
+        client = client or self.os_primary.servers_client
+        pending = set(server['id'] for server in servers)
+        start_time = time.time()
+        while True:
+            missing = set(pending)
+            for server in client.list_servers(detail=True)['servers']:
+                server_id = server['id']
+                if server_id not in pending:
+                    continue
+                missing.discard(server_id)
+                task_state = server.get('OS-EXT-STS:task_state')
+                if server['status'] == status:
+                    if not ready_wait or task_state is None:
+                        pending.remove(server_id)
+                elif server['status'] == 'ERROR' and raise_on_error:
+                    if 'fault' in server:
+                        raise tempest_exc.BuildErrorException(
+                            server['fault'], server_id=server_id)
+                    raise tempest_exc.BuildErrorException(server_id=server_id)
+
+            if missing:
+                if status != 'DELETED':
+                    raise lib_exc.NotFound(
+                        'Servers %s not found while waiting for %s status' %
+                        (', '.join(sorted(missing)), status))
+                # Deleted servers are no longer listed
+                pending -= missing
+
+            if not pending:
+                break
+
+            if time.time() - start_time >= client.build_timeout:
+                message = ('Servers %(server_ids)s failed to reach %(status)s '
+                           'status within the required time (%(timeout)s s).'
+                           % {'server_ids': ', '.join(sorted(pending)),
+                              'status': status,
+                              'timeout': client.build_timeout})
+                caller = test_utils.find_test_caller()
+                if caller:
+                    message = '(%s) %s' % (caller, message)
+                raise lib_exc.TimeoutException(message)
+
+            time.sleep(client.build_interval)
+
+        if ready_wait and status != 'BUILD':
+            # without state api extension 3 sec usually enough
+            time.sleep(CONF.compute.ready_wait)
+
+    def wait_for_servers_active(self, servers, client=None):
+        """Waits for many servers to reach active status.
+
+        :param servers: sequence of mappings having schema
+        {'id': <server_id>}
+        :param client: servers client (self.os_primary.servers_client as
+                       default value)
+        """
+        self.wait_for_servers_status(
+            servers, constants.SERVER_STATUS_ACTIVE, client)
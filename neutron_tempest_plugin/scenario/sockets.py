@@ -0,0 +1,156 @@
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import os
+import random
+import select
+import socket
+import time
+
+import netaddr
+from oslo_log import log
+
+from neutron_tempest_plugin.scenario import constants
+from neutron_tempest_plugin.scenario import exceptions
+
+
+LOG = log.getLogger(__name__)
+
+# Max seconds to wait for a single connection attempt
+CONNECT_ATTEMPT_TIMEOUT = 5.
+
+# Seconds to wait before the second attempt: it doubles after every failed
+# attempt up to MAX_BACKOFF seconds
+INITIAL_BACKOFF = .1
+MAX_BACKOFF = 5.
+
+# Errors meaning the server is not ready yet (ie. guest process not
+# listening yet or floating IP not configured yet)
+_RETRY_ERRNOS = frozenset([errno.ECONNREFUSED, errno.ECONNRESET,
+                           errno.ECONNABORTED, errno.ETIMEDOUT,
+                           errno.EHOSTUNREACH, errno.ENETUNREACH])
+
+_IN_PROGRESS_ERRNOS = frozenset([errno.EINPROGRESS, errno.EWOULDBLOCK,
+                                 errno.EALREADY, errno.EAGAIN])
+
+
+class ConnectStats(object):
+    """Statistics of the attempts made to establish a TCP connection
+
+    :param host: server address
+
+    :param port: server port
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.attempts = 0
+        self.errors = []
+        self.connected = False
+        self.elapsed = None
+
+    def __repr__(self):
+        return ('ConnectStats(host={!r}, port={!r}, attempts={!r}, '
+                'connected={!r}, elapsed={!r}, errors={!r})').format(
+                    self.host, self.port, self.attempts, self.connected,
+                    self.elapsed, self.errors)
+
+
+def connect(host, port, timeout=None, attempt_timeout=CONNECT_ATTEMPT_TIMEOUT,
+            initial_backoff=INITIAL_BACKOFF, max_backoff=MAX_BACKOFF,
+            stats=None):
+    """Connects a TCP socket, retrying until the server accepts it
+
+    Every attempt is a non-blocking connect waiting at most attempt_timeout
+    seconds for the socket to become writable. Between attempts it sleeps a
+    random time up to a backoff that doubles after every failure (full
+    jitter), so that many clients don't flood the server with SYNs.
+
+    :param host: server IP address
+
+    :param port: server port
+
+    :param timeout: max seconds to wait for the connection. By default it
+    is SOCKET_CONNECT_TIMEOUT.
+
+    :param stats: ConnectStats instance to be updated. By default a new one
+    is created and logged.
+
+    :returns: connected blocking socket
+
+    :raises exceptions.ConnectionTimeoutException: when timeout expires
+
+    :raises socket.error: on errors that retrying can't recover
+    """
+    if timeout is None:
+        timeout = constants.SOCKET_CONNECT_TIMEOUT
+    if stats is None:
+        stats = ConnectStats(host=host, port=port)
+    family = (socket.AF_INET6 if netaddr.IPAddress(host).version == 6
+              else socket.AF_INET)
+
+    start = time.time()
+    end_of_time = start + timeout
+    backoff = initial_backoff
+    while True:
+        stats.attempts += 1
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            error = _try_connect(sock, (host, port), min(
+                attempt_timeout, max(0., end_of_time - time.time())))
+        except Exception:
+            sock.close()
+            raise
+
+        if not error:
+            sock.setblocking(True)
+            stats.connected = True
+            stats.elapsed = time.time() - start
+            LOG.debug("Connected to %s port %d: %r", host, port, stats)
+            return sock
+
+        sock.close()
+        stats.errors.append(os.strerror(error))
+        if error not in _RETRY_ERRNOS:
+            stats.elapsed = time.time() - start
+            LOG.debug("Unable to connect to %s port %d: %r", host, port,
+                      stats)
+            raise socket.error(error, os.strerror(error))
+
+        remaining = end_of_time - time.time()
+        if remaining <= 0.:
+            stats.elapsed = time.time() - start
+            LOG.debug("Timeout connecting to %s port %d: %r", host, port,
+                      stats)
+            raise exceptions.ConnectionTimeoutException(host=host, port=port)
+
+        time.sleep(min(remaining, random.uniform(0., backoff)))
+        backoff = min(backoff * 2., max_backoff)
+
+
+def _try_connect(sock, address, timeout):
+    """Makes a single non-blocking connection attempt
+
+    :returns: 0 when connected, otherwise the connection error number
+    """
+    sock.setblocking(False)
+    error = sock.connect_ex(address)
+    if error in _IN_PROGRESS_ERRNOS:
+        _, writable, _ = select.select([], [sock], [], timeout)
+        if not writable:
+            return errno.ETIMEDOUT
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    return error
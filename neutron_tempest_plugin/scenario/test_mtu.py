@@ -17,7 +17,6 @@ from neutron_lib.api.definitions import provider_net
 from oslo_log import log
 from oslo_serialization import jsonutils
 from tempest.common import utils
-from tempest.common import waiters
 from tempest.lib.common.utils import data_utils
 from tempest.lib import decorators
 import testtools
@@ -25,7 +24,6 @@ import testtools
 from neutron_tempest_plugin.common import ssh
 from neutron_tempest_plugin import config
 from neutron_tempest_plugin.scenario import base
-from neutron_tempest_plugin.scenario import constants
 
 CONF = config.CONF
 LOG = log.getLogger(__name__)
@@ -48,20 +46,28 @@ class NetworkMtuBaseTest(base.BaseTempestTestCase):
             secgroup_id=cls.secgroup['security_group']['id'])
 
     def create_pingable_vm(self, net, keypair, secgroup):
-        server = self.create_server(
-            flavor_ref=CONF.neutron_plugin_options.advanced_image_flavor_ref,
-            image_ref=CONF.neutron_plugin_options.advanced_image_ref,
-            key_name=keypair['name'],
-            networks=[{'uuid': net['id']}],
-            security_groups=[{'name': secgroup[
-                'security_group']['name']}])
-        waiters.wait_for_server_status(
-            self.os_primary.servers_client, server['server']['id'],
-            constants.SERVER_STATUS_ACTIVE)
-        port = self.client.list_ports(
-            network_id=net['id'], device_id=server['server']['id'])['ports'][0]
-        fip = self.create_floatingip(port=port)
-        return server, fip
+        return self.create_pingable_vms([net], keypair, secgroup)[0]
+
+    def create_pingable_vms(self, nets, keypair, secgroup):
+        servers = self.create_servers([
+            {'flavor_ref': (
+                CONF.neutron_plugin_options.advanced_image_flavor_ref),
+             'image_ref': CONF.neutron_plugin_options.advanced_image_ref,
+             'key_name': keypair['name'],
+             'networks': [{'uuid': net['id']}],
+             'security_groups': [{'name': secgroup[
+                 'security_group']['name']}]}
+            for net in nets])
+        self.wait_for_servers_active(
+            [server['server'] for server in servers])
+        servers_ports = self.list_servers_ports(
+            [server['server'] for server in servers])
+        servers_fips = []
+        for net, server in zip(nets, servers):
+            port = [port for port in servers_ports[server['server']['id']]
+                    if port['network_id'] == net['id']][0]
+            servers_fips.append((server, self.create_floatingip(port=port)))
+        return servers_fips
 
     def _get_network_params(self):
         return jsonutils.loads(CONF.neutron_plugin_options.test_mtu_networks)
@@ -103,14 +109,12 @@ class NetworkMtuTest(NetworkMtuBaseTest):
         # check that MTUs are different for 2 networks
         self.assertNotEqual(self.networks[0]['mtu'], self.networks[1]['mtu'])
         self.networks.sort(key=lambda net: net['mtu'])
-        server1, fip1 = self.create_pingable_vm(self.networks[0],
-                                                self.keypair, self.secgroup)
+        (server1, fip1), (server2, fip2) = self.create_pingable_vms(
+            self.networks[:2], self.keypair, self.secgroup)
         server_ssh_client1 = ssh.Client(
             self.floating_ips[0]['floating_ip_address'],
             CONF.neutron_plugin_options.advanced_image_ssh_user,
             pkey=self.keypair['private_key'])
-        server2, fip2 = self.create_pingable_vm(self.networks[1],
-                                                self.keypair, self.secgroup)
         server_ssh_client2 = ssh.Client(
             self.floating_ips[0]['floating_ip_address'],
             CONF.neutron_plugin_options.advanced_image_ssh_user,
@@ -198,14 +202,12 @@ class NetworkWritableMtuTest(NetworkMtuBaseTest):
         # check that MTUs are different for 2 networks
         self.assertNotEqual(self.networks[0]['mtu'], self.networks[1]['mtu'])
         self.networks.sort(key=lambda net: net['mtu'])
-        server1, fip1 = self.create_pingable_vm(self.networks[0],
-                                                self.keypair, self.secgroup)
+        (server1, fip1), (server2, fip2) = self.create_pingable_vms(
+            self.networks[:2], self.keypair, self.secgroup)
         server_ssh_client1 = ssh.Client(
             self.floating_ips[0]['floating_ip_address'],
             CONF.neutron_plugin_options.advanced_image_ssh_user,
             pkey=self.keypair['private_key'])
-        server2, fip2 = self.create_pingable_vm(self.networks[1],
-                                                self.keypair, self.secgroup)
         server_ssh_client2 = ssh.Client(
             self.floating_ips[0]['floating_ip_address'],
             CONF.neutron_plugin_options.advanced_image_ssh_user,
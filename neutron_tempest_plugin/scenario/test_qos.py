@@ -12,57 +12,106 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
-import errno
-import socket
+import collections
+from concurrent import futures
+import threading
 import time
 
 from neutron_lib.services.qos import constants as qos_consts
 from oslo_log import log as logging
 from tempest.common import utils as tutils
+from tempest.lib.common.utils import test_utils
 from tempest.lib import decorators
 from tempest.lib import exceptions
 
 from neutron_tempest_plugin.api import base as base_api
+from neutron_tempest_plugin.common import bandwidth
 from neutron_tempest_plugin.common import ssh
+from neutron_tempest_plugin.common import traffic
 from neutron_tempest_plugin.common import utils
 from neutron_tempest_plugin import config
 from neutron_tempest_plugin.scenario import base
 from neutron_tempest_plugin.scenario import constants
 from neutron_tempest_plugin.scenario import exceptions as sc_exceptions
+from neutron_tempest_plugin.scenario import sockets
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
 
 
-def _try_connect(host_ip, port):
-    try:
-        client_socket = socket.socket(socket.AF_INET,
-                                      socket.SOCK_STREAM)
-        client_socket.connect((host_ip, port))
-        return client_socket
-    except socket.error as serr:
-        if serr.errno == errno.ECONNREFUSED:
-            raise sc_exceptions.SocketConnectionRefused(host=host_ip,
-                                                        port=port)
-        else:
-            raise
-
-
 def _connect_socket(host, port):
     """Try to initiate a connection to a host using an ip address and a port.
 
     Trying couple of times until a timeout is reached in case the listening
     host is not ready yet.
     """
+    return sockets.connect(host, port,
+                           timeout=constants.SOCKET_CONNECT_TIMEOUT)
 
-    start = time.time()
-    while True:
-        try:
-            return _try_connect(host, port)
-        except sc_exceptions.SocketConnectionRefused:
-            if time.time() - start > constants.SOCKET_CONNECT_TIMEOUT:
-                raise sc_exceptions.ConnectionTimeoutException(host=host,
-                                                               port=port)
+
+class QoSTarget(collections.namedtuple(
+        'QoSTarget', ['port_id', 'ssh_client', 'host', 'max_kbps',
+                      'max_burst_kbps'])):
+    """Port whose bandwidth is verified against a bandwidth limit rule
+
+    :param port_id: ID of the port the QoS policy is applied to
+
+    :param ssh_client: SSH client of the server owning the port
+
+    :param host: IP address of the server reachable from the test runner
+
+    :param max_kbps: max_kbps value of the bandwidth limit rule
+
+    :param max_burst_kbps: max_burst_kbps value of the bandwidth limit rule.
+    When it is not given the burst is not verified.
+    """
+
+
+class BandwidthConformance(collections.namedtuple(
+        'BandwidthConformance', ['target', 'measurement', 'tolerance'])):
+    """Bandwidth measured on a port compared to its bandwidth limit rule
+
+    :param target: QoSTarget instance
+
+    :param measurement: bandwidth.BandwidthMeasurement of a transfer from
+    target server to the test runner
+
+    :param tolerance: factor applied to the limits to accept measurement
+    errors
+    """
+
+    @property
+    def max_rate(self):
+        """Max steady-state bytes per second allowed by max_kbps"""
+        return self.target.max_kbps * 1024 * self.tolerance / 8.
+
+    @property
+    def max_burst(self):
+        """Max bytes above max_rate allowed by max_burst_kbps"""
+        return (self.target.max_burst_kbps or 0) * 1024 * self.tolerance / 8.
+
+    @property
+    def burst(self):
+        """Bytes received above max_rate during the whole transfer"""
+        allowed = self.max_rate * self.measurement.duration
+        return max(0., self.measurement.size - allowed)
+
+    @property
+    def conforming(self):
+        if self.measurement.rate > self.max_rate:
+            return False
+        if self.target.max_burst_kbps:
+            return self.burst <= self.max_burst
+        return True
+
+    def __str__(self):
+        return ('port {!s} ({!s}): rate={:.0f} B/s (max {:.0f} B/s), '
+                'burst={:.0f} B (max {!s}): {!s}').format(
+                    self.target.port_id, self.target.host,
+                    self.measurement.rate, self.max_rate, self.burst,
+                    '{:.0f} B'.format(self.max_burst)
+                    if self.target.max_burst_kbps else 'n/a',
+                    'OK' if self.conforming else 'NOT CONFORMING')
 
 
 class QoSTestMixin(object):
@@ -81,6 +130,15 @@ class QoSTestMixin(object):
     NC_PORT = 1234
     FILE_DOWNLOAD_TIMEOUT = 120
 
+    # Parameters of QoS enforcement latency measurements: seconds of data
+    # transfer, seconds of transfer before the QoS change, seconds covered by
+    # every throughput sample and number of consecutive samples within the
+    # new limit required to consider it enforced
+    ENFORCEMENT_TRANSFER_TIME = 30.
+    ENFORCEMENT_CHANGE_DELAY = 5.
+    ENFORCEMENT_SAMPLE_INTERVAL = .25
+    ENFORCEMENT_SETTLE_SAMPLES = 2
+
     def _create_file_for_bw_tests(self, ssh_client):
         cmd = ("(dd if=/dev/zero bs=%(bs)d count=%(count)d of=%(file_path)s) "
                % {'bs': QoSTestMixin.BS, 'count': QoSTestMixin.COUNT,
@@ -92,35 +150,197 @@ class QoSTestMixin(object):
             raise sc_exceptions.FileCreationFailedException(
                 file=QoSTestMixin.FILE_PATH)
 
-    def _check_bw(self, ssh_client, host, port, expected_bw=LIMIT_BYTES_SEC):
+    def _prepare_bw_tests(self, ssh_client):
+        """Prepares a server to send data for BW measurements
+
+        The file transferred by nc is only created when the traffic agent
+        can't be run on the server.
+        """
+        if not traffic.get_agent(ssh_client):
+            self._create_file_for_bw_tests(ssh_client)
+
+    def _measure_bw(self, ssh_client, host, port, duration=None,
+                    sample_interval=None, started=None):
+        """Measures BW of a transfer from a server to the test runner
+
+        :param duration: seconds to transfer data for. By default the file
+        created by _create_file_for_bw_tests is transferred.
+        :param sample_interval: seconds covered by every throughput sample
+        :param started: threading.Event set when the first data are received
+        :returns: bandwidth.BandwidthMeasurement instance
+        """
+        size = None if duration else int(QoSTestMixin.FILE_SIZE)
+        if traffic.get_agent(ssh_client):
+            # Measure BW with traffic agent, that depends neither on nc
+            # behavior nor on the file written to guest disk
+            result = traffic.measure(
+                ssh_client, host, direction='egress', port=port,
+                duration=duration, size=size,
+                sample_interval=sample_interval,
+                timeout=self.FILE_DOWNLOAD_TIMEOUT, started=started)
+            # A single stream is transferred, so its measurement is the BW
+            # of the port
+            self.assertEqual(1, len(result.measurements))
+            return result.measurements[0]
+
         cmd = "killall -q nc"
         try:
             ssh_client.exec_command(cmd)
         except exceptions.SSHExecCommandFailed:
             pass
+        # Timed transfers send zeros until the test runner closes the
+        # connection
         cmd = ("(nc -ll -p %(port)d < %(file_path)s > /dev/null &)" % {
-                'port': port, 'file_path': QoSTestMixin.FILE_PATH})
+                'port': port,
+                'file_path': '/dev/zero' if duration else
+                QoSTestMixin.FILE_PATH})
         ssh_client.exec_command(cmd)
 
-        # Open TCP socket to remote VM and download big file
-        start_time = time.time()
+        # Open TCP socket to remote VM and download big file measuring
+        # steady-state BW (TCP slow start and QoS burst are not considered)
         client_socket = _connect_socket(host, port)
-        total_bytes_read = 0
-        while total_bytes_read < QoSTestMixin.FILE_SIZE:
-            data = client_socket.recv(QoSTestMixin.BUFFER_SIZE)
-            total_bytes_read += len(data)
-
-        # Calculate and return actual BW + logging result
-        time_elapsed = time.time() - start_time
-        bytes_per_second = total_bytes_read / time_elapsed
-
-        LOG.debug("time_elapsed = %(time_elapsed).16f, "
-                  "total_bytes_read = %(total_bytes_read)d, "
-                  "bytes_per_second = %(bytes_per_second)d",
-                  {'time_elapsed': time_elapsed,
-                   'total_bytes_read': total_bytes_read,
-                   'bytes_per_second': bytes_per_second})
-        return bytes_per_second <= expected_bw
+        try:
+            return bandwidth.receive(
+                client_socket, max_size=size,
+                timeout=duration or self.FILE_DOWNLOAD_TIMEOUT,
+                buffer_size=QoSTestMixin.BUFFER_SIZE,
+                sample_interval=sample_interval or bandwidth.SAMPLE_INTERVAL,
+                started=started)
+        finally:
+            client_socket.close()
+
+    def _check_bw(self, ssh_client, host, port, expected_bw=LIMIT_BYTES_SEC):
+        measurement = self._measure_bw(ssh_client, host, port)
+        LOG.debug("Measured BW: %s (expected BW: %d bytes/s)", measurement,
+                  expected_bw)
+        return measurement.rate <= expected_bw
+
+    def _verify_bw_limits(self, targets, port=NC_PORT, timeout=None,
+                          max_workers=None):
+        """Verifies BW limits of many ports measuring them concurrently
+
+        All target servers send data to the test runner at the same time and
+        the BW measured on every port is compared to its own limits. Ports
+        not conforming to their limits are measured again every second until
+        timeout expires.
+
+        :param targets: sequence of QoSTarget
+        :param port: TCP port target servers listen on
+        :param timeout: max seconds to wait for all ports to conform. By
+        default it is FILE_DOWNLOAD_TIMEOUT.
+        :param max_workers: max number of ports measured at the same time. By
+        default all of them are.
+        :returns: list of BandwidthConformance in the same order as targets
+        """
+        targets = list(targets)
+        results = [None] * len(targets)
+        pending = list(range(len(targets)))
+
+        def measure_pending():
+            with futures.ThreadPoolExecutor(
+                    max_workers=max_workers or len(pending)) as executor:
+                jobs = [executor.submit(self._measure_bw,
+                                        targets[index].ssh_client,
+                                        targets[index].host, port)
+                        for index in pending]
+            for index, measurement in zip(pending,
+                                          utils.gather(jobs)):
+                results[index] = BandwidthConformance(
+                    targets[index], measurement, self.TOLERANCE_FACTOR)
+            # Only ports not conforming to their limits are measured again
+            pending[:] = [index for index in pending
+                          if not results[index].conforming]
+            return not pending
+
+        conforming = test_utils.call_until_true(
+            measure_pending, timeout or self.FILE_DOWNLOAD_TIMEOUT, 1)
+        report = '\n'.join(str(result) for result in results
+                           if result is not None)
+        LOG.debug("QoS BW limits verified:\n%s", report)
+        self.assertTrue(
+            conforming,
+            "BW limits not enforced on {:d} of {:d} ports:\n{!s}".format(
+                len(pending), len(targets), report))
+        return results
+
+    def _measure_enforcement_latency(self, ssh_client, host, apply_change,
+                                     max_kbps, change, port=NC_PORT):
+        """Measures the time taken by a QoS change to be enforced
+
+        The server sends data to the test runner for
+        ENFORCEMENT_TRANSFER_TIME seconds while throughput is sampled every
+        ENFORCEMENT_SAMPLE_INTERVAL seconds. The change is applied
+        ENFORCEMENT_CHANGE_DELAY seconds after the first data are received,
+        and it is enforced from the beginning of the first of
+        ENFORCEMENT_SETTLE_SAMPLES consecutive samples whose rate is within
+        the band of the new limit (max_kbps divided and multiplied by
+        TOLERANCE_FACTOR). The latency is logged together with the q_agent
+        backend, so that it can be collected as a metric.
+
+        :param apply_change: callable applying the QoS change (ie. updating
+        a bandwidth limit rule)
+        :param max_kbps: max_kbps value expected to be enforced after the
+        change
+        :param change: description of the change reported with the latency
+        :returns: seconds elapsed from the call to apply_change to the
+        enforcement, or None when it was not enforced before the end of the
+        transfer
+        """
+        started = threading.Event()
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            job = executor.submit(
+                self._measure_bw, ssh_client, host, port,
+                duration=self.ENFORCEMENT_TRANSFER_TIME,
+                sample_interval=self.ENFORCEMENT_SAMPLE_INTERVAL,
+                started=started)
+            # Setting up the transfer may take a while (ie. deploying the
+            # traffic agent), so the delay is counted from the first data
+            utils.wait_until_true(
+                lambda: started.is_set() or job.done(),
+                timeout=self.FILE_DOWNLOAD_TIMEOUT, sleep=.1)
+            if not started.is_set():
+                job.result()
+                self.fail("No data received from the server "
+                          "({!s})".format(change))
+            time.sleep(self.ENFORCEMENT_CHANGE_DELAY)
+            change_time = time.time()
+            apply_change()
+        measurement = job.result()
+
+        # Samples taken before the change are required to tell when the
+        # rate moved into the new band
+        self.assertIsNotNone(measurement.start_time)
+        self.assertLess(
+            measurement.start_time, change_time,
+            "Data transfer started after the QoS change ({!s})".format(
+                change))
+
+        max_rate = max_kbps * 1024 / 8.
+        latency = measurement.find_rate_change(
+            since=change_time - measurement.start_time,
+            min_rate=max_rate / self.TOLERANCE_FACTOR,
+            max_rate=max_rate * self.TOLERANCE_FACTOR,
+            settle_samples=self.ENFORCEMENT_SETTLE_SAMPLES)
+        LOG.info("QoS enforcement latency (q_agent=%s, change=%s, "
+                 "max_kbps=%d): %s s (resolution %s s); measured BW: %s",
+                 CONF.neutron_plugin_options.q_agent, change, max_kbps,
+                 'n/a' if latency is None else '{:.2f}'.format(latency),
+                 self.ENFORCEMENT_SAMPLE_INTERVAL, measurement)
+        return latency
+
+    def _check_enforcement_latency(self, latency, change):
+        """Fails when a QoS change was not enforced in time"""
+        self.assertIsNotNone(
+            latency,
+            "QoS change not enforced after {:.0f} seconds ({!s})".format(
+                self.ENFORCEMENT_TRANSFER_TIME - self.ENFORCEMENT_CHANGE_DELAY,
+                change))
+        max_latency = CONF.neutron_plugin_options.qos_max_enforcement_latency
+        if max_latency is not None:
+            self.assertLessEqual(
+                latency, max_latency,
+                "QoS change enforced after {:.2f} seconds, more than "
+                "{:.2f} ({!s})".format(latency, max_latency, change))
 
     def _create_ssh_client(self):
         return ssh.Client(self.fip['floating_ip_address'],
@@ -147,6 +367,64 @@ class QoSTestMixin(object):
                                         shared=True)
         return policy['policy']['id']
 
+    def _create_bw_limit_policies(self, limits):
+        """Creates many QoS policies with a bandwidth limit rule concurrently
+
+        Policies are deleted, together with their rules, at test cleanup.
+
+        :param limits: sequence of (max_kbps, max_burst_kbps) pairs
+        :returns: list of (QoS policy ID, bandwidth limit rule ID) pairs in
+        the same order as limits
+        """
+        limits = list(limits)
+        client = self.os_admin.async_network_client
+        policies = utils.gather([
+            client.create_qos_policy(name='test-policy',
+                                     description='test-qos-policy',
+                                     shared=True)
+            for _ in limits])
+        policy_ids = [policy['policy']['id'] for policy in policies]
+        for policy_id in policy_ids:
+            self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                            self.os_admin.network_client.delete_qos_policy,
+                            policy_id)
+        rules = utils.gather([
+            client.create_bandwidth_limit_rule(
+                policy_id=policy_id, max_kbps=max_kbps,
+                max_burst_kbps=max_burst_kbps)
+            for policy_id, (max_kbps, max_burst_kbps) in zip(policy_ids,
+                                                             limits)])
+        return [(policy_id, rule['bandwidth_limit_rule']['id'])
+                for policy_id, rule in zip(policy_ids, rules)]
+
+    def _apply_qos_policies(self, ports=None, networks=None):
+        """Associates QoS policies to many ports and networks concurrently
+
+        Associations are removed at test cleanup, before the policies are
+        deleted.
+
+        :param ports: mapping of port IDs to QoS policy IDs
+        :param networks: mapping of network IDs to QoS policy IDs
+        """
+        ports = ports or {}
+        networks = networks or {}
+        admin_client = self.os_admin.network_client
+        for port_id in ports:
+            self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                            admin_client.update_port, port_id,
+                            qos_policy_id=None)
+        for network_id in networks:
+            self.addCleanup(test_utils.call_and_ignore_notfound_exc,
+                            admin_client.update_network, network_id,
+                            qos_policy_id=None)
+        client = self.os_admin.async_network_client
+        requests = [client.update_port(port_id, qos_policy_id=policy_id)
+                    for port_id, policy_id in ports.items()]
+        requests += [client.update_network(network_id,
+                                           qos_policy_id=policy_id)
+                     for network_id, policy_id in networks.items()]
+        utils.gather(requests)
+
 
 class QoSTest(QoSTestMixin, base.BaseTempestTestCase):
     @classmethod
@@ -270,3 +548,114 @@ class QoSTest(QoSTestMixin, base.BaseTempestTestCase):
             port=self.NC_PORT, expected_bw=QoSTest.LIMIT_BYTES_SEC * 3),
             timeout=self.FILE_DOWNLOAD_TIMEOUT,
             sleep=1)
+
+    @decorators.idempotent_id('0da0bc0c-5fce-4f83-a19d-8c8d7e444e63')
+    def test_qos_many_ports(self):
+        """Verify BW limits of many ports at the same time
+
+        Every port gets its own QoS policy with a different bandwidth
+        limit. Then all servers send data to the test node at the same time
+        and the BW measured for every port is compared to its own limits.
+        The number of ports is given by qos_bandwidth_ports option.
+        """
+        self._test_basic_resources()
+        count = CONF.neutron_plugin_options.qos_bandwidth_ports
+        ports = [self.port]
+        fips = [self.fip]
+        if count > 1:
+            servers_kwargs = [{
+                'flavor_ref': CONF.compute.flavor_ref,
+                'image_ref': CONF.compute.image_ref,
+                'key_name': self.keypair['name'],
+                'networks': [{'uuid': self.network['id']}],
+                'security_groups': [
+                    {'name': self.security_groups[-1]['name']}]}
+                for _ in range(count - 1)]
+            servers = [server['server']
+                       for server in self.create_servers(servers_kwargs)]
+            self.wait_for_servers_active(servers)
+            servers_ports = self.list_servers_ports(
+                servers, network_id=self.network['id'])
+            for server in servers:
+                port = servers_ports[server['id']][0]
+                ports.append(port)
+                fips.append(self.create_floatingip(port=port))
+
+        targets = [
+            QoSTarget(port_id=port['id'],
+                      ssh_client=ssh.Client(
+                          fip['floating_ip_address'],
+                          CONF.validation.image_ssh_user,
+                          pkey=self.keypair['private_key']),
+                      host=fip['floating_ip_address'],
+                      max_kbps=constants.LIMIT_KILO_BITS_PER_SECOND * (i + 1),
+                      max_burst_kbps=constants.LIMIT_KILO_BITS_PER_SECOND * (
+                          i + 1))
+            for i, (port, fip) in enumerate(zip(ports, fips))]
+
+        # Create a QoS policy for every port and associate them
+        policies = self._create_bw_limit_policies(
+            (target.max_kbps, target.max_burst_kbps) for target in targets)
+        self._apply_qos_policies(ports=dict(
+            (target.port_id, policy_id)
+            for target, (policy_id, _) in zip(targets, policies)))
+
+        # Prepare VMs to send data
+        with futures.ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            list(executor.map(self._prepare_bw_tests,
+                              [target.ssh_client for target in targets]))
+
+        # Check that actual BW of every port is as expected
+        self._verify_bw_limits(targets)
+
+    @decorators.idempotent_id('8a1d6f3e-4b2c-4e7a-9f05-c3d81b6e2a47')
+    def test_qos_enforcement_latency(self):
+        """Measure how long QoS changes take to be enforced
+
+        While the server keeps sending data to the test node, the bandwidth
+        limit rule of the network QoS policy is updated and then a new QoS
+        policy with a lower limit is associated to the port. For both
+        changes the time elapsed until the throughput enters the band of the
+        new limit is logged together with the q_agent backend and, when
+        qos_max_enforcement_latency option is set, compared to it.
+        """
+        self._test_basic_resources()
+        ssh_client = self._create_ssh_client()
+        host = self.fip['floating_ip_address']
+        client = self.os_admin.network_client
+
+        (policy_id, rule_id), = self._create_bw_limit_policies(
+            [(constants.LIMIT_KILO_BITS_PER_SECOND,
+              constants.LIMIT_KILO_BITS_PER_SECOND)])
+        self._apply_qos_policies(networks={self.network['id']: policy_id})
+        self._prepare_bw_tests(ssh_client)
+
+        # Wait for the original limit to be enforced before changing it
+        utils.wait_until_true(lambda: self._check_bw(
+            ssh_client, host, port=self.NC_PORT),
+            timeout=self.FILE_DOWNLOAD_TIMEOUT,
+            sleep=1)
+
+        # Raise the limit of the network QoS policy rule
+        max_kbps = constants.LIMIT_KILO_BITS_PER_SECOND * 3
+        change = 'update_bandwidth_limit_rule'
+        latency = self._measure_enforcement_latency(
+            ssh_client, host,
+            lambda: client.update_bandwidth_limit_rule(
+                policy_id, rule_id, max_kbps=max_kbps,
+                max_burst_kbps=max_kbps),
+            max_kbps=max_kbps, change=change)
+        self._check_enforcement_latency(latency, change)
+
+        # Associate a port QoS policy with the original limit, that
+        # overrides the network one
+        (port_policy_id, _), = self._create_bw_limit_policies(
+            [(constants.LIMIT_KILO_BITS_PER_SECOND,
+              constants.LIMIT_KILO_BITS_PER_SECOND)])
+        change = 'port qos_policy_id'
+        latency = self._measure_enforcement_latency(
+            ssh_client, host,
+            lambda: self._apply_qos_policies(
+                ports={self.port['id']: port_policy_id}),
+            max_kbps=constants.LIMIT_KILO_BITS_PER_SECOND, change=change)
+        self._check_enforcement_latency(latency, change)
@@ -14,14 +14,12 @@
 #    under the License.
 from neutron_lib import constants
 
-from tempest.common import waiters
 from tempest.lib.common.utils import data_utils
 from tempest.lib import decorators
 
 from neutron_tempest_plugin.common import ssh
 from neutron_tempest_plugin import config
 from neutron_tempest_plugin.scenario import base
-from neutron_tempest_plugin.scenario import constants as const
 
 CONF = config.CONF
 
@@ -49,7 +47,7 @@ class NetworkSecGroupTest(base.BaseTempestTestCase):
         :param ports* (list): list of ports
         *Needs to be the same length as num_servers
         """
-        servers, fips, server_ssh_clients = ([], [], [])
+        servers_kwargs = []
         for i in range(num_servers):
             server_args = {
                 'flavor_ref': CONF.compute.flavor_ref,
@@ -60,14 +58,16 @@ class NetworkSecGroupTest(base.BaseTempestTestCase):
             }
             if ports is not None:
                 server_args['networks'][0].update({'port': ports[i]['id']})
-            servers.append(self.create_server(**server_args))
+            servers_kwargs.append(server_args)
+        servers = self.create_servers(servers_kwargs)
+        self.wait_for_servers_active(
+            [server['server'] for server in servers])
+        servers_ports = self.list_servers_ports(
+            [server['server'] for server in servers],
+            network_id=self.network['id'])
+        fips, server_ssh_clients = ([], [])
         for i, server in enumerate(servers):
-            waiters.wait_for_server_status(
-                self.os_primary.servers_client, server['server']['id'],
-                const.SERVER_STATUS_ACTIVE)
-            port = self.client.list_ports(
-                network_id=self.network['id'], device_id=server['server'][
-                    'id'])['ports'][0]
+            port = servers_ports[server['server']['id']][0]
             fips.append(self.create_floatingip(port=port))
             server_ssh_clients.append(ssh.Client(
                 fips[i]['floating_ip_address'], CONF.validation.image_ssh_user,
@@ -118,12 +118,6 @@ class NetworkSecGroupTest(base.BaseTempestTestCase):
         self.ping_ip_address(fips[0]['floating_ip_address'],
                              should_succeed=False)
 
-        # Check ICMP connectivity between VMs without specific rule for that
-        # It should work though the rule is not configured
-        self.check_remote_connectivity(
-            server_ssh_clients[0], fips[1]['fixed_ip_address'])
-
-        # Check ICMP connectivity from VM to external network
         subnets = self.os_admin.network_client.list_subnets(
             network_id=CONF.network.public_network_id)['subnets']
         ext_net_ip = None
@@ -132,7 +126,12 @@ class NetworkSecGroupTest(base.BaseTempestTestCase):
                 ext_net_ip = subnet['gateway_ip']
                 break
         self.assertTrue(ext_net_ip)
-        self.check_remote_connectivity(server_ssh_clients[0], ext_net_ip)
+
+        # Check ICMP connectivity between VMs without specific rule for that
+        # (it should work though the rule is not configured) and from VM to
+        # external network
+        self.check_connectivity_matrix(
+            server_ssh_clients[:1], [fips[1]['fixed_ip_address'], ext_net_ip])
 
     @decorators.idempotent_id('3d73ec1a-2ec6-45a9-b0f8-04a283d9d864')
     def test_protocol_number_rule(self):
@@ -288,8 +287,8 @@ class NetworkSecGroupTest(base.BaseTempestTestCase):
         server_ssh_clients, fips, servers = self.create_vm_testing_sec_grp(
             ports=ports)
         # verify ICMP reachability and ssh connectivity
+        self.ping_ip_addresses([fip['floating_ip_address'] for fip in fips])
         for fip in fips:
-            self.ping_ip_address(fip['floating_ip_address'])
             self.check_connectivity(fip['floating_ip_address'],
                                     CONF.validation.image_ssh_user,
                                     self.keypair['private_key'])
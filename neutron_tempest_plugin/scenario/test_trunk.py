@@ -22,6 +22,7 @@ from tempest.lib import decorators
 import testtools
 
 from neutron_tempest_plugin.common import ip
+from neutron_tempest_plugin.common import shell
 from neutron_tempest_plugin.common import ssh
 from neutron_tempest_plugin.common import utils
 from neutron_tempest_plugin import config
@@ -156,8 +157,8 @@ class TrunkTest(base.BaseTempestTestCase):
                           username=username,
                           pkey=self.keypair['private_key'])
 
-    def _assert_has_ssh_connectivity(self, ssh_client):
-        ssh_client.exec_command("true")
+    def _assert_has_ssh_connectivity(self, *ssh_clients):
+        shell.execute_many("true", ssh_clients)
 
     def _configure_vlan_subport(self, vm, vlan_tag, vlan_subnet):
         self.wait_for_server_active(server=vm.server)
@@ -165,8 +166,10 @@ class TrunkTest(base.BaseTempestTestCase):
         self._wait_for_port(port=vm.port)
         self._wait_for_port(port=vm.subport)
 
-        ip_command = ip.IPCommand(ssh_client=vm.ssh_client)
-        for address in ip_command.list_addresses(port=vm.port):
+        # All ip commands are executed by the same remote shell
+        ip_command = ip.IPCommand(
+            ssh_client=vm.ssh_client.get_shell_session())
+        for address in ip_command.get_address_table().list_by_port(vm.port):
             port_iface = address.device.name
             break
         else:
@@ -175,7 +178,8 @@ class TrunkTest(base.BaseTempestTestCase):
         subport_iface = ip_command.configure_vlan_subport(
             port=vm.port, subport=vm.subport, vlan_tag=vlan_tag,
             subnets=[vlan_subnet])
-        for address in ip_command.list_addresses(port=vm.subport):
+        for address in ip_command.get_address_table().list_by_port(
+                vm.subport):
             self.assertEqual(subport_iface, address.device.name)
             self.assertEqual(port_iface, address.device.parent)
             break
@@ -200,7 +204,7 @@ class TrunkTest(base.BaseTempestTestCase):
         for vm in (vm1, vm2):
             self.wait_for_server_active(server=vm.server)
             self._wait_for_trunk(vm.trunk)
-            self._assert_has_ssh_connectivity(vm.ssh_client)
+        self._assert_has_ssh_connectivity(vm1.ssh_client, vm2.ssh_client)
 
         # create a few more networks and ports for subports
         # check limit of networks per project
@@ -242,7 +246,7 @@ class TrunkTest(base.BaseTempestTestCase):
         # final connectivity check
         for vm in [vm1, vm2]:
             self._wait_for_trunk(vm.trunk)
-            self._assert_has_ssh_connectivity(vm1.ssh_client)
+        self._assert_has_ssh_connectivity(vm1.ssh_client, vm2.ssh_client)
 
     @testtools.skipUnless(CONF.neutron_plugin_options.advanced_image_ref,
                           "Advanced image is required to run this test.")
@@ -10,6 +10,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+from concurrent import futures
+import functools
 import time
 
 from oslo_serialization import jsonutils
@@ -17,6 +20,13 @@ from six.moves.urllib import parse as urlparse
 from tempest.lib.common import rest_client as service_client
 from tempest.lib import exceptions as lib_exc
 
+try:
+    # Optional faster JSON decoder, only used for (potentially big) list
+    # responses. It is not a requirement: it is used when installed.
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class NetworkClientJSON(service_client.RestClient):
     """NetworkClientJSON class
@@ -36,29 +46,53 @@ class NetworkClientJSON(service_client.RestClient):
     version = '2.0'
     uri_prefix = "v2.0"
 
+    # The following list represents resource names that do not require
+    # changing underscore to a hyphen
+    hyphen_exceptions = frozenset(["service_profiles", "availability_zones"])
+
+    # The following map is used to construct proper URI
+    # for the given neutron resource.
+    # No need to populate this map if the neutron resource
+    # doesn't have a URI prefix.
+    service_resource_prefix_map = {
+        'metering_labels': 'metering',
+        'metering_label_rules': 'metering',
+        'policies': 'qos',
+        'bandwidth_limit_rules': 'qos',
+        'minimum_bandwidth_rules': 'qos',
+        'rule_types': 'qos',
+        'logs': 'log',
+        'loggable_resources': 'log',
+    }
+
+    # map from resource name to a plural name
+    # needed only for those which can't be constructed as name + 's'
+    resource_plural_map = {
+        'security_groups': 'security_groups',
+        'security_group_rules': 'security_group_rules',
+        'quotas': 'quotas',
+        'qos_policy': 'policies',
+        'rbac_policy': 'rbac_policies',
+        'network_ip_availability': 'network_ip_availabilities',
+    }
+
+    # URIs are computed once for every resource and URI prefix and shared
+    # between all client instances
+    _uri_table = {}
+
     def get_uri(self, plural_name):
-        # get service prefix from resource name
+        try:
+            return self._uri_table[self.uri_prefix, plural_name]
+        except KeyError:
+            uri = self._uri_table[self.uri_prefix, plural_name] = (
+                self._make_uri(plural_name))
+            return uri
 
-        # The following list represents resource names that do not require
-        # changing underscore to a hyphen
-        hyphen_exceptions = ["service_profiles", "availability_zones"]
-        # The following map is used to construct proper URI
-        # for the given neutron resource.
-        # No need to populate this map if the neutron resource
-        # doesn't have a URI prefix.
-        service_resource_prefix_map = {
-            'metering_labels': 'metering',
-            'metering_label_rules': 'metering',
-            'policies': 'qos',
-            'bandwidth_limit_rules': 'qos',
-            'minimum_bandwidth_rules': 'qos',
-            'rule_types': 'qos',
-            'logs': 'log',
-            'loggable_resources': 'log',
-        }
-        service_prefix = service_resource_prefix_map.get(
+    def _make_uri(self, plural_name):
+        # get service prefix from resource name
+        service_prefix = self.service_resource_prefix_map.get(
             plural_name)
-        if plural_name not in hyphen_exceptions:
+        if plural_name not in self.hyphen_exceptions:
             plural_name = plural_name.replace("_", "-")
         if service_prefix:
             uri = '%s/%s/%s' % (self.uri_prefix, service_prefix,
@@ -75,31 +109,86 @@ class NetworkClientJSON(service_client.RestClient):
 
     def pluralize(self, resource_name):
         # get plural from map or just add 's'
-
-        # map from resource name to a plural name
-        # needed only for those which can't be constructed as name + 's'
-        resource_plural_map = {
-            'security_groups': 'security_groups',
-            'security_group_rules': 'security_group_rules',
-            'quotas': 'quotas',
-            'qos_policy': 'policies',
-            'rbac_policy': 'rbac_policies',
-            'network_ip_availability': 'network_ip_availabilities',
-        }
-        return resource_plural_map.get(resource_name, resource_name + 's')
+        return self.resource_plural_map.get(resource_name,
+                                            resource_name + 's')
 
     def get_uri_with_links(self, plural_name, uri):
         resp, body = self.get(uri)
-        result = {plural_name: self.deserialize_list(body)}
-        links = self.deserialize_links(body)
+        resources, links = self.deserialize_list_with_links(
+            body, plural_name=plural_name)
+        result = {plural_name: resources}
         self.expected_success(200, resp.status)
         return links, service_client.ResponseBody(resp, result)
 
+    def get_bare_uri(self, url):
+        """Gets the URI to be requested from an URL returned by the server
+
+        It converts URLs of links returned by the server (like next and
+        previous pagination links) to URIs relative to the service endpoint.
+        """
+        base_url = self.base_url
+        if url.startswith(base_url):
+            return url[len(base_url):]
+        # The server could be behind a proxy exposing a different endpoint
+        parsed_url = urlparse.urlsplit(url)
+        path = parsed_url.path
+        prefix_index = path.find('/' + self.uri_prefix + '/')
+        if prefix_index >= 0:
+            path = path[prefix_index:]
+        return urlparse.urlunsplit(('', '', path, parsed_url.query, ''))
+
+    def _iterator(self, plural_name):
+        def _iter(page_size=None, prefetch=False, **filters):
+            """Iterates over resources fetching them one page at a time
+
+            :param page_size: max number of resources requested with every
+            request. If None server default page size is used.
+
+            :param prefetch: when True next page is requested in background
+            while resources of current page are being consumed
+
+            :param **filters: query parameters sent with first request
+            """
+            if page_size:
+                filters['limit'] = page_size
+            uri = self.build_uri(plural_name, **filters)
+
+            def get_page(page_uri):
+                links, body = self.get_uri_with_links(plural_name, page_uri)
+                resources = body[plural_name]
+                next_url = links.get('next')
+                if resources and next_url:
+                    return resources, self.get_bare_uri(next_url)
+                else:
+                    return resources, None
+
+            executor = prefetch and futures.ThreadPoolExecutor(max_workers=1)
+            try:
+                resources, uri = get_page(uri)
+                while True:
+                    if uri is None:
+                        next_page = None
+                    elif executor:
+                        next_page = executor.submit(get_page, uri).result
+                    else:
+                        next_page = functools.partial(get_page, uri)
+                    for resource in resources:
+                        yield resource
+                    if next_page is None:
+                        break
+                    resources, uri = next_page()
+            finally:
+                if executor:
+                    executor.shutdown(wait=False)
+
+        return _iter
+
     def _lister(self, plural_name):
         def _list(**filters):
             uri = self.build_uri(plural_name, **filters)
             resp, body = self.get(uri)
-            result = {plural_name: self.deserialize_list(body)}
+            result = {plural_name: self.deserialize_list(
+                body, plural_name=plural_name)}
             self.expected_success(200, resp.status)
             return service_client.ResponseBody(resp, result)
 
@@ -162,17 +251,23 @@ class NetworkClientJSON(service_client.RestClient):
 
         return _update
 
+    method_functors = collections.OrderedDict([
+        ("list_", "_lister"),
+        ("delete_", "_deleter"),
+        ("show_", "_shower"),
+        ("create_", "_creater"),
+        ("update_", "_updater"),
+        ("iter_", "_iterator"),
+    ])
+
     def __getattr__(self, name):
-        method_prefixes = ["list_", "delete_", "show_", "create_", "update_"]
-        method_functors = [self._lister,
-                           self._deleter,
-                           self._shower,
-                           self._creater,
-                           self._updater]
-        for index, prefix in enumerate(method_prefixes):
-            prefix_len = len(prefix)
-            if name[:prefix_len] == prefix:
-                return method_functors[index](name[prefix_len:])
+        for prefix, functor_name in self.method_functors.items():
+            if name.startswith(prefix):
+                method = getattr(self, functor_name)(name[len(prefix):])
+                # Bind generated method to this client so that next time it
+                # is found without calling __getattr__ again
+                setattr(self, name, method)
+                return method
         raise AttributeError(name)
 
     # Subnetpool methods
@@ -291,28 +386,58 @@ class NetworkClientJSON(service_client.RestClient):
     def deserialize_single(self, body):
         return jsonutils.loads(body)
 
-    def deserialize_list(self, body):
-        res = jsonutils.loads(body)
+    def deserialize_list(self, body, plural_name=None):
+        return self._get_list(self.deserialize_single(body), plural_name)
+
+    def deserialize_links(self, body, plural_name=None):
+        return self._get_links(self.deserialize_single(body), plural_name)
+
+    def deserialize_list_with_links(self, body, plural_name=None):
+        """Decodes both resources list and links parsing body only once
+
+        :param body: JSON response body of a list request
+
+        :param plural_name: optional name of the resources collection, used
+        to get it without looking for it between body keys
+
+        :returns: tuple (resources, links) where links is a dict mapping link
+        relations to their href
+        """
+        if orjson is not None:
+            res = orjson.loads(body)
+        else:
+            res = self.deserialize_single(body)
+        return (self._get_list(res, plural_name),
+                self._get_links(res, plural_name))
+
+    @staticmethod
+    def _get_list(res, plural_name=None):
         # expecting response in form
         # {'resources': [ res1, res2] } => when pagination disabled
         # {'resources': [..], 'resources_links': {}} => if pagination enabled
+        if plural_name in res:
+            return res[plural_name]
         for k in res.keys():
             if k.endswith("_links"):
                 continue
             return res[k]
 
-    def deserialize_links(self, body):
-        res = jsonutils.loads(body)
+    @staticmethod
+    def _get_links(res, plural_name=None):
         # expecting response in form
         # {'resources': [ res1, res2] } => when pagination disabled
         # {'resources': [..], 'resources_links': {}} => if pagination enabled
-        for k in res.keys():
-            if k.endswith("_links"):
-                return {
-                    link['rel']: link['href']
-                    for link in res[k]
-                }
-        return {}
+        links = None
+        if plural_name is not None:
+            links = res.get(plural_name + '_links')
+        if links is None:
+            for k in res.keys():
+                if k.endswith("_links"):
+                    links = res[k]
+                    break
+            else:
+                return {}
+        return {link['rel']: link['href'] for link in links}
 
     def serialize(self, data):
         return jsonutils.dumps(data)
@@ -1002,3 +1127,52 @@ class NetworkClientJSON(service_client.RestClient):
             self.uri_prefix, resource_type, resource_id, tag)
         resp, body = self.delete(uri)
         self.expected_success(204, resp.status)
+
+
+class AsyncNetworkClient(object):
+    """Asynchronous facade of NetworkClientJSON
+
+    It exposes the same methods as the wrapped client, including dynamic
+    list_, show_, create_, update_ and delete_ methods. Instead of waiting
+    for the API response, calling a method submits the request to a bounded
+    pool of worker threads and returns a concurrent.futures.Future object.
+    Results can be collected by calling common.utils.gather function.
+    Example:
+
+        ports = utils.gather([
+            async_client.create_port(network_id=network['id'])
+            for _ in range(50)])
+
+    :param client: NetworkClientJSON instance used to perform API requests
+
+    :param max_workers: max number of requests being executed concurrently
+    """
+
+    max_workers = 10
+
+    def __init__(self, client, max_workers=None):
+        self.client = client
+        self.max_workers = max_workers or self.max_workers
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=self.max_workers)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        def submit(*args, **kwargs):
+            return self._executor.submit(attribute, *args, **kwargs)
+
+        submit.__name__ = name
+        return submit
+
+    def close(self):
+        """Waits for pending requests and stops worker threads"""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exception_type, _exception_value, _traceback):
+        self.close()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Micro-benchmark of ip command output parsers
+
+It compares the cost of parsing 'ip address list' output of a guest with
+many VLAN subports using the text parser and the JSON one. Before that it
+checks that both parsers return the same addresses for the same output.
+
+Usage: python tools/benchmark_ip_parsers.py [--subports N] [--number N]
+"""
+
+import argparse
+import json
+import timeit
+
+from neutron_tempest_plugin.common import ip
+
+
+TEXT_DEVICE = """\
+{index:d}: {name!s}: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1450 qdisc \
+noqueue state UP group default qlen 1000
+    link/ether fa:16:3e:00:{high:02x}:{low:02x} brd ff:ff:ff:ff:ff:ff
+    inet 10.{high:d}.{low:d}.5/24 brd 10.{high:d}.{low:d}.255 scope global \
+dynamic noprefixroute {label!s}
+       valid_lft 86000sec preferred_lft 86000sec
+    inet6 fe80::f816:3eff:fe00:{index:x}/64 scope link
+       valid_lft forever preferred_lft forever
+"""
+
+
+def generate_devices(subports):
+    for index in range(2, subports + 3):
+        name = 'eth0' if index == 2 else 'eth0.{:d}@eth0'.format(index)
+        yield index, name
+
+
+def generate_text_output(subports):
+    return ''.join(
+        TEXT_DEVICE.format(index=index, name=name, label=name.split('@')[0],
+                           high=index // 256, low=index % 256)
+        for index, name in generate_devices(subports))
+
+
+def generate_json_output(subports):
+    links = []
+    for index, name in generate_devices(subports):
+        high, low = index // 256, index % 256
+        name, _, parent = name.partition('@')
+        link = {
+            'ifindex': index, 'ifname': name,
+            'flags': ['BROADCAST', 'MULTICAST', 'UP', 'LOWER_UP'],
+            'mtu': 1450, 'qdisc': 'noqueue', 'operstate': 'UP',
+            'group': 'default', 'txqlen': 1000, 'link_type': 'ether',
+            'address': 'fa:16:3e:00:{:02x}:{:02x}'.format(high, low),
+            'broadcast': 'ff:ff:ff:ff:ff:ff',
+            'addr_info': [
+                {'family': 'inet',
+                 'local': '10.{:d}.{:d}.5'.format(high, low),
+                 'prefixlen': 24,
+                 'broadcast': '10.{:d}.{:d}.255'.format(high, low),
+                 'scope': 'global', 'dynamic': True, 'noprefixroute': True,
+                 'label': name, 'valid_life_time': 86000,
+                 'preferred_life_time': 86000},
+                {'family': 'inet6',
+                 'local': 'fe80::f816:3eff:fe00:{:x}'.format(index),
+                 'prefixlen': 64, 'scope': 'link',
+                 'valid_life_time': 4294967295,
+                 'preferred_life_time': 4294967295}]}
+        if parent:
+            link['link'] = parent
+        links.append(link)
+    return json.dumps(links)
+
+
+def check_parity(text_addresses, json_addresses):
+    """Fails when parsers return different addresses for the same output"""
+    assert len(text_addresses) == len(json_addresses), (
+        '{:d} addresses parsed from text output, {:d} from JSON '
+        'one'.format(len(text_addresses), len(json_addresses)))
+    for text_address, json_address in zip(text_addresses, json_addresses):
+        assert text_address == json_address, (
+            'Parsers mismatch:\n{!r}\n{!r}'.format(text_address,
+                                                  json_address))
+
+
+def run_benchmark(name, parse, output, number):
+    seconds = min(timeit.repeat(lambda: parse(output), number=number,
+                                repeat=5))
+    microseconds = seconds / number * 1e6
+    print('{:<10s} {:10.1f} us/table'.format(name, microseconds))
+    return microseconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subports', type=int, default=100,
+                        help='number of VLAN subports of the guest')
+    parser.add_argument('--number', type=int, default=100,
+                        help='number of iterations for every run')
+    args = parser.parse_args()
+
+    text_output = generate_text_output(args.subports)
+    json_output = generate_json_output(args.subports)
+    check_parity(ip.parse_addresses(text_output),
+                 ip.parse_addresses_json(json_output))
+
+    text = run_benchmark('text', ip.parse_addresses, text_output,
+                         args.number)
+    parsed = run_benchmark('json', ip.parse_addresses_json, json_output,
+                           args.number)
+    print('speedup    {:10.1f}x'.format(text / parsed))
+
+
+if __name__ == '__main__':
+    main()
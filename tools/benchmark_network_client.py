@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Micro-benchmark of NetworkClientJSON method dispatch
+
+It compares the cost of resolving generated client methods (list_*, show_*,
+create_*, ...) and their URIs with a copy of the implementation that
+rebuilt lookup tables on every call (legacy), with the memoized dispatch
+and URI table cleared before every resolution (uncached) and with them
+filled by previous resolutions (cached).
+
+Usage: python tools/benchmark_network_client.py [--number N]
+"""
+
+import argparse
+import timeit
+
+from neutron_tempest_plugin.services.network.json import network_client
+
+
+# Generated methods and the plural name of their resources
+METHODS = [('list_networks', 'networks'),
+           ('show_port', 'ports'),
+           ('create_qos_policy', 'policies'),
+           ('update_security_group', 'security_groups'),
+           ('delete_metering_label', 'metering_labels'),
+           ('iter_subnets', 'subnets')]
+
+
+class LegacyNetworkClientJSON(network_client.NetworkClientJSON):
+    """Method dispatch and URI resolution as they were before memoization"""
+
+    def get_uri(self, plural_name):
+        # get service prefix from resource name
+
+        # The following list represents resource names that do not require
+        # changing underscore to a hyphen
+        hyphen_exceptions = ["service_profiles", "availability_zones"]
+        # The following map is used to construct proper URI
+        # for the given neutron resource.
+        # No need to populate this map if the neutron resource
+        # doesn't have a URI prefix.
+        service_resource_prefix_map = {
+            'metering_labels': 'metering',
+            'metering_label_rules': 'metering',
+            'policies': 'qos',
+            'bandwidth_limit_rules': 'qos',
+            'minimum_bandwidth_rules': 'qos',
+            'rule_types': 'qos',
+            'logs': 'log',
+            'loggable_resources': 'log',
+        }
+        service_prefix = service_resource_prefix_map.get(
+            plural_name)
+        if plural_name not in hyphen_exceptions:
+            plural_name = plural_name.replace("_", "-")
+        if service_prefix:
+            uri = '%s/%s/%s' % (self.uri_prefix, service_prefix,
+                                plural_name)
+        else:
+            uri = '%s/%s' % (self.uri_prefix, plural_name)
+        return uri
+
+    def pluralize(self, resource_name):
+        # get plural from map or just add 's'
+
+        # map from resource name to a plural name
+        # needed only for those which can't be constructed as name + 's'
+        resource_plural_map = {
+            'security_groups': 'security_groups',
+            'security_group_rules': 'security_group_rules',
+            'quotas': 'quotas',
+            'qos_policy': 'policies',
+            'rbac_policy': 'rbac_policies',
+            'network_ip_availability': 'network_ip_availabilities',
+        }
+        return resource_plural_map.get(resource_name, resource_name + 's')
+
+    def __getattr__(self, name):
+        method_prefixes = ["list_", "delete_", "show_", "create_", "update_",
+                           "iter_"]
+        method_functors = [self._lister,
+                           self._deleter,
+                           self._shower,
+                           self._creater,
+                           self._updater,
+                           self._iterator]
+        for index, prefix in enumerate(method_prefixes):
+            prefix_len = len(prefix)
+            if name[:prefix_len] == prefix:
+                return method_functors[index](name[prefix_len:])
+        raise AttributeError(name)
+
+
+def create_client(client_class=network_client.NetworkClientJSON):
+    return client_class(
+        auth_provider=None, service='network', region='RegionOne')
+
+
+def resolve(client):
+    for name, plural_name in METHODS:
+        getattr(client, name)
+        client.get_uri(plural_name)
+
+
+def resolve_uncached(client):
+    # Forget methods bound by __getattr__ and computed URIs
+    for name, _ in METHODS:
+        client.__dict__.pop(name, None)
+    client._uri_table.clear()
+    resolve(client)
+
+
+def run_benchmark(name, function, client, number):
+    seconds = min(timeit.repeat(lambda: function(client), number=number,
+                                repeat=5))
+    nanoseconds = seconds / (number * len(METHODS)) * 1e9
+    print('{:<10s} {:10.1f} ns/method'.format(name, nanoseconds))
+    return nanoseconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=10000,
+                        help='number of iterations for every run')
+    args = parser.parse_args()
+
+    legacy = run_benchmark('legacy', resolve,
+                           create_client(LegacyNetworkClientJSON),
+                           args.number)
+    uncached = run_benchmark('uncached', resolve_uncached, create_client(),
+                             args.number)
+    cached = run_benchmark('cached', resolve, create_client(), args.number)
+    print('speedup    {:10.1f}x (cached vs legacy), {:.1f}x (cached vs '
+          'uncached)'.format(legacy / cached, uncached / cached))
+
+
+if __name__ == '__main__':
+    main()